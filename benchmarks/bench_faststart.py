@@ -0,0 +1,85 @@
+# Compares the cost of producing fast-start mp4s with the current (moov at the end) output:
+#   plain     - the current -c copy command, moov at the end
+#   movflags  - ffmpeg -movflags +faststart: writes the file, then shifts all data to insert moov
+#   reserve   - -moov_size sized from the playlist: moov written into reserved room, one pass
+#   relocate  - plain, then mp4_faststart.relocate_moov into a new file on the same filesystem
+# Run it on a large lecture, with the output folder on the disk you care about:
+#   python benchmarks/bench_faststart.py input_videos/some_lecture/index.m3u8 /tmp/bench --runs 3
+# Bytes written come from /proc/self/io, which includes the reaped ffmpeg children (Linux only).
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from m3u8_playlist import validate_playlist # noqa: E402
+from merge_core import build_ffmpeg_command, find_ffmpeg, first_segment_layout # noqa: E402
+from mp4_faststart import relocate_moov, reserved_moov_size # noqa: E402
+from mp4_probe import probe_mp4 # noqa: E402
+
+MODES = ("plain", "movflags", "reserve", "relocate")
+
+
+def written_bytes():
+    # Bytes this process and its reaped children caused to be written to storage
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(fields['write_bytes']) - int(fields['cancelled_write_bytes'])
+
+
+def run_mode(mode, ffmpeg_path, m3u8_path, output_dir, moov_size):
+    output_path = os.path.join(output_dir, f"{mode}.mp4")
+    for path in (output_path, output_path + ".tmp"):
+        if os.path.exists(path):
+            os.remove(path)
+    command = build_ffmpeg_command(ffmpeg_path, m3u8_path, output_path, overwrite=True,
+                                   moov_size=moov_size if mode == "reserve" else None)
+    if mode == "movflags":
+        command[-1:-1] = ['-movflags', '+faststart']
+    os.sync()
+    started_bytes = written_bytes()
+    started = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    if mode == "relocate":
+        if relocate_moov(output_path, output_path + ".tmp"):
+            os.replace(output_path + ".tmp", output_path)
+    os.sync() # Count the writeback in the elapsed time too
+    elapsed = time.perf_counter() - started
+    finished_bytes = written_bytes()
+    written = finished_bytes - started_bytes if started_bytes is not None else None
+    return elapsed, written, os.path.getsize(output_path), probe_mp4(output_path).is_fast_start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快速启动 (moov前置) 输出的开销测量")
+    parser.add_argument("m3u8", help="用于测试的 m3u8 播放列表 (建议使用较长的课程视频)")
+    parser.add_argument("output_dir", help="存放测试输出的文件夹，测试结束后输出文件会被删除")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--ffmpeg", default=None)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    ffmpeg_path = args.ffmpeg or find_ffmpeg(REPO_DIR)
+    os.makedirs(args.output_dir, exist_ok=True)
+    report = validate_playlist(args.m3u8)
+    moov_size = reserved_moov_size(report.total_duration, first_segment_layout(report.playlist))
+
+    print(f"{'mode':<10} {'median s':>10} {'written MB':>12} {'output MB':>10} fast-start")
+    for mode in args.modes:
+        samples = [run_mode(mode, ffmpeg_path, args.m3u8, args.output_dir, moov_size) for _ in range(args.runs)]
+        elapsed = statistics.median(s[0] for s in samples)
+        written = samples[-1][1]
+        written_text = f"{written / 1e6:.1f}" if written is not None else "n/a"
+        print(f"{mode:<10} {elapsed:>10.2f} {written_text:>12} {samples[-1][2] / 1e6:>10.1f} {samples[-1][3]}")
+        os.remove(os.path.join(args.output_dir, f"{mode}.mp4"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Measures how long it takes for the main window to appear, and what the heavy
+# batch-rename dependencies would add if they were imported eagerly at startup.
+# Every sample runs in a fresh interpreter so nothing is cached between runs:
+#   python benchmarks/bench_startup.py --runs 5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("cv2", "PIL.ImageTk", "requests", "bs4")
+
+# Prints "<seconds until the main window is drawn> <comma separated heavy modules loaded>"
+MAIN_WINDOW_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import tkinter as tk
+import video_merger_app
+try:
+    root = tk.Tk()
+except tk.TclError:
+    root = None # No display: only the import is measured
+if root is not None:
+    app = video_merger_app.VideoMergerApp(root)
+    root.update()
+elapsed = time.perf_counter() - started
+if root is not None:
+    root.destroy()
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ",".join(loaded), "window" if root is not None else "import-only")
+"""
+
+# Prints the seconds spent importing one module in a fresh interpreter
+IMPORT_SNIPPET = """
+import importlib, time
+started = time.perf_counter()
+importlib.import_module({module!r})
+print(time.perf_counter() - started)
+"""
+
+
+def run_snippet(code):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=REPO_DIR)
+    if result.returncode != 0:
+        return None
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主窗口启动耗时测量")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = []
+    mode = loaded = None
+    for _ in range(args.runs):
+        output = run_snippet(MAIN_WINDOW_SNIPPET.format(repo=REPO_DIR, heavy=HEAVY_MODULES))
+        if output is None:
+            print("无法启动 video_merger_app，请检查依赖。", file=sys.stderr)
+            return 1
+        samples.append(float(output[0]))
+        loaded, mode = (output[1], output[2]) if len(output) == 3 else ("", output[1])
+    print(f"main window ({mode}): median {statistics.median(samples) * 1000:.1f} ms over {args.runs} runs")
+    print(f"heavy modules loaded at startup: {loaded or 'none'}")
+
+    eager_total = 0.0
+    for module in HEAVY_MODULES:
+        times = [run_snippet(IMPORT_SNIPPET.format(module=module)) for _ in range(args.runs)]
+        if any(t is None for t in times):
+            print(f"  import {module}: not installed")
+            continue
+        median = statistics.median(float(t[0]) for t in times)
+        eager_total += median
+        print(f"  import {module}: median {median * 1000:.1f} ms")
+    print(f"startup cost avoided by lazy imports: ~{eager_total * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Keyframe contact sheet for identifying a lecture without watching it from the start.
+# The video is sampled at N evenly spaced positions (10%, 30%, ... for N=5). For each one
+# ffmpeg seeks to the nearest keyframe before the position (-noaccurate_seek) and decodes
+# only keyframes (-skip_frame nokey), so a tile costs one decoded frame however long the
+# GOP is, and a 90-minute lecture costs N frames instead of a linear decode from the start.
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from merge_core import parse_ffmpeg_duration, popen_platform_kwargs, run_ffmpeg
+from mp4_probe import probe_mp4
+
+SHEET_TILES = 6
+SHEET_COLUMNS = 3
+TILE_SIZE = (256, 144)
+MAX_PARALLEL_EXTRACTS = 3 # Each one is a short ffmpeg process decoding a single frame
+_MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+
+def scrub_positions(duration, count):
+    # Centres of count equal slices: 10%, 30%, 50%, 70%, 90% for count=5
+    return [duration * (index + 0.5) / count for index in range(count)]
+
+
+def probe_duration(ffmpeg_path, video_path):
+    # mp4s are read from their box headers; anything else from ffmpeg's input header
+    if video_path.lower().endswith(_MP4_EXTENSIONS):
+        try:
+            duration = probe_mp4(video_path).duration
+            if duration:
+                return duration
+        except (OSError, ValueError):
+            pass
+    _, stderr = run_ffmpeg([ffmpeg_path, '-hide_banner', '-i', video_path]) # Exits 1 without an output; the header is enough
+    return parse_ffmpeg_duration(stderr)
+
+
+def build_keyframe_command(ffmpeg_path, video_path, seconds, tile_size=TILE_SIZE):
+    width, height = tile_size
+    return [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+        '-noaccurate_seek', '-ss', f"{seconds:.3f}",
+        '-skip_frame', 'nokey',
+        '-i', video_path,
+        '-an', '-frames:v', '1',
+        '-vf', f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+        '-f', 'image2pipe', '-c:v', 'png', '-'
+    ]
+
+
+def extract_keyframe(ffmpeg_path, video_path, seconds, tile_size=TILE_SIZE):
+    # PNG bytes of the keyframe at or before seconds, None when ffmpeg produced nothing
+    result = subprocess.run(build_keyframe_command(ffmpeg_path, video_path, seconds, tile_size),
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, **popen_platform_kwargs())
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def build_contact_sheet(ffmpeg_path, video_path, on_tile, count=SHEET_TILES, tile_size=TILE_SIZE, stop_event=None):
+    # Calls on_tile(index, seconds, png_bytes_or_None) from worker threads as tiles finish,
+    # in any order. Returns the duration, or None when it could not be determined (nothing
+    # is extracted then). FileNotFoundError propagates when ffmpeg is missing.
+    duration = probe_duration(ffmpeg_path, video_path)
+    if not duration:
+        return None
+
+    def extract(index, seconds):
+        if stop_event is not None and stop_event.is_set():
+            return
+        on_tile(index, seconds, extract_keyframe(ffmpeg_path, video_path, seconds, tile_size))
+
+    with ThreadPoolExecutor(max_workers=min(count, MAX_PARALLEL_EXTRACTS)) as executor:
+        futures = [executor.submit(extract, index, seconds) for index, seconds in enumerate(scrub_positions(duration, count))]
+        for future in futures:
+            future.result()
+    return duration
@@ -0,0 +1,58 @@
+# Classification of failed conversions, used to decide whether and how to retry.
+# ffmpeg only exits with 1 for almost everything, so the kind of failure is read from the
+# tail of its stderr (or from the errno of a failed copy in the ts-concat engine).
+import errno
+import re
+
+FAILURE_MISSING_SEGMENT = "missing-segment" # A segment or key could not be opened: permanent
+FAILURE_DISK_FULL = "disk-full" # Permanent until space is freed
+FAILURE_ACCESS_DENIED = "access-denied" # No permission, read-only file system or a directory in the way: permanent
+FAILURE_CODEC = "codec" # Bitstream/timestamp problem: retried with fallback command variants
+FAILURE_TRANSIENT_IO = "transient-io" # Retried with backoff
+FAILURE_CORRUPT_OUTPUT = "corrupt-output" # Output failed verification: retried with backoff
+FAILURE_UNKNOWN = "unknown"
+
+RETRYABLE_FAILURES = (FAILURE_CODEC, FAILURE_TRANSIENT_IO, FAILURE_CORRUPT_OUTPUT)
+
+# Status recorded in the history when the last attempt failed this way
+FAILURE_STATUSES = {
+    FAILURE_MISSING_SEGMENT: "失败: 分段缺失",
+    FAILURE_DISK_FULL: "失败: 磁盘空间不足",
+    FAILURE_ACCESS_DENIED: "失败: 无访问权限",
+    FAILURE_CODEC: "失败: 码流错误",
+    FAILURE_TRANSIENT_IO: "失败: 读写错误",
+}
+
+# Checked in order; disk full first because ffmpeg reports it as an I/O error as well
+_STDERR_PATTERNS = [
+    (FAILURE_DISK_FULL, re.compile(r"No space left on device|Disk quota exceeded", re.I)),
+    (FAILURE_ACCESS_DENIED, re.compile(r"Permission denied|Operation not permitted|Read-only file system|Is a directory", re.I)),
+    (FAILURE_MISSING_SEGMENT, re.compile(
+        r"No such file or directory|Failed to open segment|Unable to open key file|Server returned 40[34]|HTTP error 40[34]", re.I)),
+    (FAILURE_TRANSIENT_IO, re.compile(
+        r"Input/output error|Connection (?:reset|refused|timed out)|Operation timed out|Resource temporarily unavailable"
+        r"|Server returned 5\d\d|HTTP error 5\d\d|Broken pipe", re.I)),
+    (FAILURE_CODEC, re.compile(
+        r"aac_adtstoasc|Malformed AAC bitstream|Error parsing ADTS|non[- ]monoton\w* (?:increasing )?dts|timestamps are unset"
+        r"|Invalid data found when processing input|Could not write header|Error applying bitstream filters", re.I)),
+]
+
+_DISK_FULL_ERRNOS = {errno.ENOSPC, errno.EDQUOT} if hasattr(errno, 'EDQUOT') else {errno.ENOSPC}
+_ACCESS_DENIED_ERRNOS = {errno.EACCES, errno.EPERM, errno.EROFS, errno.EISDIR}
+
+
+def classify_stderr(stderr):
+    for failure, pattern in _STDERR_PATTERNS:
+        if pattern.search(stderr):
+            return failure
+    return FAILURE_UNKNOWN
+
+
+def classify_os_error(error):
+    if error.errno in _DISK_FULL_ERRNOS:
+        return FAILURE_DISK_FULL
+    if error.errno in _ACCESS_DENIED_ERRNOS:
+        return FAILURE_ACCESS_DENIED
+    if error.errno == errno.ENOENT:
+        return FAILURE_MISSING_SEGMENT
+    return FAILURE_TRANSIENT_IO
@@ -0,0 +1,235 @@
+# Watch mode: notices course subfolders that land in the input folder while the program runs
+# and hands each one to the conversion pipeline once its download has finished.
+# A subfolder becomes a candidate when it is new, or when its directory mtime changed since it
+# was last handed over (files were added, removed or renamed in it). A candidate is ready once
+# its playlists and the sizes of their local segments have stayed the same for settle_seconds
+# and every segment is present; a candidate that stays incomplete but unchanged for
+# INCOMPLETE_TIMEOUT_SECONDS is handed over anyway, so the conversion reports what is missing.
+# On Linux inotify wakes the watcher as soon as something changes; the folders are still
+# rescanned every poll interval, as inotify does not see changes made by other machines on a
+# network share. Elsewhere the watcher only polls.
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+from m3u8_playlist import folder_fingerprint, validate_playlist
+
+SETTLE_SECONDS = 30.0 # Download pipelines pause between segments; shorter waits catch folders half-written
+POLL_SECONDS = 5.0
+INOTIFY_POLL_SECONDS = 30.0 # Safety net for changes inotify cannot see
+MIN_SCAN_INTERVAL_SECONDS = 1.0 # Busy downloads wake inotify many times a second
+INCOMPLETE_TIMEOUT_SECONDS = 600.0
+
+# inotify(7)
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_ONLYDIR = 0x01000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+
+
+def folder_signature(folder_path):
+    # (signature, complete) of a subfolder's playlists and local segments; signature is None
+    # while there is no playlist. Stats every local segment, so only pending folders are checked.
+    try:
+        m3u8_paths = sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".m3u8"))
+    except OSError:
+        return None, False
+    if not m3u8_paths:
+        return None, False
+    sizes = []
+    complete = True
+    for path in m3u8_paths:
+        try:
+            report = validate_playlist(path)
+        except OSError:
+            return None, False # Deleted or replaced while looking at it
+        sizes.append((report.estimated_size, len(report.missing_segments), len(report.empty_segments)))
+        if report.missing_segments or report.empty_segments or report.missing_keys or not report.playlist.segments:
+            complete = False
+    return (folder_fingerprint(m3u8_paths), tuple(sizes)), complete
+
+
+class PollWaiter:
+    poll_seconds = POLL_SECONDS
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+
+    def watch(self, path):
+        pass
+
+    def unwatch(self, path):
+        pass
+
+    def wait(self, timeout):
+        self.stop_event.wait(timeout)
+
+    def close(self):
+        pass
+
+
+class InotifyWaiter:
+    # Only used as a wake-up: which file changed is worked out by rescanning
+    poll_seconds = INOTIFY_POLL_SECONDS
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {} # path -> watch descriptor
+
+    def watch(self, path):
+        if path in self.watches:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd >= 0: # Out of watches (fs.inotify.max_user_watches): the poll still covers the folder
+            self.watches[path] = wd
+
+    def unwatch(self, path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.libc.inotify_rm_watch(self.fd, wd) # Fails harmlessly when the folder is already gone
+
+    def wait(self, timeout):
+        # Returns after timeout, on a change, or soon after stop_event is set
+        deadline = time.monotonic() + timeout
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            readable, _, _ = select.select([self.fd], [], [], min(remaining, 0.5))
+            if readable:
+                self._drain()
+                return
+
+    def _drain(self):
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    return
+            except BlockingIOError:
+                return
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_waiter(stop_event, use_inotify=True):
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyWaiter(stop_event)
+        except (OSError, AttributeError): # No libc inotify (e.g. musl without it, or a sandbox)
+            pass
+    return PollWaiter(stop_event)
+
+
+class _FolderState:
+    def __init__(self, path):
+        self.path = path
+        self.handed_mtime_ns = None # Directory mtime when last handed over
+        self.signature = None
+        self.stable_since = None
+        self.busy = False # Handed over and not finished yet
+
+
+class FolderWatcher:
+    # on_ready(folder_path) is called on the watcher's thread for each folder that is ready;
+    # the caller reports back with folder_finished(folder_path) once it has been converted.
+    def __init__(self, input_folder, on_ready, stop_event, settle_seconds=SETTLE_SECONDS, poll_seconds=None, use_inotify=True):
+        self.input_folder = input_folder
+        self.on_ready = on_ready
+        self.stop_event = stop_event
+        self.settle_seconds = settle_seconds
+        self.waiter = make_waiter(stop_event, use_inotify)
+        self.poll_seconds = poll_seconds or self.waiter.poll_seconds
+        self.folders = {} # name -> _FolderState
+        self.pending = set() # Names whose contents are being watched until they settle
+
+    @property
+    def uses_inotify(self):
+        return isinstance(self.waiter, InotifyWaiter)
+
+    def run(self):
+        # Blocks until stop_event is set
+        self.waiter.watch(self.input_folder)
+        try:
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                self.scan()
+                self.waiter.wait(self._next_check_in())
+                # Coalesce the flood of events of an active download into one scan a second
+                self.stop_event.wait(max(0.0, MIN_SCAN_INTERVAL_SECONDS - (time.monotonic() - started)))
+        finally:
+            self.waiter.close()
+
+    def _next_check_in(self):
+        # Seconds until the next scan is due: the poll interval, or sooner when a pending
+        # folder will have settled by then
+        timeout = self.poll_seconds
+        now = time.monotonic()
+        for name in self.pending:
+            stable_since = self.folders[name].stable_since
+            if stable_since is not None:
+                timeout = min(timeout, stable_since + self.settle_seconds - now)
+        return max(timeout, 0.0)
+
+    def scan(self):
+        now = time.monotonic()
+        try:
+            entries = [entry for entry in os.scandir(self.input_folder) if entry.is_dir()]
+        except OSError:
+            return # Input folder briefly unavailable (network share); try again next time
+        seen = set()
+        for entry in sorted(entries, key=lambda e: e.name):
+            seen.add(entry.name)
+            try:
+                mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            state = self.folders.get(entry.name)
+            if state is None:
+                state = self.folders[entry.name] = _FolderState(entry.path)
+                self.waiter.watch(entry.path)
+            if not state.busy and entry.name not in self.pending and mtime_ns != state.handed_mtime_ns:
+                self.pending.add(entry.name)
+                state.signature = None
+        for name in set(self.folders) - seen: # Deleted or moved away
+            self.waiter.unwatch(self.folders.pop(name).path)
+            self.pending.discard(name)
+
+        for name in sorted(self.pending):
+            state = self.folders[name]
+            signature, complete = folder_signature(state.path)
+            if signature is None: # No playlist (yet)
+                state.signature = state.stable_since = None
+                continue
+            if signature != state.signature:
+                state.signature = signature
+                state.stable_since = now
+                continue
+            settled_for = now - state.stable_since
+            if settled_for >= self.settle_seconds and (complete or settled_for >= INCOMPLETE_TIMEOUT_SECONDS):
+                self.pending.discard(name)
+                state.busy = True
+                try:
+                    state.handed_mtime_ns = os.stat(state.path).st_mtime_ns
+                except OSError:
+                    state.busy = False
+                    continue
+                self.on_ready(state.path)
+
+    def folder_finished(self, folder_path):
+        # Called from a conversion worker: a single attribute store, picked up by the next scan
+        state = self.folders.get(os.path.basename(folder_path))
+        if state is not None:
+            state.busy = False
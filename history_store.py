@@ -0,0 +1,156 @@
+# Conversion history kept as an append-only JSON-lines journal.
+# Each log call appends a single line, so the cost of recording a result does not grow
+# with the size of the history. Entries are stored oldest first and returned newest first.
+import json
+import os
+import threading
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class HistoryStore:
+    def __init__(self, journal_path, legacy_json_path=None):
+        self.journal_path = journal_path
+        self.legacy_json_path = legacy_json_path
+        self._lock = threading.Lock()
+        self.migrate_legacy()
+        self._truncate_torn_tail()
+
+    def migrate_legacy(self):
+        # One-time import of the old conversion_history.json (a newest-first JSON list).
+        # The old file is renamed afterwards so clearing the journal cannot resurrect it.
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        if os.path.exists(self.journal_path):
+            return
+        with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+            legacy_entries = json.load(f)
+        self._rewrite(reversed(legacy_entries))
+        os.replace(self.legacy_json_path, self.legacy_json_path + ".bak")
+
+    def _truncate_torn_tail(self):
+        # A crash mid-append can leave a final line without its newline; the next append
+        # would be glued onto it, so cut the journal back to the last complete line.
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            pos = size
+            while pos > 0:
+                read_size = min(READ_BLOCK_SIZE, pos)
+                f.seek(pos - read_size)
+                newline = f.read(read_size).rfind(b'\n')
+                if newline != -1:
+                    pos = pos - read_size + newline + 1
+                    break
+                pos -= read_size
+            if pos != size:
+                f.truncate(pos)
+
+    def append(self, entry):
+        # Returns the (start, end) byte offsets of the new line for use with read_after/read_before
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries):
+        # One open and one write for a batch of entries; returns their (start, end) offsets
+        lines = [(json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8') for entry in entries]
+        offsets = []
+        with self._lock:
+            with open(self.journal_path, 'ab') as f:
+                start = f.tell()
+                f.write(b''.join(lines))
+        for line in lines:
+            offsets.append((start, start + len(line)))
+            start += len(line)
+        return offsets
+
+    def read_before(self, end_offset=None, limit=200):
+        # Newest first: up to `limit` (start, end, entry) tuples for the lines that end at or
+        # before end_offset (None = end of the journal). Only the tail of the file is read,
+        # so paging through recent history does not depend on how long the journal is.
+        results = []
+        with self._lock:
+            if not os.path.exists(self.journal_path):
+                return results
+            with open(self.journal_path, 'rb') as f:
+                if end_offset is None:
+                    end_offset = f.seek(0, os.SEEK_END)
+                buf_start = end_offset
+                tail = b'' # bytes [buf_start, buf_start + len(tail)) not consumed yet
+                while len(results) < limit and (tail or buf_start > 0):
+                    if buf_start > 0:
+                        read_size = min(READ_BLOCK_SIZE, buf_start)
+                        buf_start -= read_size
+                        f.seek(buf_start)
+                        tail = f.read(read_size) + tail
+                    while tail and len(results) < limit:
+                        newline = tail.rfind(b'\n', 0, len(tail) - 1) # end of the previous line
+                        if newline == -1 and buf_start > 0:
+                            break # Need another block to see the start of this line
+                        line = tail[newline + 1:]
+                        start = buf_start + newline + 1
+                        tail = tail[:newline + 1]
+                        entry = self._parse_line(line)
+                        if entry is not None:
+                            results.append((start, start + len(line), entry))
+        return results
+
+    def read_after(self, start_offset, limit=200):
+        # Oldest first: up to `limit` (start, end, entry) tuples for the lines from start_offset on
+        results = []
+        with self._lock:
+            if not os.path.exists(self.journal_path):
+                return results
+            with open(self.journal_path, 'rb') as f:
+                f.seek(start_offset)
+                while len(results) < limit:
+                    start = f.tell()
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        break # End of journal, or a line still being written
+                    entry = self._parse_line(line)
+                    if entry is not None:
+                        results.append((start, start + len(line), entry))
+        return results
+
+    @staticmethod
+    def _parse_line(line):
+        if not line.strip():
+            return None
+        try:
+            return json.loads(line.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None # Torn line from a crash mid-append
+
+    def load(self):
+        # Newest first. Lines torn by a crash mid-write are skipped and compacted away.
+        if not os.path.exists(self.journal_path):
+            return []
+        entries = []
+        malformed = 0
+        with self._lock:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        malformed += 1
+            if malformed:
+                self._rewrite(entries)
+        entries.reverse()
+        return entries
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def _rewrite(self, entries_oldest_first):
+        # Compaction: write a clean journal next to the old one and swap it in atomically
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries_oldest_first:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.journal_path)
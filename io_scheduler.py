@@ -0,0 +1,165 @@
+# Device-aware ordering of conversion jobs for run_batch.
+# A -c copy remux is bound by the disks it reads and writes, not by the CPU. Several jobs
+# reading and writing the same spinning disk or network share make the heads (or the link)
+# thrash, while jobs on separate SSDs can all run at once. Every job is therefore tied to
+# the devices (os.stat().st_dev) of its source folder and of the output folder, and only
+# starts when each of them has a free slot. Free space on the output device is checked
+# against the playlist's estimated size before ffmpeg starts.
+import os
+import shutil
+import threading
+
+DEVICE_LIMIT_ROTATIONAL = 1 # One sequential stream keeps a spinning disk at full speed
+DEVICE_LIMIT_NETWORK = 2 # Hides some of the latency of a share without flooding the link
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'fuse.sshfs', 'fuse.rclone', 'afs', 'ceph', 'glusterfs')
+
+# Kept free on the output device on top of the estimated output size: the mp4 index,
+# the history and manifest journals, and whatever else writes to the disk meanwhile.
+FREE_SPACE_MARGIN_BYTES = 64 * 1024 * 1024
+_WAIT_SECONDS = 0.5 # Wake-up interval of idle workers, so a cancelled batch drains promptly
+
+
+def device_of(path):
+    # st_dev of path, or of its nearest existing parent (the output folder may not exist yet)
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def _mount_of(path):
+    # (fstype, "major:minor") of the mount containing path, from /proc/self/mountinfo; None elsewhere
+    try:
+        with open('/proc/self/mountinfo', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best = None
+    for line in lines:
+        fields, _, rest = line.partition(' - ')
+        fields = fields.split()
+        mount_point = fields[4].replace('\\040', ' ')
+        inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+        if inside and (best is None or len(mount_point) >= len(best[0])):
+            best = (mount_point, rest.split()[0], fields[2])
+    return best[1:] if best else None
+
+
+def _is_rotational(major_minor):
+    # /sys/dev/block/M:m is the partition or the disk; only the disk has queue/rotational
+    block_dir = os.path.realpath(os.path.join('/sys/dev/block', major_minor))
+    for candidate in (block_dir, os.path.dirname(block_dir)):
+        try:
+            with open(os.path.join(candidate, 'queue', 'rotational')) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+def detect_device_limit(path):
+    # Concurrent jobs a device should carry, or None when nothing is known about it (SSDs,
+    # and anything that cannot be inspected, e.g. local disks on Windows).
+    if os.name == 'nt':
+        return DEVICE_LIMIT_NETWORK if os.path.abspath(path).startswith('\\\\') else None # UNC path
+    mount = _mount_of(path)
+    if mount is None:
+        return None
+    fstype, major_minor = mount
+    if fstype in NETWORK_FILESYSTEMS:
+        return DEVICE_LIMIT_NETWORK
+    if _is_rotational(major_minor):
+        return DEVICE_LIMIT_ROTATIONAL
+    return None
+
+
+class IoScheduler:
+    # Hands jobs to the run_batch workers. A job waits while one of its devices already
+    # runs as many jobs as its limit allows; later jobs on other devices go ahead of it.
+    # per_device overrides the detected limit of every device (None = detect).
+    def __init__(self, per_device=None):
+        self.per_device = per_device
+        self.condition = threading.Condition()
+        self.limits = {} # st_dev -> limit, None for unlimited
+        self.running = {} # st_dev -> running job count
+        self.job_devices = {} # job -> set of st_dev it reads from or writes to
+        self.reservations = {} # st_dev -> {part_path: estimated bytes} of conversions in progress
+
+    def plan(self, jobs):
+        # stat()s every source folder once, on the batch thread before the workers start
+        folder_devices = {}
+        for job in jobs:
+            devices = set()
+            for folder in (job.subfolder_path, job.output_folder):
+                if folder not in folder_devices:
+                    folder_devices[folder] = device_of(folder)
+                    device = folder_devices[folder]
+                    if device not in self.limits:
+                        self.limits[device] = self.per_device or detect_device_limit(folder)
+                devices.add(folder_devices[folder])
+            self.job_devices[job] = devices
+
+    def device_summary(self):
+        # {st_dev: limit} of the devices with a cap, for status messages and the CLI summary
+        return {device: limit for device, limit in self.limits.items() if limit}
+
+    def _has_slot(self, job):
+        return all(not self.limits.get(device) or self.running.get(device, 0) < self.limits[device]
+                   for device in self.job_devices.get(job, ()))
+
+    def next_job(self, pending, cancel_event):
+        # Removes and returns the first pending job whose devices all have a free slot,
+        # waiting for a running job to finish if there is none. None when nothing is left.
+        with self.condition:
+            while pending and not cancel_event.is_set():
+                for index, job in enumerate(pending):
+                    if self._has_slot(job):
+                        del pending[index]
+                        for device in self.job_devices.get(job, ()):
+                            self.running[device] = self.running.get(device, 0) + 1
+                        return job
+                self.condition.wait(_WAIT_SECONDS)
+            return None
+
+    def job_finished(self, job):
+        with self.condition:
+            for device in self.job_devices.pop(job, ()): # Watch mode plans jobs for as long as it runs
+                self.running[device] -= 1
+            self.condition.notify_all()
+
+    def reserve_space(self, output_path, part_path, estimated_size):
+        # Claims estimated_size bytes on the output device for part_path. Returns None when
+        # they fit next to what running conversions still have to write, otherwise the
+        # (needed, available) byte counts. Space that running conversions have already
+        # written is no longer free, so only the rest of their estimate is subtracted.
+        try:
+            device = device_of(output_path)
+            free = shutil.disk_usage(os.path.dirname(os.path.abspath(output_path))).free
+        except OSError:
+            return None # Cannot tell; ffmpeg reports a full disk itself
+        with self.condition:
+            reserved = self.reservations.setdefault(device, {})
+            pending_writes = sum(max(0, size - _file_size(path)) for path, size in reserved.items())
+            available = free - pending_writes - FREE_SPACE_MARGIN_BYTES
+            if estimated_size > available:
+                return estimated_size, max(0, available)
+            reserved[part_path] = estimated_size
+            return None
+
+    def release_space(self, part_path):
+        with self.condition:
+            for reserved in self.reservations.values():
+                reserved.pop(part_path, None)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
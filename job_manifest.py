@@ -0,0 +1,138 @@
+# Persistent per-batch job manifest so an interrupted batch can be resumed.
+# The manifest lives in the output folder as an append-only JSON-lines log: a header line
+# naming the batch, then one line per state change of a subfolder job. Replaying the log
+# gives the latest state of every job; it is compacted each time a batch is opened.
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from m3u8_playlist import folder_fingerprint
+from merge_core import PART_SUFFIX
+
+MANIFEST_FILENAME = ".merge_manifest.jsonl"
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_SKIPPED = "skipped" # Output existed and the user/policy kept it
+JOB_FAILED = "failed"
+
+
+def source_fingerprint(job):
+    return folder_fingerprint(job.m3u8_paths())
+
+
+class JobManifest:
+    def __init__(self, input_folder, output_folder, fresh=False):
+        # fresh=True ignores whatever an earlier run of this batch recorded
+        self.input_folder = os.path.abspath(input_folder)
+        self.output_folder = os.path.abspath(output_folder)
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.records = {} # folder name -> latest record
+        self._lock = threading.Lock()
+        self.resumed = False if fresh else self._load()
+        self._compact()
+
+    def _load(self):
+        # Returns True when an unfinished manifest for the same batch was found
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return False
+        header = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # Torn line from a crash mid-write
+            if header is None:
+                header = record
+                if header.get("input_folder") != self.input_folder or header.get("output_folder") != self.output_folder:
+                    return False # A different batch; start fresh
+                continue
+            self.records[record["folder"]] = record
+        return bool(self.records)
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"input_folder": self.input_folder, "output_folder": self.output_folder}, ensure_ascii=False) + "\n")
+            for record in self.records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def register(self, jobs):
+        # Record every job of the batch up front, so jobs that never started are still
+        # pending when the batch is resumed
+        new_jobs = [job for job in jobs if job.folder_name not in self.records]
+        if not new_jobs:
+            return
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for job in new_jobs:
+                    record = {"folder": job.folder_name, "state": JOB_PENDING, "output": job.output_filename}
+                    self.records[job.folder_name] = record
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def mark(self, job, state, **fields):
+        record = {
+            "folder": job.folder_name,
+            "state": state,
+            "output": job.output_filename,
+            "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.records[job.folder_name] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def mark_running(self, job):
+        self.mark(job, JOB_RUNNING, fingerprint=source_fingerprint(job), started=time.time())
+
+    def mark_finished(self, job, state):
+        output_size = os.path.getsize(job.output_path) if os.path.exists(job.output_path) else None
+        self.mark(job, state, fingerprint=source_fingerprint(job), output_size=output_size, error=job.error)
+
+    def resume(self, job):
+        # Returns True when the job already completed in an earlier run of this batch and its
+        # output is intact, so it can be skipped without asking. ffmpeg only ever writes to
+        # <output>.part, which is renamed into place after a clean exit, so a .part file is
+        # what a killed ffmpeg leaves behind and is removed here.
+        record = self.records.get(job.folder_name)
+        # The earlier run may have written under another name (rename overwrite policy)
+        output_filename = record.get("output", job.output_filename) if record else job.output_filename
+        output_path = os.path.join(job.output_folder, output_filename)
+        for path in {job.output_path, output_path}:
+            if os.path.exists(path + PART_SUFFIX):
+                os.remove(path + PART_SUFFIX)
+        if record is None or not os.path.exists(output_path):
+            return False
+        if os.path.splitext(output_filename)[1] != os.path.splitext(job.output_filename)[1]:
+            return False # Converted with another engine
+        if record.get("fingerprint") != source_fingerprint(job):
+            return False # Sources changed since then
+        if record["state"] in (JOB_DONE, JOB_SKIPPED):
+            resumed = record.get("output_size") == os.path.getsize(output_path)
+        elif record["state"] == JOB_RUNNING:
+            # The .part was renamed into place but the run stopped before recording it
+            resumed = os.path.getmtime(output_path) >= record.get("started", float('inf'))
+        else:
+            resumed = False
+        if resumed:
+            job.set_output_filename(output_filename)
+        return resumed
+
+    def finish(self):
+        # A batch with nothing left to do no longer needs its manifest
+        with self._lock:
+            unfinished = [r for r in self.records.values() if r["state"] not in (JOB_DONE, JOB_SKIPPED)]
+            if not unfinished and os.path.exists(self.path):
+                os.remove(self.path)
+        return not unfinished
@@ -0,0 +1,159 @@
+# Reading local .m3u8 playlists without starting ffmpeg.
+import hashlib
+import os
+import re
+from urllib.parse import unquote
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text):
+    # 'METHOD=AES-128,URI="key.key"' -> {'METHOD': 'AES-128', 'URI': 'key.key'}
+    return {name: value.strip('"') for name, value in _ATTRIBUTE_RE.findall(text)}
+
+
+class Segment:
+    def __init__(self, uri, duration, path, byterange=None, discontinuity=False, key=None):
+        self.uri = uri
+        self.duration = duration # From #EXTINF, seconds
+        self.path = path # Local file path, or None for remote URIs
+        self.byterange = byterange
+        self.discontinuity = discontinuity # Preceded by #EXT-X-DISCONTINUITY
+        self.key = key # Attributes of the #EXT-X-KEY in effect, or None
+
+
+class Playlist:
+    def __init__(self, path):
+        self.path = path
+        self.segments = []
+        self.keys = [] # Attribute dicts of every #EXT-X-KEY tag
+        self.has_map = False # #EXT-X-MAP: fragmented MP4 segments with an init section
+        self.is_master = False # Variant playlist pointing at other playlists
+        self.ended = False # #EXT-X-ENDLIST seen
+
+    def is_encrypted(self):
+        return any(key.get('METHOD', 'NONE').upper() != 'NONE' for key in self.keys)
+
+
+def parse_playlist(m3u8_path):
+    playlist = Playlist(m3u8_path)
+    base_dir = os.path.dirname(os.path.abspath(m3u8_path))
+    duration = None
+    byterange = None
+    discontinuity = False
+    key = None
+    with open(m3u8_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                tag, _, value = line.partition(':')
+                if tag == '#EXTINF':
+                    try:
+                        duration = float(value.split(',', 1)[0])
+                    except ValueError:
+                        duration = None
+                elif tag == '#EXT-X-KEY':
+                    key = parse_attributes(value)
+                    playlist.keys.append(key)
+                    if key.get('METHOD', 'NONE').upper() == 'NONE':
+                        key = None
+                elif tag == '#EXT-X-BYTERANGE':
+                    byterange = value
+                elif tag == '#EXT-X-DISCONTINUITY':
+                    discontinuity = True
+                elif tag == '#EXT-X-MAP':
+                    playlist.has_map = True
+                elif tag == '#EXT-X-STREAM-INF':
+                    playlist.is_master = True
+                elif tag == '#EXT-X-ENDLIST':
+                    playlist.ended = True
+                continue
+            path = None
+            if '://' not in line:
+                path = os.path.normpath(os.path.join(base_dir, unquote(line)))
+            playlist.segments.append(Segment(line, duration, path, byterange, discontinuity, key))
+            duration = None
+            byterange = None
+            discontinuity = False
+    return playlist
+
+
+class PlaylistReport:
+    # Result of checking a playlist against the files on disk, before any ffmpeg is started
+    MAX_LISTED_SEGMENTS = 5 # Missing segments named in the problem text; the rest are counted
+
+    def __init__(self, playlist):
+        self.playlist = playlist
+        self.total_duration = sum(segment.duration or 0.0 for segment in playlist.segments)
+        self.missing_segments = [] # URIs of local segments that do not exist
+        self.empty_segments = [] # URIs of local segments with zero size
+        self.remote_segments = 0 # Segments ffmpeg fetches itself; not checked here
+        self.missing_keys = [] # URIs of local #EXT-X-KEY files that do not exist
+        # Sum of the local segment sizes. A stream copy into mp4 drops the TS packet
+        # overhead, so the output is a little smaller than this.
+        self.estimated_size = 0
+
+    def problems(self):
+        # Human-readable reasons the playlist cannot convert; empty when it looks fine
+        problems = []
+        if not self.playlist.segments and not self.playlist.is_master:
+            problems.append("播放列表中没有分段")
+        if self.missing_segments:
+            listed = ", ".join(self.missing_segments[:self.MAX_LISTED_SEGMENTS])
+            more = len(self.missing_segments) - self.MAX_LISTED_SEGMENTS
+            problems.append(f"缺少 {len(self.missing_segments)} 个分段: {listed}" + (f" 等另外 {more} 个" if more > 0 else ""))
+        if self.empty_segments:
+            problems.append(f"{len(self.empty_segments)} 个分段为空: {', '.join(self.empty_segments[:self.MAX_LISTED_SEGMENTS])}")
+        if self.missing_keys:
+            problems.append(f"缺少密钥文件: {', '.join(self.missing_keys)}")
+        return problems
+
+
+def validate_playlist(m3u8_path):
+    # Parses the playlist and stats every local segment once. Raises OSError when the
+    # playlist itself cannot be read.
+    playlist = parse_playlist(m3u8_path)
+    report = PlaylistReport(playlist)
+    for segment in playlist.segments:
+        if segment.path is None:
+            report.remote_segments += 1
+            continue
+        try:
+            size = os.stat(segment.path).st_size
+        except OSError:
+            report.missing_segments.append(segment.uri)
+            continue
+        if size == 0:
+            report.empty_segments.append(segment.uri)
+        report.estimated_size += size
+    base_dir = os.path.dirname(os.path.abspath(m3u8_path))
+    for key in playlist.keys:
+        uri = key.get('URI')
+        if key.get('METHOD', 'NONE').upper() == 'NONE' or not uri or '://' in uri:
+            continue
+        if not os.path.isfile(os.path.join(base_dir, unquote(uri))) and uri not in report.missing_keys:
+            report.missing_keys.append(uri)
+    return report
+
+
+def read_segment_uris(m3u8_path):
+    # Segment URIs in playlist order: every non-empty line that is not a tag or comment
+    with open(m3u8_path, 'r', encoding='utf-8', errors='replace') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def folder_fingerprint(m3u8_paths):
+    # Cheap identity of a subfolder's sources: name, size and mtime of every playlist plus
+    # its segment list. Segment files themselves are not read or stat'ed.
+    digest = hashlib.sha1()
+    for path in m3u8_paths:
+        try:
+            st = os.stat(path)
+            segments = read_segment_uris(path)
+        except OSError:
+            continue
+        digest.update(f"{os.path.basename(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+        digest.update("\n".join(segments).encode('utf-8'))
+    return digest.hexdigest()
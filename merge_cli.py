@@ -0,0 +1,325 @@
+# Headless command-line entry point for the m3u8 -> mp4 pipeline, for servers and cron.
+# Uses the same discovery, naming and ffmpeg logic as the GUI without importing tkinter,
+# cv2 or PIL. Prints a JSON summary on stdout, e.g.:
+#   python merge_cli.py input_videos output_videos --concurrency 4 --overwrite skip
+# With --watch it keeps running and converts subfolders as they are downloaded into the input
+# folder, printing one JSON line per finished folder, until interrupted with Ctrl+C.
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from folder_watch import SETTLE_SECONDS, FolderWatcher
+from history_store import HistoryStore
+from io_scheduler import IoScheduler
+from job_manifest import JOB_DONE, JOB_FAILED, JOB_PENDING, JOB_SKIPPED, JobManifest
+from overwrite_policy import POLICIES, POLICY_SKIP, OverwritePolicy
+from skip_cache import CACHE_FRESH, CACHE_STALE, ConversionCache
+from merge_core import (ENGINE_FFMPEG, ENGINE_TS_CONCAT, FFMPEG_MISSING_MESSAGE, KEPT_OUTPUT_STATUSES, STATUS_FFMPEG_MISSING, STATUS_NO_M3U8, STATUS_RESUMED_DONE,
+                        STATUS_SUCCESS, STATUS_UNCHANGED_SKIPPED, BatchCancelled, FfmpegNotFound, JobStream, convert_m3u8, default_concurrency, discover_job, discover_jobs,
+                        find_ffmpeg, run_batch)
+
+ENGINE_CHOICES = (ENGINE_FFMPEG, ENGINE_TS_CONCAT)
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILURES = 1 # Some jobs failed
+EXIT_FATAL = 2 # Bad arguments or ffmpeg missing
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="将输入文件夹下各子文件夹中的 m3u8 合并转换为 mp4 (无界面模式)")
+    parser.add_argument("input_folder", help="包含视频子文件夹的输入文件夹")
+    parser.add_argument("output_folder", help="输出 mp4 的文件夹，不存在时自动创建")
+    parser.add_argument("-j", "--concurrency", type=int, default=default_concurrency(),
+                        help="同时运行的转换任务数 (默认: CPU 核心数)")
+    parser.add_argument("--per-device", type=int, default=0, metavar="N",
+                        help="同一磁盘上同时运行的任务数上限 (默认 0: 自动，机械硬盘 1、网络共享 2、固态硬盘不限)")
+    parser.add_argument("--overwrite", choices=POLICIES, default=POLICY_SKIP,
+                        help="输出文件已存在时的处理方式: skip 跳过, overwrite 覆盖, skip-if-newer 比源文件新则跳过, "
+                             "skip-if-valid 是完整文件则跳过, rename 另存为 名称_1.mp4 (默认: skip)")
+    parser.add_argument("--engine", choices=ENGINE_CHOICES, default=ENGINE_FFMPEG,
+                        help="ffmpeg: 转封装为 mp4 (默认); ts-concat: 直接拼接 TS 分段输出 .ts，无法直接拼接时改用 ffmpeg")
+    parser.add_argument("--verify", action="store_true",
+                        help="转换后校验输出 (moov、时长与播放列表一致、流数量)，不通过时自动重新转换一次")
+    parser.add_argument("--faststart", action="store_true",
+                        help="生成 moov 在前的 mp4 (快速启动)，无需 FFmpeg 的 +faststart 二次重写")
+    parser.add_argument("--fresh", action="store_true", help="忽略上次未完成批处理的任务清单，从头开始")
+    parser.add_argument("--watch", action="store_true",
+                        help="持续监视输入文件夹，新的或有变化的子文件夹下载完成后自动转换，每完成一个输出一行 JSON；Ctrl+C 结束")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, metavar="SECONDS",
+                        help=f"监视模式: 播放列表和分段保持不变多少秒后才开始转换 (默认: {SETTLE_SECONDS:g})")
+    parser.add_argument("--poll", type=float, default=0, metavar="SECONDS",
+                        help="监视模式: 重新扫描的间隔 (默认 0: 自动，使用 inotify 时 30 秒，否则 5 秒)")
+    parser.add_argument("--no-inotify", action="store_true", help="监视模式: 只轮询，不使用 inotify")
+    parser.add_argument("--ffmpeg", default=None, help="ffmpeg 可执行文件路径 (默认与图形界面相同的查找顺序)")
+    parser.add_argument("--history", default=None, metavar="JSONL", help="将结果追加到此历史记录文件 (如 conversion_history.jsonl)")
+    parser.add_argument("--summary", default=None, metavar="PATH", help="将 JSON 概要写入文件而不是标准输出")
+    parser.add_argument("-v", "--verbose", action="store_true", help="在标准错误输出中逐个打印任务结果")
+    return parser
+
+
+class CliBatch:
+    # Runs one batch and collects a machine-readable summary. Results are appended from the
+    # pool workers, so everything shared is guarded by a lock.
+    def __init__(self, args, ffmpeg_path, manifest, skip_cache, history_store=None):
+        self.args = args
+        self.ffmpeg_path = ffmpeg_path
+        self.manifest = manifest
+        self.skip_cache = skip_cache
+        self.history_store = history_store
+        self.overwrite_policy = OverwritePolicy(args.overwrite)
+        self.scheduler = IoScheduler(args.per_device or None)
+        self.lock = threading.Lock()
+        self.fatal_error = None
+        self.cancel_event = threading.Event() # Also the watch mode's stop event
+
+    def log(self, job, input_path, output_file, status, details=None):
+        with self.lock:
+            job.results.append((input_path, status))
+        if self.history_store:
+            entry = {
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "input": input_path,
+                "output": output_file,
+                "status": status
+            }
+            entry.update(details or {})
+            self.history_store.append(entry)
+        if self.args.verbose:
+            print(f"[{status}] {input_path} -> {output_file}", file=sys.stderr, flush=True)
+
+    def convert_job(self, job):
+        cache_state = self.skip_cache.check(job) if job.m3u8_files else None
+        if cache_state == CACHE_FRESH:
+            self.log(job, job.subfolder_path, job.output_filename, STATUS_UNCHANGED_SKIPPED)
+            self.manifest.mark_finished(job, JOB_SKIPPED)
+            return
+        if self.manifest.resume(job):
+            self.log(job, job.subfolder_path, job.output_filename, STATUS_RESUMED_DONE)
+            return
+        try:
+            self.convert_job_playlists(job, replace_output=(cache_state == CACHE_STALE))
+        except BatchCancelled:
+            self.manifest.mark(job, JOB_PENDING)
+            raise
+        if job.error:
+            self.manifest.mark_finished(job, JOB_FAILED)
+        elif job.results and all(status in KEPT_OUTPUT_STATUSES for _, status in job.results):
+            self.manifest.mark_finished(job, JOB_SKIPPED)
+        else:
+            self.manifest.mark_finished(job, JOB_DONE)
+            if any(status == STATUS_SUCCESS for _, status in job.results):
+                self.skip_cache.record(job)
+
+    def convert_job_playlists(self, job, replace_output=False):
+        if not job.m3u8_files:
+            self.log(job, job.subfolder_path, "N/A", STATUS_NO_M3U8)
+            return
+        for input_m3u8_path in job.m3u8_paths():
+            skip_status = None if replace_output else self.overwrite_policy.resolve(job)
+            if skip_status:
+                self.log(job, input_m3u8_path, job.output_filename, skip_status)
+                continue
+            self.manifest.mark_running(job)
+            try:
+                status, error_msg = convert_m3u8(self.ffmpeg_path, job, input_m3u8_path, engine=self.args.engine, verify=self.args.verify,
+                                                 faststart=self.args.faststart, scheduler=self.scheduler, cancel_event=self.cancel_event)
+            except FfmpegNotFound:
+                self.log(job, input_m3u8_path, job.output_filename, STATUS_FFMPEG_MISSING)
+                self.fatal_error = FFMPEG_MISSING_MESSAGE
+                raise BatchCancelled()
+            details = {}
+            verify_result = job.verify_results.get(input_m3u8_path)
+            if verify_result:
+                details["verify"] = verify_result.to_dict()
+            attempts = job.attempts.get(input_m3u8_path, [])
+            if len(attempts) > 1:
+                details["attempts"] = attempts
+            self.log(job, input_m3u8_path, job.output_filename, status, details)
+            if error_msg:
+                with self.lock:
+                    job.error = error_msg
+
+    def run(self, jobs):
+        started = time.monotonic()
+        self.manifest.register(jobs)
+        ran = set(run_batch(jobs, self.convert_job, concurrency=self.args.concurrency, scheduler=self.scheduler,
+                            cancel_event=self.cancel_event))
+        if not self.fatal_error:
+            self.manifest.finish()
+        return self.summarize(jobs, ran, time.monotonic() - started)
+
+    def job_summary(self, job, ran):
+        return {
+            "folder": job.subfolder_path,
+            "output": job.output_path if job.m3u8_files else None,
+            "results": [{"input": input_path, "status": status} for input_path, status in job.results],
+            "error": job.error,
+            "playlists": [{
+                "input": input_path,
+                "segments": len(report.playlist.segments),
+                "duration_seconds": round(report.total_duration, 3),
+                "encrypted": report.playlist.is_encrypted(),
+                "estimated_size": report.estimated_size,
+                "missing_segments": report.missing_segments,
+                "verify": job.verify_results[input_path].to_dict() if input_path in job.verify_results else None,
+                "attempts": job.attempts.get(input_path, []),
+            } for input_path, report in job.playlist_reports.items()],
+            "ran": ran,
+        }
+
+    def tally(self, job, counts):
+        # Adds the job's statuses to counts; returns the size of the output it wrote
+        statuses = [status for _, status in job.results]
+        for status in statuses:
+            counts[status] = counts.get(status, 0) + 1
+        if STATUS_SUCCESS in statuses and os.path.exists(job.output_path):
+            return os.path.getsize(job.output_path)
+        return 0
+
+    def summarize(self, jobs, ran, elapsed):
+        counts = {}
+        bytes_written = sum(self.tally(job, counts) for job in jobs)
+        summary = self.summary_totals(len(jobs), sum(1 for job in jobs if job.error), counts, bytes_written, elapsed)
+        summary["jobs"] = [self.job_summary(job, job in ran) for job in jobs]
+        return summary
+
+    def summary_totals(self, total_jobs, failed, counts, bytes_written, elapsed):
+        return {
+            "input_folder": self.args.input_folder,
+            "output_folder": self.args.output_folder,
+            "concurrency": self.args.concurrency,
+            "device_limits": {str(device): limit for device, limit in self.scheduler.device_summary().items()},
+            "overwrite": self.args.overwrite,
+            "overwrite_decisions": self.overwrite_policy.summary(),
+            "engine": self.args.engine,
+            "verify": self.args.verify,
+            "faststart": self.args.faststart,
+            "resumed": self.manifest.resumed,
+            "total_jobs": total_jobs,
+            "failed_jobs": failed,
+            "status_counts": counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "bytes_written": bytes_written,
+            "throughput_bytes_per_second": round(bytes_written / elapsed) if elapsed > 0 else None,
+            "fatal_error": self.fatal_error,
+        }
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class CliWatch:
+    # Watch mode: subfolders are converted as the FolderWatcher hands them over, by a JobStream
+    # with the batch's concurrency and per-device limits. Runs until Ctrl+C or a fatal error.
+    def __init__(self, batch):
+        self.batch = batch
+        self.args = batch.args
+        # Totals only: it runs indefinitely, and every job has already been printed when it finished
+        self.total_jobs = 0 # Handed over, a folder again each time it changed
+        self.failed_jobs = 0
+        self.status_counts = {}
+        self.bytes_written = 0
+        self.stream = None
+        self.watcher = None
+
+    def enqueue(self, folder_path):
+        try:
+            job = discover_job(folder_path, self.args.output_folder, self.args.engine)
+        except OSError:
+            self.watcher.folder_finished(folder_path) # Removed again before it could be read
+            return
+        self.batch.manifest.register([job])
+        with self.batch.lock:
+            self.total_jobs += 1
+        self.stream.submit(job)
+
+    def job_done(self, job):
+        counts = {}
+        bytes_written = self.batch.tally(job, counts)
+        with self.batch.lock:
+            for status, count in counts.items():
+                self.status_counts[status] = self.status_counts.get(status, 0) + count
+            self.bytes_written += bytes_written
+            self.failed_jobs += bool(job.error)
+        self.watcher.folder_finished(job.subfolder_path)
+        print(json.dumps(self.batch.job_summary(job, True), ensure_ascii=False), flush=True)
+
+    def run(self):
+        started = time.monotonic()
+        self.stream = JobStream(self.batch.convert_job, concurrency=self.args.concurrency, scheduler=self.batch.scheduler,
+                                on_job_done=self.job_done, stop_event=self.batch.cancel_event)
+        self.watcher = FolderWatcher(self.args.input_folder, self.enqueue, self.stream.stop_event, settle_seconds=self.args.settle,
+                                     poll_seconds=self.args.poll or None, use_inotify=not self.args.no_inotify)
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt) # How systemd and docker stop a daemon
+        mode = "inotify" if self.watcher.uses_inotify else "轮询"
+        print(f"正在监视 {self.args.input_folder} ({mode})，按 Ctrl+C 结束", file=sys.stderr, flush=True)
+        try:
+            self.watcher.run()
+        except KeyboardInterrupt:
+            print("正在停止，等待进行中的转换完成...", file=sys.stderr, flush=True)
+        finally:
+            self.stream.close()
+        if self.stream.errors:
+            raise self.stream.errors[0] # Same as run_batch: unexpected worker errors are not swallowed
+        if not self.batch.fatal_error:
+            self.batch.manifest.finish()
+        return self.batch.summary_totals(self.total_jobs, self.failed_jobs, self.status_counts, self.bytes_written,
+                                         time.monotonic() - started)
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.concurrency < 1:
+        print("并发数必须是大于0的整数。", file=sys.stderr)
+        return EXIT_FATAL
+    if args.per_device < 0:
+        print("每磁盘并发数不能为负数。", file=sys.stderr)
+        return EXIT_FATAL
+    if args.settle < 0 or args.poll < 0:
+        print("等待时间和扫描间隔不能为负数。", file=sys.stderr)
+        return EXIT_FATAL
+    if not os.path.isdir(args.input_folder):
+        print(f"输入文件夹路径无效: {args.input_folder}", file=sys.stderr)
+        return EXIT_FATAL
+    try:
+        os.makedirs(args.output_folder, exist_ok=True)
+    except OSError as e:
+        print(f"无法创建输出文件夹: {args.output_folder}\n{e}", file=sys.stderr)
+        return EXIT_FATAL
+
+    ffmpeg_path = args.ffmpeg or find_ffmpeg(os.path.dirname(os.path.abspath(__file__)))
+    history_store = HistoryStore(args.history) if args.history else None
+    try:
+        manifest = JobManifest(args.input_folder, args.output_folder, fresh=args.fresh)
+        skip_cache = ConversionCache(args.output_folder)
+    except OSError as e:
+        print(f"无法写入任务清单或跳过缓存: {e}", file=sys.stderr)
+        return EXIT_FATAL
+    batch = CliBatch(args, ffmpeg_path, manifest, skip_cache, history_store)
+    if args.watch:
+        summary = CliWatch(batch).run()
+    else:
+        summary = batch.run(discover_jobs(args.input_folder, args.output_folder, args.engine))
+
+    summary_json = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(summary_json + "\n")
+    elif not args.watch: # Watch mode has already printed one line per job
+        print(summary_json)
+
+    if batch.fatal_error:
+        print(batch.fatal_error, file=sys.stderr)
+        return EXIT_FATAL
+    return EXIT_FAILURES if summary["failed_jobs"] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,592 @@
+# Headless m3u8 -> mp4 conversion pipeline shared by the GUI.
+# Nothing in here may import tkinter: the worker pool runs jobs on background threads
+# and reports back through plain callbacks.
+import collections
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ts_concat
+from ffmpeg_failures import (FAILURE_CODEC, FAILURE_CORRUPT_OUTPUT, FAILURE_DISK_FULL, FAILURE_MISSING_SEGMENT, FAILURE_STATUSES, FAILURE_UNKNOWN,
+                             RETRYABLE_FAILURES, classify_os_error, classify_stderr)
+from io_scheduler import IoScheduler
+from m3u8_playlist import validate_playlist
+from mp4_faststart import MOOV_TOO_SMALL_MESSAGE, relocate_moov, reserved_moov_size
+from output_verify import verify_output
+
+
+# Status strings recorded in the conversion history
+STATUS_SUCCESS = "成功"
+STATUS_NO_M3U8 = "无m3u8文件跳过"
+STATUS_EXISTS_SKIPPED = "已存在-跳过"
+STATUS_NEWER_SKIPPED = "已存在且较新-跳过"
+STATUS_VALID_SKIPPED = "已存在且有效-跳过"
+STATUS_RESUMED_DONE = "已完成-跳过 (续传)"
+STATUS_UNCHANGED_SKIPPED = "未变化-跳过"
+STATUS_CANCELLED = "用户取消"
+STATUS_FFMPEG_MISSING = "失败: FFmpeg未找到"
+STATUS_INVALID_PLAYLIST = "失败: 播放列表无效"
+STATUS_VERIFY_FAILED = "失败: 输出校验未通过"
+STATUS_UNKNOWN_ERROR = "失败: 未知错误"
+# An existing output was kept by the overwrite policy
+KEPT_OUTPUT_STATUSES = (STATUS_EXISTS_SKIPPED, STATUS_NEWER_SKIPPED, STATUS_VALID_SKIPPED)
+FFMPEG_MISSING_MESSAGE = "FFmpeg未找到。请确保ffmpeg已安装并配置在系统PATH中，或ffmpeg.exe在程序目录下。"
+
+# ffmpeg command variants, tried in this order after codec/bitstream failures
+VARIANT_DEFAULT = "default"
+VARIANT_NO_ADTS_FILTER = "no-adtstoasc"
+VARIANT_GENPTS = "genpts"
+VARIANT_GENPTS_NO_ADTS_FILTER = "genpts-no-adtstoasc"
+FALLBACK_VARIANTS = (VARIANT_DEFAULT, VARIANT_NO_ADTS_FILTER, VARIANT_GENPTS, VARIANT_GENPTS_NO_ADTS_FILTER)
+
+# Retries of a failed playlist. Transient I/O errors and corrupt outputs wait with
+# exponential backoff; codec errors move on to the next command variant right away.
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 2.0
+RETRY_BACKOFF_MAX_SECONDS = 30.0
+
+PART_SUFFIX = ".part" # ffmpeg writes here first; renamed to the final .mp4 on success
+
+# Conversion engines. ts-concat joins plain MPEG-TS segments directly into a .ts file and
+# only starts ffmpeg (still writing .ts) for playlists it cannot handle.
+ENGINE_FFMPEG = "ffmpeg"
+ENGINE_TS_CONCAT = "ts-concat"
+ENGINE_OUTPUT_EXT = {ENGINE_FFMPEG: ".mp4", ENGINE_TS_CONCAT: ".ts"}
+ENGINE_OUTPUT_FORMAT = {ENGINE_FFMPEG: "mp4", ENGINE_TS_CONCAT: "mpegts"}
+
+
+def default_concurrency():
+    # Remuxing with -c copy is mostly I/O bound and uses little CPU per job,
+    # so one worker per core keeps the disks busy without oversubscribing.
+    return max(1, os.cpu_count() or 1)
+
+
+def find_ffmpeg(script_dir):
+    # Bundled ffmpeg\bin\ffmpeg.exe first, then ffmpeg.exe next to the script, then PATH
+    ffmpeg_dir_path = os.path.join(script_dir, "ffmpeg", "bin", "ffmpeg.exe")
+    ffmpeg_script_path = os.path.join(script_dir, "ffmpeg.exe")
+    if os.path.exists(ffmpeg_dir_path) and os.access(ffmpeg_dir_path, os.X_OK):
+        return ffmpeg_dir_path
+    if os.path.exists(ffmpeg_script_path) and os.access(ffmpeg_script_path, os.X_OK):
+        return ffmpeg_script_path
+    return "ffmpeg" # Fallback to system PATH
+
+
+def sanitize_filename(name):
+    return "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in name).rstrip()
+
+
+class ConversionJob:
+    # One subfolder of the input directory. All m3u8 files inside it map to the same
+    # output name, so they are converted sequentially within a single job.
+    def __init__(self, subfolder_path, m3u8_files, output_folder, output_ext=".mp4"):
+        self.subfolder_path = subfolder_path
+        self.folder_name = os.path.basename(subfolder_path)
+        self.m3u8_files = m3u8_files
+        self.output_folder = output_folder
+        self.set_output_filename(f"{sanitize_filename(self.folder_name)}{output_ext}")
+        self.results = [] # (input_m3u8_path, status) per m3u8 file
+        self.error = None # Error message of the last failed m3u8, if any
+        self.fingerprint = None # Source fingerprint taken before converting, see skip_cache
+        self.playlist_reports = {} # m3u8 path -> PlaylistReport from the pre-flight check
+        self.verify_results = {} # m3u8 path -> VerifyResult of the last verified output
+        self.attempts = {} # m3u8 path -> [attempt records], see convert_m3u8
+
+    def m3u8_paths(self):
+        return [os.path.join(self.subfolder_path, f) for f in self.m3u8_files]
+
+    def set_output_filename(self, output_filename):
+        # The default name can be replaced, e.g. by a rename-with-suffix overwrite policy
+        self.output_filename = output_filename
+        self.output_path = os.path.join(self.output_folder, output_filename)
+
+
+def discover_job(subfolder_path, output_folder, engine=ENGINE_FFMPEG):
+    m3u8_files = sorted(f for f in os.listdir(subfolder_path) if f.endswith(".m3u8"))
+    return ConversionJob(subfolder_path, m3u8_files, output_folder, ENGINE_OUTPUT_EXT[engine])
+
+
+def discover_jobs(input_folder, output_folder, engine=ENGINE_FFMPEG):
+    return [discover_job(entry.path, output_folder, engine)
+            for entry in sorted(os.scandir(input_folder), key=lambda e: e.name) if entry.is_dir()]
+
+
+def build_ffmpeg_command(ffmpeg_path, input_m3u8_path, output_mp4_path, overwrite=False, progress=False, output_format=None,
+                         variant=VARIANT_DEFAULT, moov_size=None):
+    command = [
+        ffmpeg_path,
+        '-protocol_whitelist', 'file,http,https,tcp,tls,crypto,pipe',
+        '-i', input_m3u8_path,
+        '-c', 'copy',
+        '-bsf:a', 'aac_adtstoasc',
+        output_mp4_path
+    ]
+    if output_format == 'mpegts' or variant in (VARIANT_NO_ADTS_FILTER, VARIANT_GENPTS_NO_ADTS_FILTER):
+        # MPEG-TS keeps AAC in ADTS framing, so the ADTS -> ASC filter does not apply. As a
+        # fallback it is also dropped for inputs whose audio is not ADTS to begin with.
+        command.remove('-bsf:a')
+        command.remove('aac_adtstoasc')
+    if variant in (VARIANT_GENPTS, VARIANT_GENPTS_NO_ADTS_FILTER):
+        # Regenerate missing presentation timestamps, e.g. after a bad segment join
+        command[command.index('-i'):command.index('-i')] = ['-fflags', '+genpts']
+    if moov_size:
+        # Reserve room for the index after ftyp, so moov ends up in front of mdat (see mp4_faststart)
+        command[-1:-1] = ['-moov_size', str(moov_size)]
+    if output_format:
+        # Needed when the output name does not end in the container's extension
+        command[-1:-1] = ['-f', output_format]
+    if progress:
+        # Machine-readable key=value blocks on stdout instead of the \r-updated stats line
+        command[1:1] = ['-progress', 'pipe:1', '-nostats']
+    if overwrite:
+        command.insert(1, '-y')
+    return command
+
+
+def popen_platform_kwargs():
+    # Hide the console window on Windows; CREATE_NO_WINDOW does not exist elsewhere
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NO_WINDOW}
+    return {}
+
+
+class FfmpegNotFound(FileNotFoundError):
+    # The ffmpeg executable itself could not be started. Other FileNotFoundErrors (a segment,
+    # the output folder) are ordinary failures of one playlist and must not stop the batch.
+    pass
+
+
+def _start_ffmpeg(command):
+    try:
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, encoding='utf-8', errors='replace', **popen_platform_kwargs())
+    except FileNotFoundError as e:
+        raise FfmpegNotFound(e.errno, e.strerror, e.filename) from e
+
+
+def run_ffmpeg(command):
+    # Returns (returncode, stderr). FfmpegNotFound propagates when ffmpeg is missing.
+    process = _start_ffmpeg(command)
+    _, stderr = process.communicate()
+    return process.returncode, stderr
+
+
+STDERR_TAIL_LINES = 40 # Enough of ffmpeg's log to explain a failure
+_DURATION_RE = re.compile(r"Duration:\s*(\d+:\d+:\d+(?:\.\d+)?)")
+# One line per output stream under "Stream mapping:", e.g. "  Stream #0:0 -> #0:0 (copy)"
+_STREAM_MAPPING_RE = re.compile(r"Stream #\d+:\d+\S* -> #0:\d+")
+
+
+def count_output_streams(stderr):
+    return len(_STREAM_MAPPING_RE.findall(stderr))
+
+
+def parse_ffmpeg_time(value):
+    # "HH:MM:SS.micro" -> seconds, None for N/A or garbage
+    try:
+        hours, minutes, seconds = value.strip().split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (ValueError, AttributeError):
+        return None
+
+
+def parse_ffmpeg_duration(stderr):
+    # Seconds from the "Duration:" line of the input header, None when absent or N/A
+    match = _DURATION_RE.search(stderr)
+    return parse_ffmpeg_time(match.group(1)) if match else None
+
+
+def parse_ffmpeg_speed(value):
+    # "12.3x" -> 12.3, None for N/A
+    try:
+        return float(value.strip().rstrip('x'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def format_seconds(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class FfmpegProgress:
+    # Snapshot of one -progress block. duration comes from the input header on stderr
+    # and stays None until ffmpeg has probed the playlist.
+    def __init__(self):
+        self.out_time = 0.0 # seconds of output written so far
+        self.speed = None # multiple of realtime
+        self.total_size = 0 # bytes written to the output
+        self.duration = None # input duration in seconds
+        self.finished = False
+        self.output_streams = 0 # Streams in ffmpeg's "Stream mapping" section
+
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        if not self.duration:
+            return 0.0
+        return max(0.0, min(1.0, self.out_time / self.duration))
+
+    def eta_seconds(self):
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+    def update(self, key, value):
+        # Returns True when a block is complete and should be reported
+        if key == 'out_time_us' or key == 'out_time_ms': # both are microseconds
+            try:
+                self.out_time = int(value) / 1000000
+            except ValueError:
+                pass
+        elif key == 'out_time':
+            out_time = parse_ffmpeg_time(value)
+            if out_time is not None:
+                self.out_time = out_time
+        elif key == 'speed':
+            self.speed = parse_ffmpeg_speed(value)
+        elif key == 'total_size':
+            try:
+                self.total_size = int(value)
+            except ValueError:
+                pass
+        elif key == 'progress':
+            self.finished = value == 'end'
+            return True
+        return False
+
+
+def run_ffmpeg_with_progress(command, on_progress, progress=None):
+    # Like run_ffmpeg, for commands built with progress=True. stdout carries the -progress
+    # blocks and is parsed on a reader thread; stderr is drained on another thread keeping
+    # only its last lines, so memory stays flat however verbose ffmpeg is.
+    # on_progress(FfmpegProgress) is called from the reader thread after every block.
+    # A progress object can be passed in, e.g. with the duration already known from the
+    # playlist, so ffmpeg's own Duration line is not needed.
+    process = _start_ffmpeg(command)
+    if progress is None:
+        progress = FfmpegProgress()
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+
+    def read_progress():
+        for line in process.stdout:
+            key, sep, value = line.strip().partition('=')
+            if sep and progress.update(key, value):
+                on_progress(progress)
+
+    def read_stderr():
+        for line in process.stderr:
+            if progress.duration is None:
+                match = _DURATION_RE.search(line)
+                if match:
+                    progress.duration = parse_ffmpeg_time(match.group(1))
+            if _STREAM_MAPPING_RE.search(line):
+                progress.output_streams += 1
+            stderr_tail.append(line)
+
+    readers = [threading.Thread(target=read_progress, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+    returncode = process.wait()
+    for reader in readers:
+        reader.join()
+    return returncode, "".join(stderr_tail)
+
+
+def convert_m3u8(ffmpeg_path, job, input_m3u8_path, on_progress=None, engine=ENGINE_FFMPEG, verify=False, faststart=False,
+                 scheduler=None, cancel_event=None):
+    # Converts one playlist of a job into job.output_path. Returns (status, error_msg) where
+    # error_msg is None on success. With on_progress the -progress stream is parsed live.
+    # The output is written to <output>.part which only replaces the output after a clean
+    # finish, so an interrupted conversion never leaves a half-written file under the final name.
+    # FfmpegNotFound propagates when ffmpeg is missing so callers can stop the batch.
+    # The playlist is checked against the disk first, so a folder with missing segments
+    # fails right away instead of after an ffmpeg run. With verify the .part is checked by
+    # output_verify before it is moved into place. With faststart mp4 outputs get their moov
+    # in front of the media data (see mp4_faststart).
+    # Failures are classified (see ffmpeg_failures) and retryable ones are attempted again,
+    # up to MAX_ATTEMPTS in total. Every attempt is recorded in job.attempts. Setting
+    # cancel_event cuts a retry backoff short and gives up on the playlist.
+    # With a scheduler (see io_scheduler) the estimated output size is claimed on the output
+    # device first; when it does not fit the playlist fails without starting ffmpeg.
+    try:
+        report = validate_playlist(input_m3u8_path)
+    except OSError as e:
+        return STATUS_INVALID_PLAYLIST, f"无法读取播放列表 ({job.output_filename}): {e}"
+    job.playlist_reports[input_m3u8_path] = report
+    problems = report.problems()
+    if problems:
+        return STATUS_INVALID_PLAYLIST, f"播放列表无效 ({job.output_filename}): {'; '.join(problems)}"
+
+    part_path = job.output_path + PART_SUFFIX
+    if scheduler is not None:
+        shortfall = scheduler.reserve_space(job.output_path, part_path, report.estimated_size)
+        if shortfall:
+            needed, available = shortfall
+            return (FAILURE_STATUSES[FAILURE_DISK_FULL], f"磁盘空间不足 ({job.output_filename}): 预计需要 "
+                    f"{needed / (1024 * 1024):.0f}MB，可用 {available / (1024 * 1024):.0f}MB")
+    try:
+        return _convert_with_retries(ffmpeg_path, job, input_m3u8_path, report, on_progress, engine, verify, faststart, cancel_event)
+    finally:
+        if scheduler is not None:
+            scheduler.release_space(part_path)
+
+
+def _convert_with_retries(ffmpeg_path, job, input_m3u8_path, report, on_progress, engine, verify, faststart, cancel_event=None):
+    attempts = job.attempts.setdefault(input_m3u8_path, [])
+    variants = iter(FALLBACK_VARIANTS)
+    variant = next(variants)
+    backoff = RETRY_BACKOFF_SECONDS
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        status, error_msg, failure = _write_output(ffmpeg_path, job, input_m3u8_path, report, on_progress, engine, verify, variant,
+                                                   faststart)
+        record = {"attempt": attempt, "variant": variant, "status": status, "failure": failure}
+        attempts.append(record)
+        if failure not in RETRYABLE_FAILURES or attempt == MAX_ATTEMPTS:
+            break
+        if failure == FAILURE_CODEC:
+            variant = next(variants, None)
+            if variant is None:
+                break # Every variant failed the same way
+        else:
+            record["retry_delay"] = backoff
+            if cancel_event is None:
+                time.sleep(backoff)
+            elif cancel_event.wait(backoff):
+                break # Batch stopped; the playlist keeps the failure of its last attempt
+            backoff = min(backoff * 2, RETRY_BACKOFF_MAX_SECONDS)
+    return status, error_msg
+
+
+def _write_output(ffmpeg_path, job, input_m3u8_path, report, on_progress, engine, verify, variant, faststart):
+    # One attempt. Returns (status, error_msg, failure) with failure None on success.
+    part_path = job.output_path + PART_SUFFIX
+    if engine == ENGINE_TS_CONCAT:
+        result = _concat_ts_playlist(job, input_m3u8_path, report, part_path, on_progress, verify)
+        if result is not None:
+            return result
+    faststart = faststart and ENGINE_OUTPUT_FORMAT[engine] == 'mp4' # MPEG-TS has no index to move
+    moov_size = reserved_moov_size(report.total_duration, first_segment_layout(report.playlist)) if faststart else None
+    try:
+        while True:
+            command = build_ffmpeg_command(ffmpeg_path, input_m3u8_path, part_path, overwrite=True, progress=on_progress is not None,
+                                           output_format=ENGINE_OUTPUT_FORMAT[engine], variant=variant, moov_size=moov_size)
+            if on_progress:
+                progress = FfmpegProgress()
+                progress.duration = report.total_duration or None
+                returncode, stderr = run_ffmpeg_with_progress(command, on_progress, progress)
+                output_streams = progress.output_streams
+            else:
+                returncode, stderr = run_ffmpeg(command)
+                output_streams = count_output_streams(stderr)
+            if returncode != 0 and moov_size and MOOV_TOO_SMALL_MESSAGE in stderr:
+                moov_size = None # Underestimated; write normally and relocate moov afterwards
+                continue
+            break
+        if returncode == 0:
+            return _finish_output(job, input_m3u8_path, report, part_path, verify, output_streams, faststart)
+    except FfmpegNotFound:
+        raise
+    except OSError as e:
+        _remove_quietly(part_path)
+        failure = classify_os_error(e)
+        if failure == FAILURE_MISSING_SEGMENT: # Segments are read by ffmpeg; here it is the output folder that went away
+            failure = FAILURE_UNKNOWN
+        return FAILURE_STATUSES.get(failure, STATUS_UNKNOWN_ERROR), f"处理时发生错误 ({job.output_filename}): {e}", failure
+    except Exception as e:
+        _remove_quietly(part_path)
+        return STATUS_UNKNOWN_ERROR, f"处理时发生未知错误 ({job.output_filename}): {e}", None
+    _remove_quietly(part_path)
+    failure = classify_stderr(stderr)
+    status = FAILURE_STATUSES.get(failure, f"失败: {returncode}")
+    return status, f"FFmpeg错误 ({job.output_filename}): {stderr.strip()}", failure
+
+
+def first_segment_layout(playlist):
+    # Frame rates of the first segment, for sizing the moov reservation; None when unknown
+    segment = playlist.segments[0] if playlist.segments else None
+    if segment is None or segment.path is None or segment.byterange is not None or playlist.is_encrypted():
+        return None
+    try:
+        return ts_concat.probe_segment_layout(segment.path, segment.duration)
+    except OSError:
+        return None
+
+
+def _finish_output(job, input_m3u8_path, report, part_path, verify, expected_streams=None, faststart=False):
+    # Moves a complete .part into place, after checking it when verify is set
+    if faststart:
+        _move_moov_to_front(part_path)
+    if verify:
+        result = verify_output(part_path, report.total_duration or None, expected_streams, expect_fast_start=faststart)
+        job.verify_results[input_m3u8_path] = result
+        if not result.ok:
+            _remove_quietly(part_path)
+            return (STATUS_VERIFY_FAILED, f"输出校验未通过 ({job.output_filename}): {'; '.join(result.problems)}",
+                    FAILURE_CORRUPT_OUTPUT)
+    os.replace(part_path, job.output_path)
+    return STATUS_SUCCESS, None, None
+
+
+def _move_moov_to_front(part_path):
+    # Only needed when ffmpeg could not reserve room for moov; a no-op for fast-start files
+    relocated_path = part_path + ".faststart"
+    try:
+        if relocate_moov(part_path, relocated_path):
+            os.replace(relocated_path, part_path)
+    except ValueError:
+        pass # Not a complete mp4; left for verification to report
+    finally:
+        _remove_quietly(relocated_path)
+
+
+def _concat_ts_playlist(job, input_m3u8_path, report, part_path, on_progress, verify):
+    # Returns None when the playlist is not plain local MPEG-TS and ffmpeg must handle it
+    playlist = report.playlist
+    if ts_concat.unsupported_reason(playlist) is not None:
+        return None
+
+    progress = FfmpegProgress()
+    durations = [segment.duration or 0.0 for segment in playlist.segments]
+    progress.duration = report.total_duration or None
+    started = time.monotonic()
+
+    def on_segment(index, written):
+        progress.out_time = sum(durations[:index + 1])
+        progress.total_size = written
+        elapsed = time.monotonic() - started
+        progress.speed = progress.out_time / elapsed if elapsed > 0 else None
+        progress.finished = index == len(durations) - 1
+        on_progress(progress)
+
+    try:
+        ts_concat.concat_segments([segment.path for segment in playlist.segments], part_path,
+                                  on_segment if on_progress else None)
+        return _finish_output(job, input_m3u8_path, report, part_path, verify)
+    except OSError as e:
+        _remove_quietly(part_path)
+        failure = classify_os_error(e)
+        return FAILURE_STATUSES.get(failure, STATUS_UNKNOWN_ERROR), f"拼接TS分段失败 ({job.output_filename}): {e}", failure
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class BatchCancelled(Exception):
+    # Raised by a job worker to stop every job that has not started yet
+    pass
+
+
+def run_batch(jobs, worker, concurrency=None, on_job_done=None, cancel_event=None, scheduler=None):
+    # Runs worker(job) for every job on a thread pool. Jobs that have not started when
+    # cancel_event is set (or when a worker raises BatchCancelled) are left untouched.
+    # The scheduler decides which pending job a free worker takes next; by default jobs
+    # run in order, limited only by concurrency.
+    # on_job_done(job, completed_count, total) is called from the worker thread.
+    # Returns the list of jobs that actually ran.
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    if scheduler is None:
+        scheduler = IoScheduler()
+    scheduler.plan(jobs)
+    total = len(jobs)
+    pending = list(jobs)
+    completed = []
+    completed_lock = threading.Lock()
+
+    def run_one(job):
+        try:
+            worker(job)
+        except BatchCancelled:
+            cancel_event.set()
+        with completed_lock:
+            completed.append(job)
+            done_count = len(completed)
+        if on_job_done:
+            on_job_done(job, done_count, total)
+
+    def run_worker():
+        # One pool thread: keeps taking jobs until none are left or the batch is cancelled
+        errors = []
+        while True:
+            job = scheduler.next_job(pending, cancel_event)
+            if job is None:
+                return errors
+            try:
+                run_one(job)
+            except Exception as e: # Reported after the batch; the other jobs still run
+                errors.append(e)
+            finally:
+                scheduler.job_finished(job)
+
+    workers = max(1, concurrency or default_concurrency())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker) for _ in range(workers)]
+        try:
+            errors = [error for future in futures for error in future.result()]
+        except KeyboardInterrupt: # Ctrl+C: let the running jobs finish, start no new ones
+            cancel_event.set()
+            raise
+    if errors:
+        raise errors[0] # Re-raise unexpected worker errors
+    return completed
+
+
+class JobStream:
+    # run_batch for jobs that keep arriving (watch mode): concurrency worker threads take
+    # submitted jobs in the scheduler's order, under the same per-device limits. A worker
+    # raising BatchCancelled stops the stream; unexpected errors are collected in errors.
+    # on_job_done(job) is called from the worker thread.
+    def __init__(self, worker, concurrency=None, scheduler=None, on_job_done=None, stop_event=None):
+        self.worker = worker
+        self.scheduler = scheduler or IoScheduler()
+        self.on_job_done = on_job_done
+        self.pending = []
+        self.stop_event = stop_event or threading.Event()
+        self.errors = []
+        self.threads = [threading.Thread(target=self._run_worker, daemon=True)
+                        for _ in range(max(1, concurrency or default_concurrency()))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job):
+        with self.scheduler.condition:
+            self.scheduler.plan([job])
+            self.pending.append(job)
+            self.scheduler.condition.notify_all()
+
+    def _run_worker(self):
+        condition = self.scheduler.condition
+        while not self.stop_event.is_set():
+            with condition:
+                if not self.pending:
+                    condition.wait(0.5)
+                    continue
+            job = self.scheduler.next_job(self.pending, self.stop_event)
+            if job is None:
+                continue
+            try:
+                self.worker(job)
+            except BatchCancelled:
+                self.stop_event.set()
+            except Exception as e: # Reported by the caller; the stream keeps going
+                self.errors.append(e)
+            finally:
+                self.scheduler.job_finished(job)
+            if self.on_job_done:
+                self.on_job_done(job)
+
+    def close(self):
+        # Waits for running jobs; submitted jobs that have not started are dropped
+        self.stop_event.set()
+        with self.scheduler.condition:
+            self.scheduler.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,125 @@
+# Fast-start ("moov at the front") mp4 output without ffmpeg's second full rewrite.
+# -movflags +faststart makes ffmpeg write the whole file and then shift all media data to
+# make room for moov, i.e. every byte is written twice. Instead:
+#   1. ffmpeg reserves room for moov right after ftyp (-moov_size), sized from the playlist
+#      duration and the frame rates of its first segment, and fills it in when muxing ends:
+#      one write of the media data.
+#   2. If the reservation was too small, or the duration is unknown, the finished file
+#      (moov at the end) is rewritten once with moov moved before mdat and its chunk offsets
+#      patched. The media data is copied in the kernel (copy_file_range / sendfile), which
+#      on copy-on-write filesystems shares the blocks instead of writing them again.
+import io
+import os
+import struct
+
+from mp4_probe import iter_boxes
+from ts_concat import copy_fd
+
+# The sample tables are most of moov: per sample 4 bytes of stsz, plus 8 of ctts for video
+# with B-frames. ffmpeg interleaves the tracks, so each track gets about one chunk per frame
+# of the less frequent one: 4 bytes of stco per chunk and track, and up to 12 of stsc for the
+# track whose samples per chunk vary. Measured moovs of 25/30/60 fps H.264 + AAC remuxes come
+# to 85-90% of this estimate.
+MOOV_HEADER_BYTES = 16 * 1024 # mvhd, tkhd, stsd, ... with room to spare
+MOOV_STSS_BYTES_PER_SECOND = 8 # One keyframe every half second at most
+MOOV_MARGIN = 1.05 # A reservation that is too small costs a second ffmpeg run
+DEFAULT_VIDEO_RATE = 30.0 # Frames per second assumed when the segments could not be probed
+DEFAULT_AUDIO_RATE = 48000 / 1024 # AAC frames per second at 48 kHz
+MOOV_TOO_SMALL_MESSAGE = "reserved_moov_size is too small"
+
+# Containers on the path from moov down to the chunk offset tables
+_CONTAINER_BOXES = ('moov', 'trak', 'mdia', 'minf', 'stbl')
+
+
+def reserved_moov_size(duration, layout=None):
+    # Bytes to pass as -moov_size, or None when the duration is unknown. layout is the
+    # ts_concat.SegmentLayout of a segment; without it 30 fps video with B-frames and 48 kHz
+    # AAC are assumed.
+    if not duration:
+        return None
+    if layout is None:
+        video_rate, audio_rate, reordered = DEFAULT_VIDEO_RATE, DEFAULT_AUDIO_RATE, True
+    else:
+        video_rate, reordered = layout.video_rate, layout.reordered
+        audio_rate = DEFAULT_AUDIO_RATE if layout.audio_rate is None else layout.audio_rate
+    rates = [rate for rate in (video_rate, audio_rate) if rate]
+    if not rates:
+        return None
+    chunk_rate = min(rates)
+    per_second = (4 * sum(rates) + (8 * video_rate if reordered else 0) + chunk_rate * (4 * len(rates) + 12)
+                  + MOOV_STSS_BYTES_PER_SECOND)
+    return int((MOOV_HEADER_BYTES + duration * per_second) * MOOV_MARGIN)
+
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type.encode('latin-1')) + payload
+
+
+def _rebuild(data, box_type, delta, use_co64):
+    # Returns the box with every stco/co64 inside it shifted by delta. stco tables are
+    # rewritten as co64 when use_co64 is set (offsets past 4 GiB after the shift).
+    # Raises OverflowError when a 32-bit offset would overflow and use_co64 is not set.
+    if box_type in _CONTAINER_BOXES:
+        children = []
+        for child_type, _, payload_offset, child_end in iter_boxes(io.BytesIO(data), 0, len(data)):
+            children.append(_rebuild(data[payload_offset:child_end], child_type, delta, use_co64))
+        return _box(box_type, b''.join(children))
+    if box_type == 'stco':
+        version_flags, count = struct.unpack('>II', data[:8])
+        offsets = [offset + delta for offset in struct.unpack(f'>{count}I', data[8:8 + 4 * count])]
+        if use_co64:
+            return _box('co64', struct.pack(f'>II{count}Q', version_flags, count, *offsets))
+        if offsets and max(offsets) > 0xFFFFFFFF:
+            raise OverflowError("stco offset overflow")
+        return _box('stco', struct.pack(f'>II{count}I', version_flags, count, *offsets))
+    if box_type == 'co64':
+        version_flags, count = struct.unpack('>II', data[:8])
+        offsets = [offset + delta for offset in struct.unpack(f'>{count}Q', data[8:8 + 8 * count])]
+        return _box('co64', struct.pack(f'>II{count}Q', version_flags, count, *offsets))
+    return _box(box_type, data)
+
+
+def relocate_moov(src_path, dst_path):
+    # Writes src_path to dst_path with moov moved in front of the first mdat. Returns False
+    # (and writes nothing) when src_path is already fast-start. Raises ValueError for files
+    # that are not complete mp4s.
+    with open(src_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        boxes = list(iter_boxes(src, 0, size))
+        moov = next((box for box in boxes if box[0] == 'moov'), None)
+        mdat = next((box for box in boxes if box[0] == 'mdat'), None)
+        if moov is None:
+            raise ValueError("no moov box")
+        if mdat is None or moov[1] < mdat[1]:
+            return False
+        _, moov_start, moov_payload, moov_end = moov
+        src.seek(moov_payload)
+        moov_data = src.read(moov_end - moov_payload)
+        # Everything from the first mdat on moves back by the size of the new moov. Its size
+        # only changes if headers are normalised or stco has to become co64, so at most a
+        # couple of passes settle it.
+        delta = moov_end - moov_start
+        use_co64 = False
+        while True:
+            try:
+                new_moov = _rebuild(moov_data, 'moov', delta, use_co64)
+            except OverflowError:
+                use_co64 = True
+                continue
+            if len(new_moov) == delta:
+                break
+            delta = len(new_moov)
+
+        mdat_start = mdat[1]
+        with open(dst_path, 'wb') as dst:
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+            os.lseek(src_fd, 0, os.SEEK_SET)
+            copy_fd(src_fd, dst_fd, mdat_start) # ftyp and anything else before the media
+            view = memoryview(new_moov)
+            while view:
+                view = view[os.write(dst_fd, view):]
+            os.lseek(src_fd, mdat_start, os.SEEK_SET)
+            copy_fd(src_fd, dst_fd, moov_start - mdat_start)
+            os.lseek(src_fd, moov_end, os.SEEK_SET)
+            copy_fd(src_fd, dst_fd, size - moov_end)
+    return True
@@ -0,0 +1,113 @@
+# Minimal MP4 (ISO BMFF) box reader for checking outputs without starting ffprobe.
+# Only box headers are read; payloads are skipped with seek, so probing a large file
+# costs a handful of small reads.
+import os
+import struct
+
+BOX_HEADER_SIZE = 8
+
+
+def iter_boxes(f, start, end):
+    # Yields (box_type, box_start, payload_offset, box_end) for the boxes between start and end.
+    # Raises ValueError on a box that does not fit, i.e. a truncated or corrupt file.
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        header = f.read(BOX_HEADER_SIZE)
+        if len(header) < BOX_HEADER_SIZE:
+            raise ValueError(f"box header truncated at offset {offset}")
+        size, box_type = struct.unpack('>I4s', header)
+        payload_offset = offset + BOX_HEADER_SIZE
+        if size == 1: # 64-bit largesize follows the type
+            largesize = f.read(8)
+            if len(largesize) < 8:
+                raise ValueError(f"box header truncated at offset {offset}")
+            size = struct.unpack('>Q', largesize)[0]
+            payload_offset += 8
+        elif size == 0: # Box extends to the end of the enclosing range
+            size = end - offset
+        box_end = offset + size
+        if box_end < payload_offset or box_end > end:
+            raise ValueError(f"box '{box_type.decode('latin-1')}' at offset {offset} extends past the end")
+        yield box_type.decode('latin-1'), offset, payload_offset, box_end
+        offset = box_end
+
+
+def top_level_boxes(path):
+    # [(box_type, box_start, payload_offset, box_end)] of the whole file; ValueError if truncated
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        return list(iter_boxes(f, 0, end))
+
+
+def has_complete_moov(path):
+    # True when every top-level box is complete and one of them is the moov index
+    try:
+        return any(box[0] == 'moov' for box in top_level_boxes(path))
+    except (OSError, ValueError):
+        return False
+
+
+class Mp4Info:
+    def __init__(self):
+        self.duration = None # Seconds, from mvhd
+        self.track_types = [] # hdlr handler type of every trak, e.g. ['vide', 'soun']
+        self.moov_offset = None
+        self.mdat_offset = None # First mdat
+
+    def is_fast_start(self):
+        # moov before the media data: playback can start before the whole file is read
+        return self.moov_offset is not None and (self.mdat_offset is None or self.moov_offset < self.mdat_offset)
+
+
+def _find_box(f, start, end, wanted):
+    for box_type, _, payload_offset, box_end in iter_boxes(f, start, end):
+        if box_type == wanted:
+            return payload_offset, box_end
+    return None
+
+
+def _read_mvhd_duration(f, payload_offset):
+    f.seek(payload_offset)
+    version = f.read(1)[0]
+    if version == 1:
+        f.seek(payload_offset + 4 + 16) # version/flags, 64-bit creation and modification times
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(payload_offset + 4 + 8)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    return duration / timescale if timescale else None
+
+
+def _read_handler_type(f, trak_start, trak_end):
+    mdia = _find_box(f, trak_start, trak_end, 'mdia')
+    if mdia is None:
+        return None
+    hdlr = _find_box(f, mdia[0], mdia[1], 'hdlr')
+    if hdlr is None:
+        return None
+    f.seek(hdlr[0] + 8) # version/flags and pre_defined
+    return f.read(4).decode('latin-1')
+
+
+def probe_mp4(path):
+    # Duration, tracks and layout from the box headers and the few small boxes that carry
+    # them. Raises ValueError when the file is truncated or has no moov.
+    info = Mp4Info()
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        moov = None
+        for box_type, box_start, payload_offset, box_end in list(iter_boxes(f, 0, end)):
+            if box_type == 'moov' and moov is None:
+                moov = (payload_offset, box_end)
+                info.moov_offset = box_start
+            elif box_type == 'mdat' and info.mdat_offset is None:
+                info.mdat_offset = box_start
+        if moov is None:
+            raise ValueError("no moov box")
+        for box_type, _, payload_offset, box_end in list(iter_boxes(f, moov[0], moov[1])):
+            if box_type == 'mvhd':
+                info.duration = _read_mvhd_duration(f, payload_offset)
+            elif box_type == 'trak':
+                info.track_types.append(_read_handler_type(f, payload_offset, box_end))
+    return info
@@ -0,0 +1,80 @@
+# Post-conversion check of a finished output before it replaces the final file.
+# mp4 outputs are probed with mp4_probe (box headers only, no ffprobe process): the moov
+# index must be present, the duration must match the playlist and the stream count must
+# match what ffmpeg mapped. .ts outputs are checked for whole, synchronised packets.
+import os
+
+from mp4_probe import probe_mp4
+from ts_concat import TS_PACKET_SIZE, TS_SYNC_BYTE
+
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_RATIO = 0.01 # Long lectures may drift a little more than a second
+
+
+class VerifyResult:
+    def __init__(self):
+        self.problems = []
+        self.duration = None
+        self.streams = None
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def to_dict(self):
+        # Stored with the history entry
+        return {
+            "ok": self.ok,
+            "duration": round(self.duration, 3) if self.duration is not None else None,
+            "streams": self.streams,
+            "problems": self.problems,
+        }
+
+
+def duration_tolerance(expected_duration):
+    return max(DURATION_TOLERANCE_SECONDS, expected_duration * DURATION_TOLERANCE_RATIO)
+
+
+def verify_output(path, expected_duration=None, expected_streams=None, expect_fast_start=False):
+    result = VerifyResult()
+    try:
+        if path.lower().endswith(('.ts', '.ts.part')):
+            _verify_ts(path, result)
+        else:
+            _verify_mp4(path, result, expected_duration, expected_streams, expect_fast_start)
+    except OSError as e:
+        result.problems.append(f"无法读取输出文件: {e}")
+    return result
+
+
+def _verify_mp4(path, result, expected_duration, expected_streams, expect_fast_start):
+    try:
+        info = probe_mp4(path)
+    except ValueError as e:
+        result.problems.append(f"文件不完整或缺少 moov: {e}")
+        return
+    result.duration = info.duration
+    if expect_fast_start and not info.is_fast_start():
+        result.problems.append("moov 不在媒体数据之前 (非快速启动)")
+    result.streams = len(info.track_types)
+    if result.streams == 0:
+        result.problems.append("输出中没有音视频流")
+    elif expected_streams and result.streams != expected_streams:
+        result.problems.append(f"流数量 {result.streams} 与预期 {expected_streams} 不符")
+    if expected_duration and info.duration is not None:
+        if abs(info.duration - expected_duration) > duration_tolerance(expected_duration):
+            result.problems.append(f"时长 {info.duration:.1f}s 与播放列表 {expected_duration:.1f}s 不符")
+
+
+def _verify_ts(path, result):
+    # Duration is not checked for .ts: that would mean parsing PES timestamps of the whole file
+    size = os.path.getsize(path)
+    if size == 0 or size % TS_PACKET_SIZE:
+        result.problems.append(f"文件大小 {size} 不是完整的 TS 包")
+        return
+    with open(path, 'rb') as f:
+        first = f.read(1)
+        f.seek(size - TS_PACKET_SIZE)
+        last = f.read(1)
+    if first[0] != TS_SYNC_BYTE or last[0] != TS_SYNC_BYTE:
+        result.problems.append("TS 同步字节错误")
@@ -0,0 +1,95 @@
+# What to do when a job's output file already exists, decided once per batch.
+# Every job resolves against the same policy without waiting on the user; the decisions are
+# collected so the GUI can show a single summary when the batch is done.
+import os
+import threading
+
+from merge_core import PART_SUFFIX, STATUS_EXISTS_SKIPPED, STATUS_NEWER_SKIPPED, STATUS_VALID_SKIPPED
+from mp4_probe import has_complete_moov
+from ts_concat import TS_PACKET_SIZE, looks_like_mpegts
+
+POLICY_OVERWRITE = "overwrite"
+POLICY_SKIP = "skip"
+POLICY_SKIP_IF_NEWER = "skip-if-newer" # Keep outputs written after their sources last changed
+POLICY_SKIP_IF_VALID = "skip-if-valid" # Keep outputs that are complete files
+POLICY_RENAME = "rename" # Write next to it as name_1.mp4, name_2.mp4, ...
+POLICIES = (POLICY_SKIP, POLICY_OVERWRITE, POLICY_SKIP_IF_NEWER, POLICY_SKIP_IF_VALID, POLICY_RENAME)
+
+DECISION_OVERWRITE = "overwrite"
+DECISION_SKIP = "skip"
+DECISION_RENAME = "rename"
+
+
+def output_looks_valid(path):
+    # Complete container: an mp4 whose boxes are all whole and include moov, or a .ts file
+    # made of whole packets
+    try:
+        if path.lower().endswith('.ts'):
+            size = os.path.getsize(path)
+            return size > 0 and size % TS_PACKET_SIZE == 0 and looks_like_mpegts(path)
+        return has_complete_moov(path)
+    except OSError:
+        return False
+
+
+def newest_source_mtime(job):
+    # The subfolder's own mtime changes when segments are added, removed or renamed
+    mtimes = [os.path.getmtime(job.subfolder_path)]
+    mtimes.extend(os.path.getmtime(path) for path in job.m3u8_paths() if os.path.exists(path))
+    return max(mtimes)
+
+
+class OverwritePolicy:
+    def __init__(self, policy=POLICY_SKIP):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overwrite policy: {policy}")
+        self.policy = policy
+        self.decisions = [] # (folder_name, output_filename, decision) for existing outputs
+        self._reserved = set() # Output paths handed out by rename and not written yet
+        self._lock = threading.Lock()
+
+    def resolve(self, job):
+        # Returns None when the job should convert (for POLICY_RENAME job's output name may
+        # have been changed to a free one), or the status to record when it is skipped
+        if not os.path.exists(job.output_path):
+            return None
+        status = None
+        if self.policy == POLICY_SKIP:
+            status = STATUS_EXISTS_SKIPPED
+        elif self.policy == POLICY_SKIP_IF_NEWER:
+            if os.path.getmtime(job.output_path) >= newest_source_mtime(job):
+                status = STATUS_NEWER_SKIPPED
+        elif self.policy == POLICY_SKIP_IF_VALID:
+            if output_looks_valid(job.output_path):
+                status = STATUS_VALID_SKIPPED
+        elif self.policy == POLICY_RENAME:
+            original = job.output_filename
+            job.set_output_filename(self._free_filename(job))
+            self._record(job.folder_name, f"{original} -> {job.output_filename}", DECISION_RENAME)
+            return None
+        self._record(job.folder_name, job.output_filename, DECISION_SKIP if status else DECISION_OVERWRITE)
+        return status
+
+    def _free_filename(self, job):
+        base, ext = os.path.splitext(job.output_filename)
+        with self._lock:
+            n = 1
+            while True:
+                filename = f"{base}_{n}{ext}"
+                path = os.path.join(job.output_folder, filename)
+                if path not in self._reserved and not os.path.exists(path) and not os.path.exists(path + PART_SUFFIX):
+                    self._reserved.add(path)
+                    return filename
+                n += 1
+
+    def _record(self, folder_name, output_filename, decision):
+        with self._lock:
+            self.decisions.append((folder_name, output_filename, decision))
+
+    def summary(self):
+        # {decision: [output filenames]} for the outputs that already existed
+        with self._lock:
+            result = {}
+            for _, output_filename, decision in self.decisions:
+                result.setdefault(decision, []).append(output_filename)
+            return result
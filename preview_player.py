@@ -0,0 +1,121 @@
+# Preview playback for the rename window with decoding off the Tk thread.
+# A decoder thread reads the video with OpenCV, converts and scales every frame to the
+# preview canvas and puts it on a small bounded queue as a PIL image. The Tk side only takes
+# the frame that is due and pastes it into one reused PhotoImage. When decoding falls behind
+# the wall clock, frames are skipped with grab() (no retrieve, colour conversion or scaling),
+# and a lag of more than MAX_LAG_SECONDS is closed with one seek instead.
+import queue
+import threading
+import time
+
+from thumbnail_cache import fit_size
+
+QUEUE_FRAMES = 8 # About a quarter second at 30 fps
+MAX_LAG_SECONDS = 1.0
+DEFAULT_FPS = 25.0 # When the container does not report one
+
+
+class PreviewPlayer:
+    def __init__(self, path, box_size, duration_limit=None, start_seconds=0.0):
+        self.path = path
+        self.box_size = box_size
+        self.duration_limit = duration_limit # Seconds of video to play, None for all of it
+        self.start_seconds = start_seconds
+        self.frames = queue.Queue(maxsize=QUEUE_FRAMES) # (seconds, PIL image); None at the end
+        self.stop_event = threading.Event()
+        self.error = None # Set by the decoder when the video cannot be opened
+        self.frame_size = None # (width, height) of the scaled frames, known after the first one
+        self.skipped_frames = 0
+        self.started = None # time.monotonic() of the first frame shown
+        self.thread = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def position(self):
+        # Seconds of video that should be on screen now
+        if self.started is None:
+            return self.start_seconds
+        return self.start_seconds + time.monotonic() - self.started
+
+    def next_frame(self):
+        # Called on the Tk thread every tick. Returns the newest frame that is due, None when
+        # none is due yet, or raises EOFError once playback has ended. Older frames that
+        # became due in the same tick are dropped in favour of the newest.
+        due = None
+        while True:
+            try:
+                item = self.frames.queue[0] # Peek; only the Tk thread takes frames
+            except IndexError:
+                return due
+            if item is None:
+                if due is None:
+                    raise EOFError
+                return due
+            seconds, image = item
+            if self.started is None:
+                # The clock starts with the first frame on screen, wherever the decoder began
+                self.started = time.monotonic() - (seconds - self.start_seconds)
+            if seconds > self.position():
+                return due
+            self.frames.get_nowait()
+            due = image
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self):
+        try:
+            import cv2
+            from PIL import Image
+            cap = cv2.VideoCapture(self.path)
+        except Exception as e: # cv2/PIL missing
+            self.error = str(e)
+            self._put(None)
+            return
+        try:
+            if not cap.isOpened():
+                self.error = "无法打开视频文件进行预览。"
+                return
+            fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+            if self.start_seconds:
+                cap.set(cv2.CAP_PROP_POS_MSEC, self.start_seconds * 1000)
+            end_seconds = self.start_seconds + self.duration_limit if self.duration_limit else None
+            seeked = False
+            while not self.stop_event.is_set():
+                lag = self.position() - cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if self.started is not None and lag > MAX_LAG_SECONDS and not seeked:
+                    cap.set(cv2.CAP_PROP_POS_MSEC, self.position() * 1000)
+                    seeked = True # Once per shown frame, in case the seek lands short of the target
+                    continue
+                if self.started is not None and lag > 1 / fps:
+                    # Behind by at least a frame: skip it without building an image
+                    if not cap.grab():
+                        break
+                    self.skipped_frames += 1
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                seeked = False
+                seconds = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if end_seconds is not None and seconds > end_seconds:
+                    break
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                img_h, img_w = frame.shape[:2]
+                self.frame_size = fit_size(img_w, img_h, *self.box_size)
+                frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+                if not self._put((seconds, Image.fromarray(frame))):
+                    break
+        finally:
+            cap.release()
+            self._put(None)
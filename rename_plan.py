@@ -0,0 +1,239 @@
+# Batch rename that either happens completely or not at all.
+# plan_renames turns the requested original -> new names into an ordered list of single
+# os.rename steps: a file is only moved onto a name once the file holding that name has been
+# moved away, and cycles (a -> b, b -> a) are broken by parking one file under a temporary
+# name. Requests that cannot be carried out (missing source, target taken by a file outside
+# the batch, two files onto one name) are reported as conflicts instead of being attempted.
+# RenameBatch records the plan in a JSON lines journal in the folder before the first rename
+# and one line per finished step, so after a failure the steps done so far are undone, and
+# after a crash the batch can be finished or rolled back. The journal of the last completed
+# batch is kept so it can be undone as a whole.
+import json
+import os
+import uuid
+from datetime import datetime
+
+JOURNAL_FILENAME = ".rename_journal.jsonl"
+TEMP_PREFIX = ".renaming-"
+
+STATE_RUNNING = "running" # Started and not finished: interrupted by a crash
+STATE_ROLLING_BACK = "rolling_back" # Undo started and not finished
+STATE_COMMITTED = "committed"
+STATE_ROLLED_BACK = "rolled_back"
+
+CONFLICT_MISSING = "原文件不存在"
+CONFLICT_TARGET_EXISTS = "目标文件已存在"
+CONFLICT_DUPLICATE_TARGET = "多个文件重命名为同一名称"
+CONFLICT_INVALID_NAME = "文件名无效"
+
+
+class RenameConflict:
+    def __init__(self, original, new, reason):
+        self.original = original
+        self.new = new
+        self.reason = reason
+
+
+class RenamePlan:
+    def __init__(self, folder, moves, steps, conflicts):
+        self.folder = folder
+        self.moves = moves # [(original, new)] that will be carried out
+        self.steps = steps # [(source, target)] os.rename calls in order, temporary names included
+        self.conflicts = conflicts # [RenameConflict] left out of the plan
+
+
+class RenameFailed(Exception):
+    def __init__(self, step, error, rolled_back):
+        super().__init__(f"无法重命名 '{step[0]}' 为 '{step[1]}': {error}")
+        self.step = step
+        self.error = error
+        self.rolled_back = rolled_back # False when undoing the finished steps failed as well
+
+
+def _name_key(name):
+    # Windows and macOS volumes are usually case-insensitive: "A.mp4" and "a.mp4" are one file
+    return os.path.normcase(name).lower()
+
+
+def plan_renames(folder, renames):
+    # renames: [(original, new)] file names inside folder
+    conflicts = []
+    moves = {} # original -> new
+    targets = {} # name key -> original moving onto it
+    duplicates = set()
+    for original, new in renames:
+        if original == new:
+            continue
+        if not new or os.path.basename(new) != new or new in ('.', '..'):
+            conflicts.append(RenameConflict(original, new, CONFLICT_INVALID_NAME))
+        elif not os.path.exists(os.path.join(folder, original)):
+            conflicts.append(RenameConflict(original, new, CONFLICT_MISSING))
+        elif _name_key(new) in targets:
+            duplicates.add(_name_key(new))
+            conflicts.append(RenameConflict(original, new, CONFLICT_DUPLICATE_TARGET))
+        else:
+            moves[original] = new
+            targets[_name_key(new)] = original
+    for key in duplicates: # The first file asking for the name loses it too
+        original = targets.pop(key)
+        conflicts.append(RenameConflict(original, moves.pop(original), CONFLICT_DUPLICATE_TARGET))
+
+    # A target may only be taken by a file that moves away as part of the batch. Dropping one
+    # move can strand another (c -> a needs a -> b), so repeat until nothing changes.
+    changed = True
+    while changed:
+        changed = False
+        sources = {_name_key(original): original for original in moves}
+        for original, new in list(moves.items()):
+            target_path = os.path.join(folder, new)
+            if not os.path.exists(target_path):
+                continue
+            occupant = sources.get(_name_key(new))
+            if occupant is None or not os.path.samefile(os.path.join(folder, occupant), target_path):
+                del moves[original]
+                conflicts.append(RenameConflict(original, new, CONFLICT_TARGET_EXISTS))
+                changed = True
+    return RenamePlan(folder, list(moves.items()), _order_steps(moves), conflicts)
+
+
+def _order_steps(moves):
+    # Moves whose target is free go first; what is left is cycles, each broken by parking
+    # one file under a temporary name. A change of case only is also done through a
+    # temporary name, since the file "occupies" its own target on case-insensitive volumes.
+    pending = {}
+    steps = []
+    for original, new in moves.items():
+        if _name_key(original) == _name_key(new):
+            temp = TEMP_PREFIX + uuid.uuid4().hex
+            steps.append((original, temp))
+            pending[temp] = new
+        else:
+            pending[original] = new
+    while pending:
+        sources = {_name_key(source) for source in pending}
+        ready = [source for source, target in pending.items() if _name_key(target) not in sources]
+        if ready:
+            for source in ready:
+                steps.append((source, pending.pop(source)))
+            continue
+        source = next(iter(pending))
+        temp = TEMP_PREFIX + uuid.uuid4().hex
+        steps.append((source, temp))
+        pending[temp] = pending.pop(source)
+    return steps
+
+
+class RenameBatch:
+    def __init__(self, folder, steps, done=0, state=STATE_RUNNING):
+        self.folder = folder
+        self.steps = steps
+        self.done = done # Steps 0..done-1 have been carried out
+        self.state = state
+        self.path = os.path.join(folder, JOURNAL_FILENAME)
+
+    @classmethod
+    def begin(cls, plan):
+        # Writes the journal for a new batch, replacing the one of the previous batch
+        batch = cls(plan.folder, plan.steps)
+        tmp_path = batch.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            header = {"created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "steps": plan.steps}
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, batch.path)
+        return batch
+
+    @classmethod
+    def load(cls, folder):
+        # The batch recorded in folder's journal, None when there is none
+        path = os.path.join(folder, JOURNAL_FILENAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue # Torn line from a crash mid-write
+        if not records or "steps" not in records[0]:
+            return None
+        batch = cls(folder, [tuple(step) for step in records[0]["steps"]])
+        for record in records[1:]:
+            batch.done = record.get("done", batch.done)
+            batch.state = record.get("state", batch.state)
+        if batch.state == STATE_RUNNING:
+            batch._recover_last_step()
+        return batch
+
+    @property
+    def unfinished(self):
+        return self.state in (STATE_RUNNING, STATE_ROLLING_BACK)
+
+    def _recover_last_step(self):
+        # The crash may have come between a rename and its journal line: the step is done
+        # when its source is gone and its target is there
+        while self.done < len(self.steps):
+            source, target = self.steps[self.done]
+            if os.path.exists(self._path(source)) or not os.path.exists(self._path(target)):
+                break
+            self.done += 1
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _append(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _set_state(self, state):
+        self.state = state
+        self._append({"done": self.done, "state": state})
+
+    def run(self, on_step=None):
+        # Carries out the remaining steps. On failure the finished ones are undone and
+        # RenameFailed is raised. on_step(done, total) is called after every step.
+        while self.done < len(self.steps):
+            step = self.steps[self.done]
+            try:
+                os.rename(self._path(step[0]), self._path(step[1]))
+            except OSError as e:
+                try:
+                    self.rollback()
+                except OSError:
+                    raise RenameFailed(step, e, False)
+                raise RenameFailed(step, e, True)
+            self.done += 1
+            self._append({"done": self.done})
+            if on_step:
+                on_step(self.done, len(self.steps))
+        self._set_state(STATE_COMMITTED)
+
+    def rollback(self, on_step=None):
+        # Undoes the finished steps, last first. Raises OSError when one cannot be undone;
+        # the journal then still describes what is left to undo.
+        total = self.done
+        if self.state != STATE_ROLLING_BACK:
+            self._set_state(STATE_ROLLING_BACK) # From here on the batch can only be finished by undoing it
+        while self.done > 0:
+            source, target = self.steps[self.done - 1]
+            # Already undone when a crash came before its journal line
+            if not (os.path.exists(self._path(source)) and not os.path.exists(self._path(target))):
+                os.rename(self._path(target), self._path(source))
+            self.done -= 1
+            self._append({"done": self.done})
+            if on_step:
+                on_step(total - self.done, total)
+        self._set_state(STATE_ROLLED_BACK)
+
+    def moves(self):
+        # [(original, new)] of the whole batch, for display
+        names = {}
+        for source, target in self.steps:
+            names[target] = names.pop(source, source)
+        return [(original, new) for new, original in names.items() if not new.startswith(TEMP_PREFIX)]
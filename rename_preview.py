@@ -0,0 +1,99 @@
+# Rule-based rename preview for the rename window, cheap enough to recompute on every rule
+# change. Folder listings come from one os.scandir pass (the file type comes with the
+# directory entry, so there is no stat per file as with listdir + isfile) and are cached
+# until the directory's mtime changes, which every create, delete or rename inside it does.
+# The program's own files are never listed: the output folder, the usual place to rename in,
+# also holds the skip cache, the job manifest, the rename journal, their .tmp files, the
+# planner's .renaming-* temporaries (all dotfiles) and .part outputs still being written.
+# Renaming those would break skipping and resuming and shift the sequence numbers.
+# The preview itself is a pure function of the listing and the rules, so it can run on a
+# worker thread, and diff_rows works out the few Treeview rows that actually changed.
+import os
+import threading
+
+from merge_core import PART_SUFFIX
+
+
+def _is_listed(name):
+    return not name.startswith('.') and not name.endswith(PART_SUFFIX)
+
+
+class FolderListingCache:
+    def __init__(self):
+        self._listings = {} # folder -> (mtime_ns, sorted file names)
+        self._lock = threading.Lock()
+
+    def list_files(self, folder):
+        # Sorted names of the regular files in folder. Raises OSError when it cannot be read.
+        mtime_ns = os.stat(folder).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(folder)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        with os.scandir(folder) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file() and _is_listed(entry.name))
+        with self._lock:
+            self._listings[folder] = (mtime_ns, names)
+        return names
+
+    def invalidate(self, folder):
+        # For file systems whose directory mtime is too coarse to notice a change made in the
+        # same second (FAT, some network shares)
+        with self._lock:
+            self._listings.pop(folder, None)
+
+
+class RenameRules:
+    def __init__(self, find="", replace="", prefix="", suffix="", use_sequence=False, sequence_start=1):
+        self.find = find
+        self.replace = replace
+        self.prefix = prefix
+        self.suffix = suffix
+        self.use_sequence = use_sequence
+        self.sequence_start = sequence_start
+
+
+def apply_rules(files, rules):
+    # [(original, new)] for the sorted file names
+    rows = []
+    for i, original_filename in enumerate(files):
+        base, ext = os.path.splitext(original_filename)
+        new_base = base
+
+        if rules.find: # Find and Replace
+            new_base = new_base.replace(rules.find, rules.replace)
+
+        if rules.prefix: # Add Prefix
+            new_base = rules.prefix + new_base
+
+        if rules.suffix: # Add Suffix
+            new_base = new_base + rules.suffix
+
+        if rules.use_sequence: # Add Sequence Number
+            # Format sequence number, e.g., _001, _002
+            sequence_num_str = f"_{rules.sequence_start + i:03d}"
+            # If no other rule applied, the sequence becomes the name; otherwise it is appended
+            if new_base == base and not rules.prefix and not rules.suffix and not rules.find:
+                new_base = f"file{sequence_num_str}"
+            else:
+                new_base += sequence_num_str
+
+        rows.append((original_filename, new_base + ext))
+    return rows
+
+
+def diff_rows(shown, rows):
+    # shown: {original: new} currently in the tree; rows: the new [(original, new)] in order.
+    # Returns (originals to delete, [(index, original, new)] to insert, {original: new} to update).
+    # Both sides are sorted by original name, so rows that stay keep their relative order and
+    # inserting the new ones at their final index leaves the whole list in order.
+    wanted = dict(rows)
+    removed = [original for original in shown if original not in wanted]
+    inserted = []
+    updated = {}
+    for index, (original, new) in enumerate(rows):
+        if original not in shown:
+            inserted.append((index, original, new))
+        elif shown[original] != new:
+            updated[original] = new
+    return removed, inserted, updated
@@ -0,0 +1,83 @@
+# Skip cache for already-converted subfolders, kept in the output folder across batches.
+# Each successful conversion records the source fingerprint of its subfolder together with
+# the size and mtime of the mp4 it produced. On the next run an unchanged subfolder whose
+# mp4 is still exactly that file is skipped without starting ffmpeg or asking anything, and
+# a subfolder whose sources changed is reconverted over its own earlier output.
+import json
+import os
+import threading
+
+from m3u8_playlist import folder_fingerprint
+
+CACHE_FILENAME = ".merge_cache.jsonl"
+
+CACHE_FRESH = "fresh" # Sources unchanged and output intact: skip
+CACHE_STALE = "stale" # Output is ours but the sources changed: reconvert without asking
+
+
+class ConversionCache:
+    def __init__(self, output_folder):
+        self.path = os.path.join(output_folder, CACHE_FILENAME)
+        self.records = {} # absolute subfolder path -> latest record
+        self._lock = threading.Lock()
+        self._load()
+        self._compact()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Torn line from a crash mid-write
+                self.records[record["source"]] = record
+
+    def _compact(self):
+        # One line per subfolder; older lines for the same folder are dropped
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self.records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def check(self, job):
+        # CACHE_FRESH, CACHE_STALE, or None when the cache knows nothing reliable about the
+        # output (never converted here, or the mp4 was replaced or edited by someone else). When
+        # the output is ours, the job's output name is switched to the recorded one, which
+        # differs when the rename overwrite policy picked another name at the time.
+        record = self.records.get(os.path.abspath(job.subfolder_path))
+        job.fingerprint = folder_fingerprint(job.m3u8_paths())
+        if record is None or not record.get("output"):
+            return None
+        if os.path.splitext(record["output"])[1] != os.path.splitext(job.output_filename)[1]:
+            return None # Converted with another engine
+        try:
+            st = os.stat(os.path.join(job.output_folder, record["output"]))
+        except OSError:
+            return None
+        if st.st_size != record.get("output_size") or st.st_mtime_ns != record.get("output_mtime_ns"):
+            return None
+        job.set_output_filename(record["output"])
+        if record.get("fingerprint") == job.fingerprint:
+            return CACHE_FRESH
+        return CACHE_STALE
+
+    def record(self, job):
+        # Call after job.output_path was (re)written from the job's sources. The fingerprint
+        # is taken before the conversion when possible, so sources that change while ffmpeg
+        # runs are picked up as stale next time.
+        st = os.stat(job.output_path)
+        record = {
+            "source": os.path.abspath(job.subfolder_path),
+            "fingerprint": job.fingerprint or folder_fingerprint(job.m3u8_paths()),
+            "output": job.output_filename,
+            "output_size": st.st_size,
+            "output_mtime_ns": st.st_mtime_ns,
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.records[record["source"]] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
@@ -0,0 +1,174 @@
+# First-frame thumbnails for the rename window.
+# Opening a multi-GB lecture with cv2.VideoCapture and decoding a frame takes hundreds of ms,
+# so thumbnails are made once on a background thread, downscaled to the preview canvas and
+# stored as PNG files keyed by path, mtime and size. A changed file gets a new key, so a
+# stale thumbnail is never shown. Recently used ones are also kept in memory (LRU).
+# Nothing in here touches Tk: results are handed to on_ready(path, png_bytes) on the worker
+# thread, png_bytes None when the video could not be decoded.
+import collections
+import hashlib
+import os
+import threading
+
+THUMBNAIL_SIZE = (320, 180) # The preview canvas of the rename window
+MEMORY_ITEMS = 128 # ~50 KB each
+DISK_ITEMS = 2000 # Oldest files beyond this are removed once per session
+
+
+def fit_size(width, height, box_width, box_height):
+    # Largest size with the frame's aspect ratio that fits inside the box
+    scale = min(box_width / width, box_height / height)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def read_first_frame(path, box_size):
+    # BGR frame scaled to fit box_size, or None when the video cannot be decoded
+    import cv2 # Only the worker thread needs OpenCV
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        img_h, img_w = frame.shape[:2]
+        return cv2.resize(frame, fit_size(img_w, img_h, *box_size), interpolation=cv2.INTER_AREA)
+    finally:
+        cap.release()
+
+
+def encode_png(frame):
+    import cv2
+    ok, data = cv2.imencode('.png', frame)
+    return data.tobytes() if ok else None
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, on_ready=None, size=THUMBNAIL_SIZE, memory_items=MEMORY_ITEMS):
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.size = size
+        self.memory_items = memory_items
+        self.memory = collections.OrderedDict() # key -> PNG bytes, most recently used last
+        self.failed = set() # Keys of videos that could not be decoded
+        self.queue = collections.deque() # Paths waiting for the worker; urgent ones at the front
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def _key(self, path):
+        st = os.stat(path)
+        identity = f"{os.path.abspath(path)}\0{st.st_mtime_ns}\0{st.st_size}\0{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".png")
+
+    def _remember(self, key, data):
+        with self.condition:
+            self.memory[key] = data
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def get(self, path):
+        # PNG bytes of a cached thumbnail, or None when it still has to be made
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        with self.condition:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def request(self, path, urgent=False):
+        # Queues path for the worker; urgent requests (the selected file) go first
+        with self.condition:
+            if path in self.queue:
+                self.queue.remove(path)
+            if urgent:
+                self.queue.appendleft(path)
+            else:
+                self.queue.append(path)
+            self._start_worker()
+            self.condition.notify()
+
+    def prefetch(self, paths):
+        # Replaces whatever is still queued with the videos of a newly opened folder
+        with self.condition:
+            self.queue.clear()
+            self.queue.extend(paths)
+            self._start_worker()
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.queue.clear()
+
+    def _start_worker(self):
+        # Called with the condition held
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def _run(self):
+        self._prune_disk()
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                path = self.queue.popleft()
+            data = self.get(path)
+            if data is None:
+                data = self._generate(path)
+            if self.on_ready:
+                self.on_ready(path, data)
+
+    def _generate(self, path):
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        if key in self.failed:
+            return None
+        try:
+            frame = read_first_frame(path, self.size)
+            data = encode_png(frame) if frame is not None else None
+        except Exception as e: # cv2 missing or a decoder error; the preview just stays empty
+            print(f"Error creating thumbnail for {path}: {e}")
+            data = None
+        if data is None:
+            self.failed.add(key)
+            return None
+        self._remember(key, data)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._disk_path(key) + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            pass # Still served from memory for this session
+        return data
+
+    def _prune_disk(self):
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".png")]
+        except OSError:
+            return
+        if len(entries) <= DISK_ITEMS:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - DISK_ITEMS]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
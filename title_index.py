@@ -0,0 +1,74 @@
+# Fuzzy search over scraped course titles for the rename window.
+# difflib.get_close_matches runs a SequenceMatcher against every title on every keystroke.
+# Instead, every title is split once into character bigrams (which suits Chinese titles,
+# where two characters are usually one word, as well as Latin ones) and an inverted index
+# maps each bigram to the titles containing it. A query only touches the posting lists of
+# its own bigrams. Titles found there are ranked mostly by how many of the query's bigrams
+# they contain, then by Dice similarity (which prefers titles close to the query's length),
+# with a bonus when the query occurs in the title verbatim.
+import collections
+import heapq
+import itertools
+import re
+
+MAX_RESULTS = 200 # More than anyone scrolls through; keeps the listbox refill cheap
+MIN_SCORE = 0.3 # Same cutoff the difflib matcher used
+SUBSTRING_BONUS = 0.5
+COVERAGE_WEIGHT = 0.8 # The rest of the base score is Dice similarity
+# Bigrams in more than this share of the titles ("第1", "讲 " ...) are too common to find
+# candidates with; they are only counted for the candidates the rarer bigrams turned up.
+COMMON_GRAM_RATIO = 0.05
+_IGNORED_CHARS_RE = re.compile(r"[\s\-_.,:;!?()\[\]【】（）《》“”\"'、，。：；！？·]+")
+
+
+def normalize(text):
+    return _IGNORED_CHARS_RE.sub('', text.lower())
+
+
+def bigrams(text):
+    # Set of the normalised text's character bigrams; a single character is its own gram
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class TitleIndex:
+    def __init__(self, titles):
+        self.titles = list(titles)
+        self.normalized = [normalize(title) for title in self.titles]
+        self.gram_counts = []
+        self.postings = collections.defaultdict(list) # bigram -> [title index]
+        for index, text in enumerate(self.normalized):
+            grams = bigrams(text)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(index)
+
+    def search(self, query, limit=MAX_RESULTS, min_score=MIN_SCORE):
+        # [(score, title)] best first. Scores are in [0, 1 + SUBSTRING_BONUS].
+        query = normalize(query)
+        if not query:
+            return []
+        if len(query) == 1:
+            # One character has no bigrams; a scan for it is still only a substring test per title
+            return [(1.0, self.titles[i]) for i, text in enumerate(self.normalized) if query in text][:limit]
+        query_grams = bigrams(query)
+        common_limit = max(1, int(len(self.titles) * COMMON_GRAM_RATIO))
+        rare_grams = [gram for gram in query_grams if len(self.postings.get(gram, ())) <= common_limit]
+        if not rare_grams:
+            # Only common bigrams, e.g. "第1讲": titles without the least common one are poor matches anyway
+            rare_grams = [min(query_grams, key=lambda gram: len(self.postings.get(gram, ())))]
+        common_grams = [gram for gram in query_grams if gram not in rare_grams]
+        shared = collections.Counter(itertools.chain.from_iterable(self.postings.get(gram, ()) for gram in rare_grams))
+        scored = []
+        for index, common in shared.items():
+            text = self.normalized[index]
+            common += sum(1 for gram in common_grams if gram in text)
+            dice = 2 * common / (len(query_grams) + self.gram_counts[index])
+            score = COVERAGE_WEIGHT * common / len(query_grams) + (1 - COVERAGE_WEIGHT) * dice
+            if query in text:
+                score += SUBSTRING_BONUS
+            if score >= min_score:
+                scored.append((score, -index))
+        # Ties keep the scraped (course) order
+        return [(score, self.titles[-negative_index]) for score, negative_index in heapq.nlargest(limit, scored)]
@@ -0,0 +1,208 @@
+# Automatic assignment of scraped course titles to the video files of a folder.
+# Every (file, title) pair gets a cost from three hints, each in [0, 1]:
+#   order    - files sorted by their Moc_<tid>_<unitid>_<n> numbers (natural name order
+#              otherwise) against the course order of the titles, as relative positions
+#   duration - the file's duration (mp4 header) against a "12:34" duration in the title
+#   name     - bigram similarity of an already meaningful file name with the title
+# Hints that are unknown for a pair are left out and the others reweighted. The assignment
+# that minimises the total cost over the whole folder is found with the Hungarian algorithm,
+# so one ambiguous file cannot grab the title that fits another file better. An assignment's
+# confidence is how well the pair fits times how clearly it beats the other titles, so the
+# preview can point at the few pairs worth checking by eye.
+import os
+import re
+
+from mp4_probe import probe_mp4
+from title_index import bigrams, normalize
+
+WEIGHTS = {"order": 0.5, "duration": 0.3, "name": 0.2}
+CONTENT_HINTS = ("duration", "name")
+ORDER_SCALE = 4.0 # Positions a quarter of the list apart already cost the full order hint
+CONFIDENT_MARGIN = 0.1 # Cost gap to the next best title at which an assignment is unambiguous
+UNTIMED_TITLE_COST = 0.5 # Duration cost of a title without a duration when other titles have one
+UNMATCHED_COST = 1.0 # Cost of leaving a file (or title) without a partner
+LOW_CONFIDENCE = 0.6 # Assignments below this are highlighted for review
+_MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+MOC_NAME_RE = re.compile(r"Moc_(\d+)_(\d+)_(\d+)", re.I)
+# "(12:34)", "1:02:03" anywhere in the title; the last one wins
+TITLE_DURATION_RE = re.compile(r"(?<!\d)(?:(\d{1,2}):)?(\d{1,2}):(\d{2})(?!\d)")
+_DIGITS_RE = re.compile(r"(\d+)")
+
+
+def file_sort_key(filename):
+    # Moc_<tid>_<unitid>_<n> files by their numbers, then everything else in natural order
+    match = MOC_NAME_RE.search(filename)
+    if match:
+        return (0, tuple(int(group) for group in match.groups()), ())
+    parts = _DIGITS_RE.split(filename.lower())
+    return (1, (), tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in parts))
+
+
+def title_duration(title):
+    matches = TITLE_DURATION_RE.findall(title)
+    if not matches:
+        return None
+    hours, minutes, seconds = matches[-1]
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def file_duration(path):
+    # Seconds from the mp4 header, None for other containers or unreadable files
+    if not path.lower().endswith(_MP4_EXTENSIONS):
+        return None
+    try:
+        return probe_mp4(path).duration
+    except (OSError, ValueError):
+        return None
+
+
+def name_grams(filename):
+    # Bigrams of a file name, None for generated names that say nothing about the content
+    base = filename.rsplit('.', 1)[0]
+    text = normalize(base)
+    if MOC_NAME_RE.search(base) or not text.strip('0123456789'):
+        return None
+    return bigrams(text)
+
+
+def name_similarity(file_grams, title_grams):
+    # Dice similarity of the bigrams, None when either side has none to compare
+    if not file_grams or not title_grams:
+        return None
+    return 2 * len(file_grams & title_grams) / (len(file_grams) + len(title_grams))
+
+
+def _relative_position(index, count):
+    return index / (count - 1) if count > 1 else 0.5
+
+
+def pair_hints(file_index, file_count, title_index, title_count, duration, title_seconds, similarity, titles_timed):
+    # {hint: cost in [0, 1]} for the hints known for this pair. titles_timed says whether the
+    # course lists durations at all; if it does, a title without one (a chapter heading, a
+    # quiz) is a poor match for a video.
+    # The order cost is squared, so that of two assignments with the same total displacement
+    # the one that keeps both lists in order is cheaper.
+    offset = abs(_relative_position(file_index, file_count) - _relative_position(title_index, title_count))
+    hints = {"order": min(1.0, offset * ORDER_SCALE) ** 2}
+    if duration and title_seconds:
+        hints["duration"] = min(1.0, abs(duration - title_seconds) / max(duration, title_seconds))
+    elif duration and titles_timed:
+        hints["duration"] = UNTIMED_TITLE_COST
+    if similarity is not None:
+        hints["name"] = 1.0 - similarity
+    return hints
+
+
+def weighted_cost(hints, names=tuple(WEIGHTS)):
+    # Weighted mean of the given hints that are known, None when none of them is
+    known = [name for name in names if name in hints]
+    if not known:
+        return None
+    return sum(WEIGHTS[name] * hints[name] for name in known) / sum(WEIGHTS[name] for name in known)
+
+
+def hungarian(cost):
+    # Minimum-cost perfect assignment for a square matrix (list of rows). Returns
+    # assignment[row] = column. O(n^3) with row/column potentials.
+    n = len(cost)
+    infinity = float('inf')
+    u = [0.0] * (n + 1) # Row potentials (1-based, index 0 is a sentinel)
+    v = [0.0] * (n + 1) # Column potentials
+    column_row = [0] * (n + 1) # column -> row matched to it
+    way = [0] * (n + 1)
+    for row in range(1, n + 1):
+        column_row[0] = row
+        current_column = 0
+        min_slack = [infinity] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[current_column] = True
+            current_row = column_row[current_column]
+            delta = infinity
+            next_column = 0
+            row_costs = cost[current_row - 1]
+            for column in range(1, n + 1):
+                if not used[column]:
+                    slack = row_costs[column - 1] - u[current_row] - v[column]
+                    if slack < min_slack[column]:
+                        min_slack[column] = slack
+                        way[column] = current_column
+                    if min_slack[column] < delta:
+                        delta = min_slack[column]
+                        next_column = column
+            for column in range(n + 1):
+                if used[column]:
+                    u[column_row[column]] += delta
+                    v[column] -= delta
+                else:
+                    min_slack[column] -= delta
+            current_column = next_column
+            if column_row[current_column] == 0:
+                break
+        while current_column:
+            previous_column = way[current_column]
+            column_row[current_column] = column_row[previous_column]
+            current_column = previous_column
+    assignment = [0] * n
+    for column in range(1, n + 1):
+        if column_row[column]:
+            assignment[column_row[column] - 1] = column - 1
+    return assignment
+
+
+class TitleAssignment:
+    def __init__(self, filename, title, confidence, duration=None, title_seconds=None):
+        self.filename = filename
+        self.title = title # None when the folder has more files than titles
+        self.confidence = confidence # 0..1, low when the pair fits badly or another title fits as well
+        self.duration = duration
+        self.title_seconds = title_seconds
+
+
+def assign_titles(folder, filenames, titles):
+    # [TitleAssignment] for every file, in file_sort_key order
+    filenames = sorted(filenames, key=file_sort_key)
+    if not filenames:
+        return []
+    durations = [file_duration(os.path.join(folder, filename)) for filename in filenames]
+    title_seconds = [title_duration(title) for title in titles]
+    title_grams = [bigrams(normalize(title)) for title in titles]
+    titles_timed = any(title_seconds)
+    size = max(len(filenames), len(titles))
+    hints = []
+    cost = []
+    for file_index, filename in enumerate(filenames):
+        file_grams = name_grams(filename)
+        hints.append([pair_hints(file_index, len(filenames), title_index, len(titles), durations[file_index], title_seconds[title_index],
+                                 name_similarity(file_grams, title_grams[title_index]), titles_timed)
+                      for title_index in range(len(titles))])
+        cost.append([weighted_cost(pair) for pair in hints[-1]] + [UNMATCHED_COST] * (size - len(titles)))
+    for _ in range(size - len(filenames)):
+        cost.append([UNMATCHED_COST] * size) # Titles without a file (chapter headings, quizzes)
+    assignment = hungarian(cost)
+
+    # Order alone cannot tell which of the surplus titles are the ones without a video: with k
+    # more titles than files, each file has about k + 1 plausible titles.
+    order_certainty = 1.0 / (1 + abs(len(titles) - len(filenames)))
+    owners = [None] * len(titles) # title index -> file index assigned to it
+    for file_index in range(len(filenames)):
+        if assignment[file_index] < len(titles):
+            owners[assignment[file_index]] = file_index
+    results = []
+    for file_index, filename in enumerate(filenames):
+        title_index = assignment[file_index]
+        if title_index >= len(titles):
+            results.append(TitleAssignment(filename, None, 0.0, durations[file_index]))
+            continue
+        # Duration and name single a title out when no other title comes close. Titles that
+        # another file fits at least as well are not competition.
+        assigned_cost = cost[file_index][title_index]
+        certainty = order_certainty
+        if weighted_cost(hints[file_index][title_index], CONTENT_HINTS) is not None:
+            runner_up = min((value for index, value in enumerate(cost[file_index][:len(titles)])
+                             if index != title_index and (owners[index] is None or cost[owners[index]][index] > value)), default=1.0)
+            certainty = max(certainty, min(1.0, max(0.0, runner_up - assigned_cost) / CONFIDENT_MARGIN))
+        confidence = (1.0 - assigned_cost) * certainty
+        results.append(TitleAssignment(filename, titles[title_index], confidence, durations[file_index], title_seconds[title_index]))
+    return results
@@ -0,0 +1,161 @@
+# Course-title scraping for the rename window, run on a background thread.
+# One requests.Session is shared by every scrape, so repeated fetches from the same site
+# reuse its pooled connections. The titles parsed from each course URL are kept in a JSON
+# lines cache together with the page's ETag / Last-Modified; the next scrape of the same
+# URL sends them as If-None-Match / If-Modified-Since and a 304 answer costs no download and
+# no parsing. When the site cannot be reached the cached titles are used. lxml is used as the
+# BeautifulSoup backend when it is installed, html.parser otherwise.
+# Nothing in here touches Tk, and the session can be passed in, so the scraper can be driven
+# against a local HTTP server.
+import json
+import os
+import threading
+import time
+
+CACHE_FILENAME = "title_cache.jsonl"
+REQUEST_TIMEOUT = 20
+POOL_SIZE = 4
+
+# Tried in order until one matches. icourse163 lesson titles are <p class="text"> inside
+# <div class="textCon">; the others cover older page layouts and chapter headings.
+TITLE_SELECTORS = ('div.textCon p.text', '.lessontitle .text', 'h3.f-thide.f-fl.listTxt')
+
+
+def _parser_features():
+    try:
+        import lxml # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+def extract_titles(html):
+    # Titles in page order; empty when none of the selectors match (e.g. content that the
+    # page loads with JavaScript)
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, _parser_features())
+    for selector in TITLE_SELECTORS:
+        elements = soup.select(selector)
+        if elements:
+            return [title for title in (element.get_text(strip=True) for element in elements) if title]
+    return []
+
+
+SOURCE_NETWORK = "network" # Downloaded and parsed
+SOURCE_NOT_MODIFIED = "not-modified" # 304: cached titles are current
+SOURCE_STALE_CACHE = "stale-cache" # Request failed; cached titles from an earlier scrape
+
+
+class ScrapeResult:
+    def __init__(self, url, titles, source, error=None):
+        self.url = url
+        self.titles = titles
+        self.source = source # SOURCE_NETWORK, SOURCE_NOT_MODIFIED or SOURCE_STALE_CACHE
+        self.error = error # Network error that the stale cache papered over
+
+
+class TitleCache:
+    # url -> latest record, appended to a JSON lines file and compacted on load
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Torn line from a crash mid-write
+                self.records[record["url"]] = record
+        try:
+            # One line per URL; older lines for the same URL are dropped
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in self.records.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass # Read-only program folder: the cache still works, just uncompacted
+
+    def get(self, url):
+        with self._lock:
+            return self.records.get(url)
+
+    def put(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.records[record["url"]] = record
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError:
+                pass # Kept for this session only
+
+
+class TitleScraper:
+    def __init__(self, cache_path, headers=None, session=None, timeout=REQUEST_TIMEOUT):
+        self.cache = TitleCache(cache_path)
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self._session = session
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created on first use so requests is only imported when something is scraped
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def scrape(self, url):
+        # Blocking; returns a ScrapeResult. Raises requests' RequestException when the page
+        # cannot be fetched and nothing is cached for it, and parser errors as they come.
+        import requests
+        cached = self.cache.get(url)
+        headers = dict(self.headers)
+        if cached:
+            if cached.get("etag"):
+                headers['If-None-Match'] = cached["etag"]
+            if cached.get("last_modified"):
+                headers['If-Modified-Since'] = cached["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached:
+                return ScrapeResult(url, cached["titles"], SOURCE_NOT_MODIFIED)
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        except requests.exceptions.RequestException as e:
+            if cached:
+                return ScrapeResult(url, cached["titles"], SOURCE_STALE_CACHE, error=e)
+            raise
+        titles = extract_titles(response.content)
+        if titles: # A page without titles is not worth revalidating against
+            self.cache.put({
+                "url": url,
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+                "titles": titles,
+                "fetched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        return ScrapeResult(url, titles, SOURCE_NETWORK)
+
+    def scrape_async(self, url, on_done):
+        # on_done(result, error) is called on the worker thread; exactly one of them is None
+        def run():
+            try:
+                result = self.scrape(url)
+            except Exception as e:
+                on_done(None, e)
+                return
+            on_done(result, None)
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,215 @@
+# Fast path for plain MPEG-TS playlists: the segments are concatenated byte for byte into
+# one .ts file, without starting ffmpeg. MPEG-TS is designed to be cut and joined at packet
+# boundaries, so for unencrypted, continuous, local segments the joined file is exactly
+# what a player would have streamed. Anything else is left to ffmpeg.
+import errno
+import os
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Zero-copy methods that turned out not to work here (e.g. across filesystems) are
+# switched off for the rest of the process
+_copy_methods_disabled = set()
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF}
+
+
+def looks_like_mpegts(path):
+    # The first two packets must start with the sync byte
+    with open(path, 'rb') as f:
+        head = f.read(TS_PACKET_SIZE + 1)
+    if not head or head[0] != TS_SYNC_BYTE:
+        return False
+    return len(head) <= TS_PACKET_SIZE or head[TS_PACKET_SIZE] == TS_SYNC_BYTE
+
+
+def unsupported_reason(playlist):
+    # None when the playlist can be joined directly, otherwise why it needs ffmpeg
+    if playlist.is_master:
+        return "主播放列表 (master playlist)"
+    if not playlist.segments:
+        return "播放列表中没有分段"
+    if playlist.is_encrypted():
+        return "分段已加密 (EXT-X-KEY)"
+    if playlist.has_map:
+        return "fMP4 分段 (EXT-X-MAP)"
+    for segment in playlist.segments:
+        if segment.path is None:
+            return f"非本地分段: {segment.uri}"
+        if segment.byterange is not None:
+            return "使用 EXT-X-BYTERANGE"
+        if segment.discontinuity:
+            return "包含 EXT-X-DISCONTINUITY"
+        if not os.path.isfile(segment.path) or os.path.getsize(segment.path) == 0:
+            return f"分段缺失或为空: {segment.uri}"
+        if not looks_like_mpegts(segment.path):
+            return f"不是 MPEG-TS 分段: {segment.uri}"
+    return None
+
+
+def copy_fd(src_fd, dst_fd, size):
+    # Copies size bytes from the current offsets, preferring in-kernel copies:
+    # copy_file_range (may reflink on CoW filesystems), then sendfile, then a plain loop
+    if 'copy_file_range' not in _copy_methods_disabled and hasattr(os, 'copy_file_range'):
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, min(size - copied, COPY_CHUNK_SIZE))
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return
+            size -= copied
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS or copied:
+                raise
+            _copy_methods_disabled.add('copy_file_range')
+    if 'sendfile' not in _copy_methods_disabled and hasattr(os, 'sendfile') and os.name != 'nt':
+        try:
+            copied = 0
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, None, min(size - copied, COPY_CHUNK_SIZE))
+                if n == 0:
+                    break
+                copied += n
+            if copied == size:
+                return
+            size -= copied
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS or copied:
+                raise
+            _copy_methods_disabled.add('sendfile')
+    while size > 0:
+        chunk = os.read(src_fd, min(size, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise OSError(errno.EIO, "分段在复制过程中被截断")
+        view = memoryview(chunk)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+        size -= len(chunk)
+
+
+def concat_segments(segment_paths, output_path, on_segment=None):
+    # Writes the segments back to back into output_path in a single streamed pass.
+    # on_segment(index, bytes_written_so_far) is called after each segment.
+    written = 0
+    with open(output_path, 'wb') as dst:
+        dst_fd = dst.fileno()
+        for index, path in enumerate(segment_paths):
+            with open(path, 'rb') as src:
+                size = os.fstat(src.fileno()).st_size
+                copy_fd(src.fileno(), dst_fd, size)
+            written += size
+            if on_segment:
+                on_segment(index, written)
+    return written
+
+
+
+# Elementary stream types (ISO/IEC 13818-1) the layout probe counts frames of
+_VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1b, 0x24} # MPEG-1/2, MPEG-4 part 2, H.264, HEVC
+_AUDIO_STREAM_TYPES = {0x03, 0x04, 0x0f, 0x11, 0x81} # MP3, AAC (ADTS / LATM), AC-3
+_ADTS_STREAM_TYPE = 0x0f
+
+
+class SegmentLayout:
+    # Frames per second of one segment's first video and audio stream, which is what the
+    # size of an mp4's sample tables follows. audio_rate is None when the segment has audio
+    # whose frames are not counted (anything but ADTS AAC).
+    def __init__(self, video_rate=0.0, audio_rate=0.0, reordered=False):
+        self.video_rate = video_rate
+        self.audio_rate = audio_rate
+        self.reordered = reordered # Video PTS differ from DTS (B-frames): the mp4 gets a ctts table
+
+
+def _section(payload):
+    # PSI section after the pointer field, with its declared length
+    section = payload[1 + payload[0]:]
+    if len(section) < 3:
+        return None, 0
+    return section, min(len(section), 3 + (((section[1] & 0x0f) << 8) | section[2]))
+
+
+def _pes_timestamp(data):
+    return ((data[0] >> 1) & 0x07) << 30 | data[1] << 22 | (data[2] >> 1) << 15 | data[3] << 7 | data[4] >> 1
+
+
+def _count_adts_frames(data):
+    count = 0
+    i = 0
+    while i + 7 <= len(data):
+        if data[i] != 0xff or data[i + 1] & 0xf6 != 0xf0:
+            i += 1 # Resynchronise
+            continue
+        frame_length = ((data[i + 3] & 0x03) << 11) | (data[i + 4] << 3) | (data[i + 5] >> 5)
+        if frame_length < 7:
+            i += 1
+            continue
+        count += (data[i + 6] & 0x03) + 1 # Raw data blocks in this frame, 1024 samples each
+        i += frame_length
+    return count
+
+
+def probe_segment_layout(path, duration):
+    # Reads one segment and returns its SegmentLayout, or None when it is not MPEG-TS with a
+    # PAT and PMT. Video frames are counted as PES packets (one per access unit in HLS).
+    if not duration:
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    pmt_pid = None
+    stream_types = {} # pid -> stream type
+    video_pid = audio_pid = None
+    video_frames = 0
+    reordered = False
+    audio = bytearray()
+    for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[offset:offset + TS_PACKET_SIZE]
+        if packet[0] != TS_SYNC_BYTE:
+            return None
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        unit_start = packet[1] & 0x40
+        adaptation = (packet[3] >> 4) & 0x03
+        start = 5 + packet[4] if adaptation & 0x02 else 4
+        if not adaptation & 0x01 or start >= TS_PACKET_SIZE:
+            continue
+        payload = packet[start:]
+        if pid == 0 and unit_start and pmt_pid is None:
+            section, end = _section(payload)
+            for i in range(8, end - 4 - 3, 4): # Programs up to the CRC; program 0 is the network PID
+                if (section[i] << 8) | section[i + 1]:
+                    pmt_pid = ((section[i + 2] & 0x1f) << 8) | section[i + 3]
+                    break
+        elif pid == pmt_pid and unit_start and not stream_types:
+            section, end = _section(payload)
+            if end < 16:
+                continue
+            i = 12 + (((section[10] & 0x0f) << 8) | section[11]) # Skip the program info descriptors
+            while i + 5 <= end - 4:
+                stream_pid = ((section[i + 1] & 0x1f) << 8) | section[i + 2]
+                stream_types[stream_pid] = section[i]
+                if section[i] in _VIDEO_STREAM_TYPES and video_pid is None:
+                    video_pid = stream_pid
+                elif section[i] in _AUDIO_STREAM_TYPES and audio_pid is None:
+                    audio_pid = stream_pid
+                i += 5 + (((section[i + 3] & 0x0f) << 8) | section[i + 4])
+        elif pid == video_pid and unit_start and payload[:3] == b'\x00\x00\x01' and len(payload) >= 19:
+            video_frames += 1
+            if payload[7] >> 6 == 0x03 and _pes_timestamp(payload[9:14]) != _pes_timestamp(payload[14:19]):
+                reordered = True
+        elif pid == audio_pid and stream_types[pid] == _ADTS_STREAM_TYPE:
+            if unit_start and payload[:3] == b'\x00\x00\x01' and len(payload) >= 9:
+                payload = payload[9 + payload[8]:] # Strip the PES header
+            audio.extend(payload)
+    if not stream_types:
+        return None
+    if audio_pid is None:
+        audio_rate = 0.0
+    elif stream_types[audio_pid] == _ADTS_STREAM_TYPE:
+        audio_rate = _count_adts_frames(audio) / duration
+    else:
+        audio_rate = None
+    return SegmentLayout(video_frames / duration, audio_rate, reordered)
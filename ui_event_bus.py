@@ -0,0 +1,71 @@
+# Single channel for worker threads to update the Tk UI.
+# Workers only put events on a queue; one periodic pump on the Tk thread drains it. Progress
+# and status updates are coalesced to the latest value per pump and history rows are handed
+# over in batches, so the UI does a bounded amount of work per tick however many jobs run.
+import queue
+
+EVENT_PROGRESS = "progress" # (percent,)
+EVENT_STATUS = "status" # (text,)
+EVENT_HISTORY = "history" # (input_path, output_file, status, timestamp)
+EVENT_CALL = "call" # (func, args, kwargs) run on the Tk thread, in posting order
+
+DELIVER_LATEST = "latest" # handler(*args) with only the newest event of the tick
+DELIVER_BATCH = "batch" # handler(list_of_args) with every event of the tick, oldest first
+
+
+class UiEventBus:
+    def __init__(self, root, interval_ms=50):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._queue = queue.SimpleQueue()
+        self._handlers = {} # kind -> (handler, delivery)
+        self._pump_job = None
+
+    def subscribe(self, kind, handler, delivery=DELIVER_LATEST):
+        self._handlers[kind] = (handler, delivery)
+
+    def post(self, kind, *args):
+        # Safe from any thread; never touches Tk
+        self._queue.put((kind, args))
+
+    def call(self, func, *args, **kwargs):
+        # Runs func(*args, **kwargs) on the Tk thread, after the events posted before it
+        self._queue.put((EVENT_CALL, (func, args, kwargs)))
+
+    def start(self):
+        if self._pump_job is None:
+            self._pump_job = self.root.after(self.interval_ms, self._pump)
+
+    def stop(self):
+        if self._pump_job is not None:
+            self.root.after_cancel(self._pump_job)
+            self._pump_job = None
+
+    def _pump(self):
+        # Reschedule first: a call below may open a modal dialog, and progress from the other
+        # workers should keep rendering while it is open.
+        self._pump_job = self.root.after(self.interval_ms, self._pump)
+        latest = {}
+        batches = {}
+        calls = []
+        while True:
+            try:
+                kind, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == EVENT_CALL:
+                calls.append(args)
+                continue
+            handler, delivery = self._handlers.get(kind, (None, None))
+            if handler is None:
+                continue
+            if delivery == DELIVER_BATCH:
+                batches.setdefault(kind, []).append(args)
+            else:
+                latest[kind] = args
+        for kind, args in latest.items():
+            self._handlers[kind][0](*args)
+        for kind, items in batches.items():
+            self._handlers[kind][0](items)
+        for func, args, kwargs in calls:
+            func(*args, **kwargs)
@@ -1,54 +1,116 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
+import io
 import os
-import subprocess
 import threading
 import json
 from datetime import datetime
-import queue # Added for dialog synchronization
-import requests
-from bs4 import BeautifulSoup
+import collections
 from urllib.parse import urljoin # For handling relative URLs from scraping
 from tkinter import scrolledtext # For displaying scraped titles
-from PIL import Image, ImageTk # For video preview
-import cv2 # For video preview
-from difflib import get_close_matches # For fuzzy search, standard library alternative to thefuzz
+from contact_sheet import SHEET_COLUMNS, SHEET_TILES, TILE_SIZE, build_contact_sheet
+from history_store import HistoryStore
+from io_scheduler import IoScheduler
+from preview_player import PreviewPlayer
+from rename_preview import FolderListingCache, RenameRules, apply_rules, diff_rows
+from rename_plan import STATE_COMMITTED, STATE_ROLLING_BACK, RenameBatch, RenameFailed, plan_renames
+from thumbnail_cache import ThumbnailCache
+from title_index import TitleIndex
+from title_matcher import LOW_CONFIDENCE, assign_titles
+from title_scraper import CACHE_FILENAME as TITLE_CACHE_FILENAME, SOURCE_STALE_CACHE, TitleScraper
+from job_manifest import JOB_DONE, JOB_FAILED, JOB_PENDING, JOB_SKIPPED, JobManifest
+from skip_cache import CACHE_FRESH, CACHE_STALE, ConversionCache
+from overwrite_policy import (DECISION_OVERWRITE, DECISION_RENAME, DECISION_SKIP, POLICY_OVERWRITE, POLICY_RENAME, POLICY_SKIP,
+                              POLICY_SKIP_IF_NEWER, POLICY_SKIP_IF_VALID, OverwritePolicy)
+from ui_event_bus import DELIVER_BATCH, DELIVER_LATEST, EVENT_HISTORY, EVENT_PROGRESS, EVENT_STATUS, UiEventBus
+from merge_core import (ENGINE_FFMPEG, ENGINE_TS_CONCAT, FFMPEG_MISSING_MESSAGE, KEPT_OUTPUT_STATUSES, STATUS_CANCELLED, STATUS_FFMPEG_MISSING, STATUS_NO_M3U8, STATUS_RESUMED_DONE,
+                        STATUS_SUCCESS, STATUS_UNCHANGED_SKIPPED, BatchCancelled, FfmpegNotFound, convert_m3u8, default_concurrency, discover_jobs, find_ffmpeg, format_seconds, run_batch)
+
+# cv2, PIL, requests and bs4 are only needed by the batch-rename window. They are imported on
+# first use so the main window does not pay for them at startup.
+
+def _import_preview_modules():
+    import cv2 # For video preview
+    from PIL import Image, ImageTk # For video preview
+    return cv2, Image, ImageTk
+
+def _import_scraping_modules():
+    import requests
+    from bs4 import BeautifulSoup
+    return requests, BeautifulSoup
 
 class VideoMergerApp:
     # Define a more specific User-Agent
     REQUEST_HEADERS = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
+    HISTORY_PAGE_SIZE = 200 # Rows fetched from the journal per lazy load
+    HISTORY_MAX_ROWS = 1000 # Upper bound on rows held in history_tree at once
+    ENGINE_LABELS = {ENGINE_FFMPEG: "FFmpeg (mp4)", ENGINE_TS_CONCAT: "TS直接拼接 (ts)"}
+    OVERWRITE_LABELS = {
+        POLICY_SKIP: "跳过",
+        POLICY_OVERWRITE: "覆盖",
+        POLICY_SKIP_IF_NEWER: "较新则跳过",
+        POLICY_SKIP_IF_VALID: "有效则跳过",
+        POLICY_RENAME: "重命名 (加序号)",
+    }
+    PER_DEVICE_AUTO = "自动" # Per-device job limit detected by io_scheduler
+    PREVIEW_SECONDS = 15
+    PREVIEW_TICK_MS = 10 # Polls the decoder's queue; a frame is only drawn when one is due
+    TITLE_FILTER_DELAY_MS = 120 # Search once typing pauses, not on every key
+    VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.ts', '.m4v', '.webm')
+    NO_TITLES_PLACEHOLDER = "未能自动提取标题，请检查URL或手动输入。"
+    RULE_PREVIEW_TEXT = "文件预览 (原始名 -> 新名) - 基于下方规则"
+    RENAME_PREVIEW_DELAY_MS = 200 # Rule preview refreshed once typing pauses
+    RENAME_PROGRESS_STEPS = 50 # Progress shown every this many renames
+    MAX_LISTED_CONFLICTS = 10
+
     def __init__(self, root):
         self.all_scraped_titles = [] # To store all titles fetched from URL
+        self.title_index = None # TitleIndex over all_scraped_titles, built on the first search
+        self.title_filter_job = None # Pending debounced search
+        self.rename_preview_job = None # Pending debounced rule preview
+        self.rename_preview_generation = 0 # Results of older preview computations are dropped
+        self.rule_preview_items = None # original name -> (tree item, new name) while the tree shows the rule preview
+        self.folder_listing = FolderListingCache()
         self.selected_local_video_path = None # Path of the video selected for preview
-        self.video_capture = None # OpenCV video capture object
+        self.preview_player = None # PreviewPlayer decoding the running preview on its own thread
         self.is_previewing = False # Flag to control video preview loop
         self.preview_frame_job = None # To store root.after job ID for preview
         self.root = root
-        self.dialog_queue = queue.Queue() # Added for dialog synchronization
         self.root.title("视频合并转换工具")
         self.root.geometry("800x600")
 
         # --- Configuration ---
-        self.history_file = os.path.join(os.path.dirname(__file__), "conversion_history.json")
+        self.history_file = os.path.join(os.path.dirname(__file__), "conversion_history.jsonl")
+        legacy_history_file = os.path.join(os.path.dirname(__file__), "conversion_history.json")
+        try:
+            self.history_store = HistoryStore(self.history_file, legacy_history_file)
+        except (IOError, json.JSONDecodeError) as e:
+            messagebox.showerror("历史记录错误", f"无法迁移旧的历史记录文件: {e}")
+            self.history_store = HistoryStore(self.history_file)
         
         # Construct path to ffmpeg.exe relative to the script's directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
-        ffmpeg_dir_path = os.path.join(script_dir, "ffmpeg", "bin", "ffmpeg.exe")
-        ffmpeg_script_path = os.path.join(script_dir, "ffmpeg.exe")
-
-        if os.path.exists(ffmpeg_dir_path) and os.access(ffmpeg_dir_path, os.X_OK):
-            self.ffmpeg_path = ffmpeg_dir_path
-        elif os.path.exists(ffmpeg_script_path) and os.access(ffmpeg_script_path, os.X_OK):
-            self.ffmpeg_path = ffmpeg_script_path
-        else:
-            self.ffmpeg_path = "ffmpeg" # Fallback to system PATH
+        self.ffmpeg_path = find_ffmpeg(script_dir)
 
         # --- UI Elements ---
         self.setup_ui()
         self.load_history()
 
+        # Worker threads report through this bus only; it is drained on the Tk thread
+        self.events = UiEventBus(self.root)
+        self.events.subscribe(EVENT_PROGRESS, self.update_progress_bar_safe, DELIVER_LATEST)
+        self.events.subscribe(EVENT_STATUS, self.update_progress_label_safe, DELIVER_LATEST)
+        self.events.subscribe(EVENT_HISTORY, self._log_history_batch, DELIVER_BATCH)
+        self.events.start()
+
+        # First-frame thumbnails of the rename window, made on a background thread
+        self.thumbnail_cache = ThumbnailCache(os.path.join(script_dir, "thumbnail_cache"),
+                                              on_ready=lambda path, data: self.events.call(self._on_thumbnail_ready, path, data))
+        self.script_dir = script_dir
+        self.title_scraper = None # Created by the first scrape, then shared (HTTP session and title cache)
+
     def setup_ui(self):
         # --- Frames ---
         main_frame = ttk.Frame(self.root, padding="10")
@@ -92,10 +154,53 @@ class VideoMergerApp:
         self.start_button = ttk.Button(controls_frame, text="开始合并与转换", command=self.start_processing_thread)
         self.start_button.pack(pady=10, padx=5, side=tk.LEFT)
 
+        # --- Stop Button ---
+        # Conversions already running finish; the ones not started yet are left for the next run
+        self.stop_button = ttk.Button(controls_frame, text="停止", command=self.stop_processing, state=tk.DISABLED)
+        self.stop_button.pack(pady=10, padx=5, side=tk.LEFT)
+
         # --- Batch Rename Button ---
         self.rename_button = ttk.Button(controls_frame, text="批量重命名", command=self.open_batch_rename_window)
         self.rename_button.pack(pady=10, padx=5, side=tk.LEFT)
 
+        # --- Concurrency ---
+        ttk.Label(controls_frame, text="并发数:").pack(pady=10, padx=(20, 5), side=tk.LEFT)
+        self.concurrency_var = tk.StringVar(value=str(default_concurrency()))
+        self.concurrency_spinbox = ttk.Spinbox(controls_frame, from_=1, to=64, width=5, textvariable=self.concurrency_var)
+        self.concurrency_spinbox.pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Per-device Concurrency ---
+        # 自动: one job per spinning disk, two per network share, no extra limit on SSDs
+        ttk.Label(controls_frame, text="每磁盘:").pack(pady=10, padx=(10, 5), side=tk.LEFT)
+        self.per_device_var = tk.StringVar(value=self.PER_DEVICE_AUTO)
+        ttk.Spinbox(controls_frame, values=[self.PER_DEVICE_AUTO] + [str(n) for n in range(1, 17)], width=5,
+                    textvariable=self.per_device_var).pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Live Progress ---
+        self.live_progress_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(controls_frame, text="实时进度", variable=self.live_progress_var).pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Output Verification ---
+        self.verify_output_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(controls_frame, text="校验输出", variable=self.verify_output_var).pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Fast Start ---
+        self.faststart_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(controls_frame, text="快速启动 (moov前置)", variable=self.faststart_var).pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Overwrite Policy ---
+        # Applied to every existing output without asking, so a batch never stops on a dialog
+        ttk.Label(controls_frame, text="已存在时:").pack(pady=10, padx=(20, 5), side=tk.LEFT)
+        self.overwrite_policy_var = tk.StringVar(value=self.OVERWRITE_LABELS[POLICY_SKIP])
+        ttk.Combobox(controls_frame, textvariable=self.overwrite_policy_var, state="readonly", width=14,
+                     values=list(self.OVERWRITE_LABELS.values())).pack(pady=10, padx=5, side=tk.LEFT)
+
+        # --- Conversion Engine ---
+        ttk.Label(controls_frame, text="转换引擎:").pack(pady=10, padx=(20, 5), side=tk.LEFT)
+        self.engine_var = tk.StringVar(value=self.ENGINE_LABELS[ENGINE_FFMPEG])
+        ttk.Combobox(controls_frame, textvariable=self.engine_var, state="readonly", width=14,
+                     values=list(self.ENGINE_LABELS.values())).pack(pady=10, padx=5, side=tk.LEFT)
+
         # --- Progress Bar ---
         self.progress_label_var = tk.StringVar()
         self.progress_label_var.set("状态: 空闲")
@@ -115,9 +220,9 @@ class VideoMergerApp:
         self.history_tree.column("output", width=250, anchor=tk.W)
         self.history_tree.column("status", width=100, anchor=tk.W)
 
-        history_scrollbar = ttk.Scrollbar(history_frame, orient="vertical", command=self.history_tree.yview)
-        self.history_tree.configure(yscrollcommand=history_scrollbar.set)
-        history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.history_scrollbar = ttk.Scrollbar(history_frame, orient="vertical", command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=self._on_history_yscroll)
+        self.history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.history_tree.pack(fill=tk.BOTH, expand=True)
 
         clear_history_button = ttk.Button(history_frame, text="清空历史记录", command=self.clear_history)
@@ -134,59 +239,112 @@ class VideoMergerApp:
             self.output_folder_var.set(folder_selected)
 
     def log_history(self, input_path, output_file, status):
-        entry = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "input": input_path,
-            "output": output_file,
-            "status": status
-        }
-        history = self.load_history_data()
-        history.insert(0, entry) # Add to the beginning
+        self._log_history_batch([(input_path, output_file, status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))])
+
+    def _log_history_batch(self, records):
+        # records: (input_path, output_file, status, timestamp[, details]) tuples, oldest first.
+        # details holds extra fields stored with the entry, e.g. the output verification.
+        entries = []
+        for input_path, output_file, status, timestamp, *details in records:
+            entry = {"timestamp": timestamp, "input": input_path, "output": output_file, "status": status}
+            if details and details[0]:
+                entry.update(details[0])
+            entries.append(entry)
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=4, ensure_ascii=False)
+            offsets = self.history_store.append_many(entries) # One append to the journal per batch
         except IOError as e:
             messagebox.showerror("历史记录错误", f"无法写入历史记录文件: {e}")
-        self.load_history() # Refresh treeview
+            return
+        # Only show them right away if the top of the window is the newest history; otherwise
+        # they are picked up when the user scrolls back up.
+        if self.history_at_head:
+            for entry, (start, end) in zip(entries, offsets):
+                item = self.history_tree.insert("", 0, values=(entry["timestamp"], entry["input"], entry["output"], entry["status"]))
+                self.history_rows.appendleft((item, start, end))
+            self._trim_history_rows(from_top=False)
 
-    def load_history_data(self):
-        if not os.path.exists(self.history_file):
-            return []
+    def load_history(self):
+        # The tree holds a sliding window over the journal: history_rows lists (item, start, end)
+        # byte offsets from newest to oldest, and pages are read on demand while scrolling.
+        self.history_tree.delete(*self.history_tree.get_children())
+        self.history_rows = collections.deque()
+        self.history_at_head = True # Top row is the newest entry in the journal
+        self.history_exhausted = False # Bottom row is the oldest entry in the journal
+        self.history_lazy_load_job = None
+        self._load_older_history()
+
+    def _history_page(self, read_page, offset):
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (IOError, json.JSONDecodeError) as e:
+            return read_page(offset, self.HISTORY_PAGE_SIZE)
+        except IOError as e:
             messagebox.showerror("历史记录错误", f"无法读取或解析历史记录文件: {e}")
             return []
 
-    def load_history(self):
-        for i in self.history_tree.get_children():
-            self.history_tree.delete(i)
-        history = self.load_history_data()
-        for entry in history:
-            self.history_tree.insert("", tk.END, values=(entry["timestamp"], entry["input"], entry["output"], entry["status"]))
+    def _load_older_history(self):
+        before = self.history_rows[-1][1] if self.history_rows else None
+        page = self._history_page(self.history_store.read_before, before)
+        if len(page) < self.HISTORY_PAGE_SIZE:
+            self.history_exhausted = True
+        for start, end, entry in page:
+            item = self.history_tree.insert("", tk.END, values=(entry["timestamp"], entry["input"], entry["output"], entry["status"]))
+            self.history_rows.append((item, start, end))
+        return len(page), self._trim_history_rows(from_top=True)
+
+    def _load_newer_history(self):
+        page = self._history_page(self.history_store.read_after, self.history_rows[0][2])
+        if len(page) < self.HISTORY_PAGE_SIZE:
+            self.history_at_head = True
+        for start, end, entry in page:
+            item = self.history_tree.insert("", 0, values=(entry["timestamp"], entry["input"], entry["output"], entry["status"]))
+            self.history_rows.appendleft((item, start, end))
+        self._trim_history_rows(from_top=False)
+        return len(page)
+
+    def _trim_history_rows(self, from_top):
+        # Drop rows beyond HISTORY_MAX_ROWS from the end that is away from the user
+        overflow = len(self.history_rows) - self.HISTORY_MAX_ROWS
+        if overflow <= 0:
+            return 0
+        if from_top:
+            dropped = [self.history_rows.popleft()[0] for _ in range(overflow)]
+            self.history_at_head = False
+        else:
+            dropped = [self.history_rows.pop()[0] for _ in range(overflow)]
+            self.history_exhausted = False
+        self.history_tree.delete(*dropped)
+        return overflow
+
+    def _on_history_yscroll(self, first, last):
+        self.history_scrollbar.set(first, last)
+        near_bottom = float(last) >= 1.0 and not self.history_exhausted
+        near_top = float(first) <= 0.0 and not self.history_at_head
+        if (near_bottom or near_top) and self.history_lazy_load_job is None:
+            self.history_lazy_load_job = self.root.after_idle(self._lazy_load_history)
+
+    def _lazy_load_history(self):
+        self.history_lazy_load_job = None
+        first, last = self.history_tree.yview()
+        row_count = len(self.history_rows)
+        top_index = round(first * row_count)
+        if last >= 1.0 and not self.history_exhausted:
+            _, dropped = self._load_older_history()
+            # Keep the rows the user is looking at in place after the top was trimmed
+            if dropped and self.history_rows:
+                self.history_tree.yview_moveto(max(0, top_index - dropped) / len(self.history_rows))
+        elif first <= 0.0 and not self.history_at_head and self.history_rows:
+            added = self._load_newer_history()
+            if added:
+                self.history_tree.yview_moveto(added / len(self.history_rows))
 
     def clear_history(self):
         if messagebox.askyesno("确认", "确定要清空所有历史记录吗?"):
             try:
-                if os.path.exists(self.history_file):
-                    os.remove(self.history_file)
+                self.history_store.clear()
                 self.load_history() # Refresh (will be empty)
                 messagebox.showinfo("成功", "历史记录已清空。")
             except OSError as e:
                 messagebox.showerror("错误", f"无法清空历史记录: {e}")
 
-    def ask_user_for_overwrite(self, output_filename_display, q):
-        # This method is called via root.after, so it runs in the main Tkinter thread
-        response = messagebox.askquestion("文件已存在",
-                                          f"输出文件 '{output_filename_display}' 已存在。\n\n"
-                                          "选择操作:",
-                                          icon='warning',
-                                          type=messagebox.YESNOCANCEL,
-                                          detail="是: 覆盖\n否: 跳过\n取消: 中止所有后续转换",
-                                          parent=self.root)
-        q.put(response)
-
     def open_batch_rename_window(self):
         rename_window = tk.Toplevel(self.root)
         rename_window.title("批量文件重命名")
@@ -197,10 +355,11 @@ class VideoMergerApp:
         # Store the rename_window to access its components later if needed
         self.rename_window_ref = rename_window
         self.all_scraped_titles = [] # Reset for each new window instance
+        self.title_index = None
+        self.rule_preview_items = None
         self.selected_local_video_path = None
-        # Bind listbox selection events for enabling/disabling buttons
-        self.local_files_listbox.bind('<<ListboxSelect>>', self._update_rename_button_state)
-        self.matched_online_titles_listbox.bind('<<ListboxSelect>>', self._update_rename_button_state)
+        # Thumbnails still queued for this window are not needed once it is closed
+        rename_window.bind('<Destroy>', lambda event: self.thumbnail_cache.cancel() if event.widget is rename_window else None)
 
         # --- UI Elements for Batch Rename Window ---
         rename_main_frame = ttk.Frame(rename_window, padding="10")
@@ -267,6 +426,9 @@ class VideoMergerApp:
 
         rules_frame.columnconfigure(1, weight=1)
         rules_frame.columnconfigure(3, weight=1)
+        # The preview follows the rules as they are typed
+        for rule_var in (self.find_var, self.replace_var, self.prefix_var, self.suffix_var, self.use_sequence_var, self.sequence_start_var):
+            rule_var.trace_add('write', self._schedule_rename_preview)
 
         # Video Preview and Comparison Frame
         video_compare_frame = ttk.LabelFrame(rename_main_frame, text="视频预览与名称匹配", padding="10")
@@ -285,6 +447,8 @@ class VideoMergerApp:
         self.video_preview_canvas.pack(pady=5)
         self.play_preview_button = ttk.Button(local_file_preview_frame, text="播放15秒预览", command=self.play_video_preview, state=tk.DISABLED)
         self.play_preview_button.pack()
+        # Frames at evenly spaced keyframes, to recognise a lecture without playing its intro
+        ttk.Button(local_file_preview_frame, text="关键帧预览", command=self.open_contact_sheet).pack(pady=(5, 0))
 
         # Right side: Scraped titles and matching
         scraped_title_match_frame = ttk.Frame(video_compare_frame)
@@ -294,23 +458,33 @@ class VideoMergerApp:
         self.online_title_search_var = tk.StringVar()
         self.online_title_search_entry = ttk.Entry(scraped_title_match_frame, textvariable=self.online_title_search_var)
         self.online_title_search_entry.pack(fill=tk.X, pady=(0,5))
-        self.online_title_search_entry.bind('<KeyRelease>', self.filter_scraped_titles)
+        self.online_title_search_entry.bind('<KeyRelease>', self._schedule_title_filter)
 
         self.matched_online_titles_listbox = tk.Listbox(scraped_title_match_frame, height=8, exportselection=False)
         self.matched_online_titles_listbox.pack(fill=tk.BOTH, expand=True, pady=(0,5))
+        self.matched_online_titles_listbox.bind('<<ListboxSelect>>', self._update_rename_button_state)
 
         self.rename_selected_button = ttk.Button(scraped_title_match_frame, text="使用选中课程名重命名", command=self.rename_to_selected_online_title, state=tk.DISABLED)
         self.rename_selected_button.pack()
+        # Every local file against every scraped title at once, shown in the preview below
+        self.auto_assign_button = ttk.Button(scraped_title_match_frame, text="自动匹配全部文件", command=self.auto_assign_titles)
+        self.auto_assign_button.pack(pady=(5, 0))
 
         # File List/Preview Frame (Original Renaming Rules)
-        preview_frame = ttk.LabelFrame(rename_main_frame, text="文件预览 (原始名 -> 新名) - 基于下方规则", padding="10")
+        preview_frame = ttk.LabelFrame(rename_main_frame, text=self.RULE_PREVIEW_TEXT, padding="10")
         preview_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        self.rename_preview_frame = preview_frame
 
-        self.rename_preview_tree = ttk.Treeview(preview_frame, columns=("original", "new"), show="headings")
+        self.rename_preview_tree = ttk.Treeview(preview_frame, columns=("original", "new", "confidence"), show="headings")
         self.rename_preview_tree.heading("original", text="原始文件名")
         self.rename_preview_tree.heading("new", text="新文件名")
+        self.rename_preview_tree.heading("confidence", text="匹配度")
         self.rename_preview_tree.column("original", width=250, anchor=tk.W)
         self.rename_preview_tree.column("new", width=250, anchor=tk.W)
+        self.rename_preview_tree.column("confidence", width=60, anchor=tk.E)
+        self.rename_preview_tree.tag_configure('low_confidence', foreground='red')
+        # Rows that should not be renamed can be dropped before applying
+        self.rename_preview_tree.bind('<Delete>', self._remove_selected_preview_rows)
         
         preview_scrollbar = ttk.Scrollbar(preview_frame, orient="vertical", command=self.rename_preview_tree.yview)
         self.rename_preview_tree.configure(yscrollcommand=preview_scrollbar.set)
@@ -323,8 +497,10 @@ class VideoMergerApp:
 
         preview_button = ttk.Button(rename_action_frame, text="预览更改", command=self.preview_rename_changes)
         preview_button.pack(side=tk.LEFT, padx=5)
-        apply_button = ttk.Button(rename_action_frame, text="应用重命名", command=self.apply_rename_changes)
-        apply_button.pack(side=tk.LEFT, padx=5)
+        self.apply_rename_button = ttk.Button(rename_action_frame, text="应用重命名", command=self.apply_rename_changes)
+        self.apply_rename_button.pack(side=tk.LEFT, padx=5)
+        self.undo_rename_button = ttk.Button(rename_action_frame, text="撤销上次重命名", command=self.undo_last_rename)
+        self.undo_rename_button.pack(side=tk.LEFT, padx=5)
         close_button = ttk.Button(rename_action_frame, text="关闭", command=rename_window.destroy)
         close_button.pack(side=tk.RIGHT, padx=5)
 
@@ -334,97 +510,144 @@ class VideoMergerApp:
             string_var.set(folder_selected)
             self.preview_rename_changes() # Auto-preview when folder changes
         self._load_local_video_files(folder_selected) # Load video files for the new comparison UI
+        if folder_selected:
+            self._check_unfinished_rename(folder_selected)
 
-    def preview_rename_changes(self):
-        # Clear previous preview
-        for i in self.rename_preview_tree.get_children():
-            self.rename_preview_tree.delete(i)
+    def _schedule_rename_preview(self, *args):
+        if self.rename_preview_job:
+            self.root.after_cancel(self.rename_preview_job)
+        self.rename_preview_job = self.root.after(self.RENAME_PREVIEW_DELAY_MS, lambda: self.preview_rename_changes(interactive=False))
 
+    def preview_rename_changes(self, interactive=True):
+        # interactive=False for the refresh while rules are typed: half-typed input is not worth a dialog
+        self.rename_preview_job = None
         folder = self.rename_folder_var.get()
         if not folder or not os.path.isdir(folder):
-            messagebox.showerror("错误", "请选择一个有效的文件夹。", parent=self.rename_preview_tree.winfo_toplevel())
+            if interactive:
+                messagebox.showerror("错误", "请选择一个有效的文件夹。", parent=self.rename_preview_tree.winfo_toplevel())
             return
 
-        find_str = self.find_var.get()
-        replace_str = self.replace_var.get()
-        prefix = self.prefix_var.get()
-        suffix = self.suffix_var.get()
-        use_sequence = self.use_sequence_var.get()
         try:
             sequence_start = int(self.sequence_start_var.get())
         except ValueError:
-            messagebox.showerror("错误", "序列号起始编号必须是数字。", parent=self.rename_preview_tree.winfo_toplevel())
+            if interactive:
+                messagebox.showerror("错误", "序列号起始编号必须是数字。", parent=self.rename_preview_tree.winfo_toplevel())
             return
+        rules = RenameRules(self.find_var.get(), self.replace_var.get(), self.prefix_var.get(), self.suffix_var.get(),
+                            self.use_sequence_var.get(), sequence_start)
 
-        files = sorted([f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))])
-        
-        for i, original_filename in enumerate(files):
-            base, ext = os.path.splitext(original_filename)
-            new_base = base
-
-            if find_str: # Find and Replace
-                new_base = new_base.replace(find_str, replace_str)
-            
-            if prefix: # Add Prefix
-                new_base = prefix + new_base
-            
-            if suffix: # Add Suffix
-                new_base = new_base + suffix
-            
-            if use_sequence: # Add Sequence Number
-                # Format sequence number, e.g., _001, _002
-                # Adjust padding based on total number of files for better alignment if needed
-                sequence_num_str = f"_{sequence_start + i:03d}" 
-                # Decide if sequence replaces part of name or is appended
-                # For now, let's append it before the extension, or replace if no other rule applied
-                if new_base == base and not prefix and not suffix and not find_str: # if name is unchanged, sequence becomes the name
-                    new_base = f"file{sequence_num_str}"
-                else:
-                    new_base += sequence_num_str
-
-            new_filename = new_base + ext
-            self.rename_preview_tree.insert("", tk.END, values=(original_filename, new_filename))
+        # Listing a network share can take a while; the window stays responsive meanwhile
+        self.rename_preview_generation += 1
+        generation = self.rename_preview_generation
+        def compute():
+            try:
+                rows, error = apply_rules(self.folder_listing.list_files(folder), rules), None
+            except OSError as e:
+                rows, error = None, e
+            self.events.call(self._show_rule_preview, generation, rows, error, interactive)
+        threading.Thread(target=compute, daemon=True).start()
+
+    def _show_rule_preview(self, generation, rows, error, interactive):
+        if generation != self.rename_preview_generation or not self.rename_window_ref.winfo_exists():
+            return # Superseded by a newer preview, or the window was closed
+        if error is not None:
+            if interactive:
+                messagebox.showerror("错误", f"无法读取文件夹: {error}", parent=self.rename_window_ref)
+            return
+        tree = self.rename_preview_tree
+        if self.rule_preview_items is None:
+            # The tree shows an automatic title match: start over
+            tree.delete(*tree.get_children())
+            self.rule_preview_items = {}
+        # Only rows whose names changed are touched, so a refresh after renaming one file costs one row
+        shown = {original: new for original, (_, new) in self.rule_preview_items.items()}
+        removed, inserted, updated = diff_rows(shown, rows)
+        if removed:
+            tree.delete(*[self.rule_preview_items.pop(original)[0] for original in removed])
+        for original, new in updated.items():
+            item_id = self.rule_preview_items[original][0]
+            tree.item(item_id, values=(original, new, ""))
+            self.rule_preview_items[original] = (item_id, new)
+        for index, original, new in inserted:
+            self.rule_preview_items[original] = (tree.insert("", index, values=(original, new, "")), new)
+        self.rename_preview_frame.config(text=self.RULE_PREVIEW_TEXT)
 
     def apply_rename_changes(self):
+        parent = self.rename_preview_tree.winfo_toplevel()
         folder = self.rename_folder_var.get()
         if not folder or not os.path.isdir(folder):
-            messagebox.showerror("错误", "请选择一个有效的文件夹。", parent=self.rename_preview_tree.winfo_toplevel())
+            messagebox.showerror("错误", "请选择一个有效的文件夹。", parent=parent)
             return
 
         if not self.rename_preview_tree.get_children():
-            messagebox.showwarning("提示", "没有可应用的更改。请先预览。", parent=self.rename_preview_tree.winfo_toplevel())
+            messagebox.showwarning("提示", "没有可应用的更改。请先预览。", parent=parent)
             return
 
-        if not messagebox.askyesno("确认重命名", "确定要应用这些重命名操作吗？此操作无法撤销。", parent=self.rename_preview_tree.winfo_toplevel()):
+        # Swaps, chains and cycles are ordered by the planner; only real conflicts are left out
+        renames = [tuple(self.rename_preview_tree.item(item_id, 'values')[:2]) for item_id in self.rename_preview_tree.get_children()]
+        plan = plan_renames(folder, renames)
+        if not plan.moves:
+            if plan.conflicts:
+                messagebox.showerror("错误", "没有可以执行的重命名:\n" + self._describe_rename_conflicts(plan.conflicts), parent=parent)
+            else:
+                messagebox.showinfo("提示", "文件名都没有变化，无需重命名。", parent=parent)
+            return
+        question = f"确定要重命名 {len(plan.moves)} 个文件吗？\n完成后可以用“撤销上次重命名”整批恢复。"
+        if plan.conflicts:
+            question = f"以下 {len(plan.conflicts)} 项无法执行，将被跳过:\n{self._describe_rename_conflicts(plan.conflicts)}\n\n" + question
+        if not messagebox.askyesno("确认重命名", question, parent=parent):
             return
 
-        renamed_count = 0
-        error_count = 0
-        for item_id in self.rename_preview_tree.get_children():
-            original_filename, new_filename = self.rename_preview_tree.item(item_id, 'values')
-            original_filepath = os.path.join(folder, original_filename)
-            new_filepath = os.path.join(folder, new_filename)
-
-            if original_filepath == new_filepath:
-                continue # No change needed
-
-            if os.path.exists(new_filepath):
-                messagebox.showerror("错误", f"目标文件 '{new_filename}' 已存在。请解决冲突后重试。", parent=self.rename_preview_tree.winfo_toplevel())
-                error_count += 1
-                continue
-            
+        try:
+            batch = RenameBatch.begin(plan)
+        except OSError as e:
+            messagebox.showerror("重命名错误", f"无法写入重命名日志，未做任何更改:\n{e}", parent=parent)
+            return
+        self._run_rename_batch(batch, batch.run)
+
+    def _describe_rename_conflicts(self, conflicts):
+        lines = [f"{conflict.original} -> {conflict.new}: {conflict.reason}" for conflict in conflicts[:self.MAX_LISTED_CONFLICTS]]
+        if len(conflicts) > self.MAX_LISTED_CONFLICTS:
+            lines.append(f"... 另有 {len(conflicts) - self.MAX_LISTED_CONFLICTS} 项")
+        return "\n".join(lines)
+
+    def _run_rename_batch(self, batch, action):
+        # action is batch.run or batch.rollback; renaming thousands of files on a network share
+        # takes a while, so it runs off the Tk thread
+        self.apply_rename_button.config(state=tk.DISABLED)
+        self.undo_rename_button.config(state=tk.DISABLED)
+        def show_progress(text):
+            if self.rename_window_ref.winfo_exists():
+                self.rename_preview_frame.config(text=text)
+        def on_step(done, total):
+            if done % self.RENAME_PROGRESS_STEPS == 0 or done == total:
+                self.events.call(show_progress, f"正在处理: {done}/{total}")
+        def run():
             try:
-                os.rename(original_filepath, new_filepath)
-                renamed_count += 1
-            except OSError as e:
-                messagebox.showerror("重命名错误", f"无法重命名 '{original_filename}' 为 '{new_filename}':\n{e}", parent=self.rename_preview_tree.winfo_toplevel())
-                error_count += 1
-        
-        if error_count > 0:
-            messagebox.showwarning("部分完成", f"{renamed_count} 个文件已成功重命名，{error_count} 个文件失败。", parent=self.rename_preview_tree.winfo_toplevel())
+                action(on_step)
+                error = None
+            except (OSError, RenameFailed) as e:
+                error = e
+            self.events.call(self._on_rename_batch_done, batch, error)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_rename_batch_done(self, batch, error):
+        if not self.rename_window_ref.winfo_exists():
+            return # Window closed meanwhile; the journal has the outcome
+        parent = self.rename_window_ref
+        self.apply_rename_button.config(state=tk.NORMAL)
+        self.undo_rename_button.config(state=tk.NORMAL)
+        if isinstance(error, RenameFailed) and error.rolled_back:
+            messagebox.showerror("重命名失败", f"{error}\n已撤销本批次中已完成的重命名，文件夹保持原样。", parent=parent)
+        elif error is not None:
+            messagebox.showerror("重命名错误", f"{error}\n文件夹中的部分文件尚未恢复，重新选择该文件夹时可以继续撤销。", parent=parent)
+        elif batch.state == STATE_COMMITTED:
+            messagebox.showinfo("成功", f"{len(batch.moves())} 个文件已成功重命名。", parent=parent)
         else:
-            messagebox.showinfo("成功", f"{renamed_count} 个文件已成功重命名。", parent=self.rename_preview_tree.winfo_toplevel())
-        
+            messagebox.showinfo("成功", "已撤销重命名，文件已恢复原名。", parent=parent)
+
+        folder = batch.folder
+        self.folder_listing.invalidate(folder)
         self.preview_rename_changes() # Refresh preview for rule-based renaming
         self._load_local_video_files(folder) # Refresh local video files list
         # Clear selections and search for the comparison UI
@@ -437,6 +660,37 @@ class VideoMergerApp:
         self.rename_selected_button.config(state=tk.DISABLED)
         self.selected_local_video_path = None
 
+    def undo_last_rename(self):
+        folder = self.rename_folder_var.get()
+        parent = self.rename_window_ref
+        batch = RenameBatch.load(folder) if folder and os.path.isdir(folder) else None
+        if batch is None or batch.state != STATE_COMMITTED:
+            messagebox.showinfo("提示", "该文件夹没有可以撤销的重命名。", parent=parent)
+            return
+        moves = batch.moves()
+        if not messagebox.askyesno("撤销重命名", f"确定要撤销上次对 {len(moves)} 个文件的重命名吗？", parent=parent):
+            return
+        self._run_rename_batch(batch, batch.rollback)
+
+    def _check_unfinished_rename(self, folder):
+        # A batch interrupted by a crash is finished or undone before anything else is renamed
+        batch = RenameBatch.load(folder)
+        if batch is None or not batch.unfinished:
+            return
+        parent = self.rename_window_ref
+        if batch.state == STATE_ROLLING_BACK:
+            if messagebox.askyesno("未完成的撤销", "该文件夹上次的重命名撤销未完成。是否现在继续撤销？", parent=parent):
+                self._run_rename_batch(batch, batch.rollback)
+            return
+        answer = messagebox.askyesnocancel(
+            "未完成的重命名",
+            f"该文件夹上次的重命名未完成 (已完成 {batch.done}/{len(batch.steps)} 步)。\n"
+            "是: 继续完成重命名\n否: 撤销已完成的部分\n取消: 暂不处理", parent=parent)
+        if answer is True:
+            self._run_rename_batch(batch, batch.run)
+        elif answer is False:
+            self._run_rename_batch(batch, batch.rollback)
+
     def start_processing_thread(self):
         input_folder = self.input_folder_var.get()
         output_folder = self.output_folder_var.get()
@@ -454,123 +708,221 @@ class VideoMergerApp:
                 messagebox.showerror("错误", f"无法创建输出文件夹: {output_folder}\n{e}")
                 return
 
-        self.overwrite_all_choice = None # Reset for each new batch operation
+        try:
+            concurrency = int(self.concurrency_var.get())
+            if concurrency < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("错误", "并发数必须是大于0的整数。")
+            return
+        per_device = None
+        if self.per_device_var.get() != self.PER_DEVICE_AUTO:
+            try:
+                per_device = int(self.per_device_var.get())
+                if per_device < 1:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("错误", "每磁盘并发数必须是大于0的整数或“自动”。")
+                return
+
         self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.cancel_event = threading.Event()
         self.progress_label_var.set("状态: 开始处理...")
         self.progress_bar['value'] = 0
 
         # Run processing in a separate thread to keep UI responsive
-        thread = threading.Thread(target=self.process_videos_in_thread, args=(input_folder, output_folder), daemon=True)
+        engine = next(e for e, label in self.ENGINE_LABELS.items() if label == self.engine_var.get())
+        policy = next(p for p, label in self.OVERWRITE_LABELS.items() if label == self.overwrite_policy_var.get())
+        thread = threading.Thread(target=self.process_videos_in_thread,
+                                  args=(input_folder, output_folder, concurrency, self.live_progress_var.get(), engine, policy,
+                                        self.verify_output_var.get(), self.faststart_var.get(), per_device), daemon=True)
         thread.start()
 
-    def process_videos_in_thread(self, input_folder, output_folder):
-        subfolders = [f.path for f in os.scandir(input_folder) if f.is_dir()]
-        total_folders = len(subfolders)
-        processed_count = 0
-        conversion_errors = []
+    def process_videos_in_thread(self, *args):
+        try:
+            self._process_videos(*args)
+        except Exception as e: # A bug or an unexpected OS error must not leave the start button disabled
+            self.events.post(EVENT_STATUS, "状态: 处理出错")
+            self.events.call(messagebox.showerror, "错误", f"处理过程中发生意外错误: {e}", parent=self.root)
+        finally:
+            self.events.call(self.start_button.config, state=tk.NORMAL)
+            self.events.call(self.stop_button.config, state=tk.DISABLED)
+
+    def stop_processing(self):
+        self.stop_button.config(state=tk.DISABLED)
+        self.cancel_event.set()
+        self.progress_label_var.set("状态: 正在停止，等待进行中的转换完成...")
+
+    def _process_videos(self, input_folder, output_folder, concurrency=None, live_progress=False, engine=ENGINE_FFMPEG,
+                        overwrite_policy=POLICY_SKIP, verify=False, faststart=False, per_device=None):
+        jobs = discover_jobs(input_folder, output_folder, engine)
+        total_folders = len(jobs)
+        # Shared between the pool workers, guarded by batch_lock
+        self.batch_lock = threading.Lock()
+        self.processed_count = 0
+        self.conversion_errors = []
+        self.batch_abort_status = None
+        self.completed_job_count = 0
+        self.running_job_fractions = {} # job -> fraction of its current m3u8 written so far
+        self.live_progress = live_progress
+        self.engine = engine
+        self.verify = verify
+        self.faststart = faststart
+        self.overwrite_policy = OverwritePolicy(overwrite_policy)
+        self.io_scheduler = IoScheduler(per_device)
 
-        for i, subfolder_path in enumerate(subfolders):
-            self.root.after(0, lambda p=i, t=total_folders: self.update_progress_bar_safe((p / t) * 100))
-            folder_name = os.path.basename(subfolder_path)
-            self.root.after(0, lambda fn=folder_name: self.update_progress_label_safe(f"处理中: {fn} ({i+1}/{total_folders})"))
+        try:
+            # Picks up where an interrupted run of the same input/output pair stopped
+            self.manifest = JobManifest(input_folder, output_folder)
+            self.manifest.register(jobs)
+            self.skip_cache = ConversionCache(output_folder)
+        except OSError as e:
+            self.events.post(EVENT_STATUS, "状态: 空闲")
+            self.events.call(messagebox.showerror, "错误", f"无法写入任务清单或跳过缓存: {e}", parent=self.root)
+            return
+        if self.manifest.resumed:
+            self.events.post(EVENT_STATUS, "状态: 继续上次未完成的批处理...")
+
+        def on_job_done(job, done_count, total):
+            with self.batch_lock:
+                self.completed_job_count = done_count
+                self.running_job_fractions.pop(job, None)
+                overall = (done_count + sum(self.running_job_fractions.values())) / total
+            self.events.post(EVENT_PROGRESS, overall * 100)
+            self.events.post(EVENT_STATUS, f"已完成: {job.folder_name} ({done_count}/{total})")
+
+        ran = run_batch(jobs, lambda job: self._convert_job(job, total_folders),
+                        concurrency=concurrency, on_job_done=on_job_done, cancel_event=self.cancel_event, scheduler=self.io_scheduler)
+
+        if self.cancel_event.is_set() and not self.batch_abort_status:
+            # Stopped by the user; the jobs not started stay pending in the manifest
+            ran = set(ran)
+            for job in jobs:
+                if job not in ran:
+                    self._log_history_async(job.subfolder_path, "N/A", STATUS_CANCELLED)
+            self.batch_abort_status = f"状态: 用户取消操作 (已完成 {len(ran)}/{total_folders} 个文件夹)"
+        if self.batch_abort_status:
+            self.events.post(EVENT_STATUS, self.batch_abort_status)
+            return
 
-            m3u8_files = [f for f in os.listdir(subfolder_path) if f.endswith(".m3u8")]
+        # After all jobs completed
+        self.manifest.finish()
+        self.events.post(EVENT_PROGRESS, 100)
+        final_status_message = f"状态: 完成! 共处理 {self.processed_count}/{total_folders} 个文件夹."
+        if self.conversion_errors:
+            final_status_message += f" {len(self.conversion_errors)} 个发生错误."
+        self.events.post(EVENT_STATUS, final_status_message)
+        overwrite_summary = self.overwrite_policy.summary()
+        if self.conversion_errors or overwrite_summary:
+            # One summary at the end instead of a dialog per file
+            self.events.call(self.show_batch_summary, list(self.conversion_errors), overwrite_summary)
+
+    def _log_history_async(self, input_path, output_file, status, details=None):
+        # Workers must not touch the Treeview directly; history is written on the Tk thread
+        self.events.post(EVENT_HISTORY, input_path, output_file, status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), details)
+
+    def _record_job_result(self, job, input_path, status, error_msg=None, processed=False, details=None):
+        with self.batch_lock:
+            job.results.append((input_path, status))
+            if processed:
+                self.processed_count += 1
+            if error_msg:
+                job.error = error_msg
+                self.conversion_errors.append(error_msg)
+        self._log_history_async(input_path, job.output_filename, status, details)
+
+    def _convert_job(self, job, total_folders):
+        self.events.post(EVENT_STATUS, f"处理中: {job.folder_name} (共 {total_folders} 个)")
+
+        cache_state = self.skip_cache.check(job) if job.m3u8_files else None
+        if cache_state == CACHE_FRESH:
+            self._record_job_result(job, job.subfolder_path, STATUS_UNCHANGED_SKIPPED, processed=True)
+            self.manifest.mark_finished(job, JOB_SKIPPED)
+            return
+        if self.manifest.resume(job):
+            self._record_job_result(job, job.subfolder_path, STATUS_RESUMED_DONE, processed=True)
+            return
+        try:
+            # A stale output was produced by us from older sources, so replace it without asking
+            self._convert_job_playlists(job, total_folders, replace_output=(cache_state == CACHE_STALE))
+        except BatchCancelled:
+            self.manifest.mark(job, JOB_PENDING) # Not finished; picked up again on resume
+            raise
+        if job.error:
+            self.manifest.mark_finished(job, JOB_FAILED)
+        elif job.results and all(status in KEPT_OUTPUT_STATUSES for _, status in job.results):
+            self.manifest.mark_finished(job, JOB_SKIPPED)
+        else:
+            self.manifest.mark_finished(job, JOB_DONE)
+            if any(status == STATUS_SUCCESS for _, status in job.results):
+                self.skip_cache.record(job)
+
+    def _convert_job_playlists(self, job, total_folders, replace_output=False):
+        if not job.m3u8_files:
+            self._log_history_async(job.subfolder_path, "N/A", STATUS_NO_M3U8)
+            return
 
-            if not m3u8_files:
-                self.log_history(subfolder_path, "N/A", "无m3u8文件跳过")
+        # Assuming one m3u8 per subfolder for simplicity, or process all
+        for input_m3u8_path in job.m3u8_paths(): # Though typically one
+            skip_status = None if replace_output else self.overwrite_policy.resolve(job)
+            if skip_status:
+                self._record_job_result(job, input_m3u8_path, skip_status, processed=True)
                 continue
 
-            # Assuming one m3u8 per subfolder for simplicity, or process all
-            for m3u8_file in m3u8_files: # Though typically one
-                input_m3u8_path = os.path.join(subfolder_path, m3u8_file)
-                # Sanitize output filename from folder_name or m3u8_file name
-                sanitized_folder_name = "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in folder_name).rstrip()
-                output_filename = f"{sanitized_folder_name}.mp4"
-                output_mp4_path = os.path.join(output_folder, output_filename)
-
-                action = None
-                if os.path.exists(output_mp4_path):
-                    if self.overwrite_all_choice == 'yes_all':
-                        action = 'yes'
-                    elif self.overwrite_all_choice == 'no_all':
-                        action = 'no'
-                    else:
-                        # Use a queue to get the dialog result from the main thread
-                        dialog_q = queue.Queue()
-                        # Schedule the dialog to be shown in the main thread
-                        self.root.after(0, lambda: self.ask_user_for_overwrite(output_filename, dialog_q))
-                        # Wait for the dialog result
-                        action = dialog_q.get() # This blocks the worker thread until dialog is closed
-
-                        if action == 'yes_all':
-                            self.overwrite_all_choice = 'yes_all'
-                            action = 'yes' # Proceed with overwrite for current file
-                        elif action == 'no_all':
-                            self.overwrite_all_choice = 'no_all'
-                            action = 'no' # Proceed with skip for current file
-
-                if action == 'no':
-                    self.log_history(input_m3u8_path, output_filename, "已存在-跳过")
-                    processed_count +=1
-                    continue
-                elif action == 'cancel':
-                    self.log_history(input_m3u8_path, output_filename, "用户取消")
-                    self.root.after(0, lambda: self.update_progress_label_safe("状态: 用户中止"))
-                    self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-                    return # Abort all further processing
-
-                # FFmpeg command construction
-                command = [
-                    self.ffmpeg_path,
-                    '-protocol_whitelist', 'file,http,https,tcp,tls,crypto,pipe',
-                    '-i', input_m3u8_path,
-                    '-c', 'copy',
-                    '-bsf:a', 'aac_adtstoasc',
-                    output_mp4_path
-                ]
-                if action == 'yes': # Overwrite if 'yes' or 'yes_all'
-                    command.insert(1, '-y')
-
-                try:
-                    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                    stdout, stderr = process.communicate()
-
-                    if process.returncode == 0:
-                        self.log_history(input_m3u8_path, output_filename, "成功")
-                        processed_count += 1
-                    else:
-                        error_msg = f"FFmpeg错误 ({output_filename}): {stderr.strip()}"
-                        self.log_history(input_m3u8_path, output_filename, f"失败: {process.returncode}")
-                        conversion_errors.append(error_msg)
-                        # Optionally show error for each failed conversion immediately or summarize later
-                        # self.root.after(0, lambda em=error_msg: messagebox.showerror("转换失败", em, parent=self.root))
-                except FileNotFoundError:
-                    error_msg = f"FFmpeg未找到。请确保ffmpeg已安装并配置在系统PATH中，或ffmpeg.exe在程序目录下。"
-                    self.log_history(input_m3u8_path, output_filename, "失败: FFmpeg未找到")
-                    conversion_errors.append(error_msg)
-                    # Stop further processing if ffmpeg is not found
-                    self.root.after(0, lambda em=error_msg: messagebox.showerror("严重错误", em, parent=self.root))
-                    self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-                    return
-                except Exception as e:
-                    error_msg = f"处理时发生未知错误 ({output_filename}): {e}"
-                    self.log_history(input_m3u8_path, output_filename, "失败: 未知错误")
-                    conversion_errors.append(error_msg)
-                    # self.root.after(0, lambda em=error_msg: messagebox.showerror("转换失败", em, parent=self.root))
-
-        # After loop completion
-        self.root.after(0, lambda: self.update_progress_bar_safe(100))
-        final_status_message = f"状态: 完成! 共处理 {processed_count}/{total_folders} 个文件夹."
-        if conversion_errors:
-            final_status_message += f" {len(conversion_errors)} 个发生错误."
-            # Show a summary of errors
-            self.root.after(0, lambda errs=list(conversion_errors): self.show_error_summary(errs))
-        self.root.after(0, lambda msg=final_status_message: self.update_progress_label_safe(msg))
-        self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-
-    def show_error_summary(self, errors):
-        summary = "以下文件转换失败:\n\n" + "\n".join(errors)
-        messagebox.showerror("转换错误概要", summary, parent=self.root)
+            on_progress = (lambda p: self._on_job_progress(job, total_folders, p)) if self.live_progress else None
+            self.manifest.mark_running(job)
+            try:
+                # An existing output is only replaced when the overwrite policy allows it
+                status, error_msg = convert_m3u8(self.ffmpeg_path, job, input_m3u8_path, on_progress=on_progress,
+                                                 engine=self.engine, verify=self.verify, faststart=self.faststart,
+                                                 scheduler=self.io_scheduler, cancel_event=self.cancel_event)
+                details = {}
+                verify_result = job.verify_results.get(input_m3u8_path)
+                if verify_result:
+                    details["verify"] = verify_result.to_dict()
+                attempts = job.attempts.get(input_m3u8_path, [])
+                if len(attempts) > 1:
+                    details["attempts"] = attempts # Only kept when something was retried
+                self._record_job_result(job, input_m3u8_path, status, error_msg=error_msg, processed=error_msg is None, details=details)
+            except FfmpegNotFound:
+                self._record_job_result(job, input_m3u8_path, STATUS_FFMPEG_MISSING, error_msg=FFMPEG_MISSING_MESSAGE)
+                # Stop further processing if ffmpeg is not found
+                with self.batch_lock:
+                    first_failure = self.batch_abort_status is None
+                    self.batch_abort_status = "状态: FFmpeg错误"
+                if first_failure:
+                    self.events.call(messagebox.showerror, "严重错误", FFMPEG_MISSING_MESSAGE, parent=self.root)
+                raise BatchCancelled()
+
+    def _on_job_progress(self, job, total_folders, progress):
+        # Called from the ffmpeg reader thread of a job after every -progress block
+        with self.batch_lock:
+            self.running_job_fractions[job] = progress.fraction()
+            overall = (self.completed_job_count + sum(self.running_job_fractions.values())) / total_folders
+        text = f"处理中: {job.folder_name} {format_seconds(progress.out_time)}"
+        if progress.duration:
+            text += f"/{format_seconds(progress.duration)}"
+        if progress.speed:
+            text += f" 速度 {progress.speed:.1f}x"
+        text += f" 已写入 {progress.total_size / (1024 * 1024):.1f}MB"
+        eta = progress.eta_seconds()
+        if eta is not None:
+            text += f" 剩余约 {format_seconds(eta)}"
+        self.events.post(EVENT_PROGRESS, overall * 100)
+        self.events.post(EVENT_STATUS, text)
+
+    def show_batch_summary(self, errors, overwrite_summary):
+        sections = []
+        for decision, title in ((DECISION_OVERWRITE, "已覆盖的文件"), (DECISION_SKIP, "已保留的现有文件"), (DECISION_RENAME, "已改名输出的文件")):
+            filenames = overwrite_summary.get(decision)
+            if filenames:
+                sections.append(f"{title} ({len(filenames)}):\n" + "\n".join(filenames))
+        if errors:
+            sections.append("以下文件转换失败:\n\n" + "\n".join(errors))
+            messagebox.showerror("批处理概要", "\n\n".join(sections), parent=self.root)
+        else:
+            messagebox.showinfo("批处理概要", "\n\n".join(sections), parent=self.root)
 
     def update_progress_bar_safe(self, value):
         self.progress_bar['value'] = value
@@ -578,11 +930,21 @@ class VideoMergerApp:
     def update_progress_label_safe(self, text):
         self.progress_label_var.set(text)
 
+    def _get_video_files_in_folder(self, folder_path):
+        if not folder_path or not os.path.isdir(folder_path):
+            return []
+        try:
+            return [name for name in self.folder_listing.list_files(folder_path) if name.lower().endswith(self.VIDEO_EXTENSIONS)]
+        except OSError:
+            return []
+
     def _load_local_video_files(self, folder_path):
         self.local_files_listbox.delete(0, tk.END)
         video_files = self._get_video_files_in_folder(folder_path)
         for vf in video_files:
             self.local_files_listbox.insert(tk.END, vf)
+        # Thumbnails for the whole folder, so selecting a file later shows its frame at once
+        self.thumbnail_cache.prefetch([os.path.join(folder_path, vf) for vf in video_files])
         self.play_preview_button.config(state=tk.DISABLED)
         self.rename_selected_button.config(state=tk.DISABLED)
         self.selected_local_video_path = None
@@ -594,89 +956,46 @@ class VideoMergerApp:
         if not url:
             messagebox.showerror("错误", "请输入课程URL。", parent=self.rename_window_ref)
             return
+        try:
+            _import_scraping_modules()
+        except ImportError as e:
+            messagebox.showerror("缺少依赖", f"抓取课程名称需要安装 requests 和 beautifulsoup4:\n{e}", parent=self.rename_window_ref)
+            return
+
+        if self.title_scraper is None:
+            self.title_scraper = TitleScraper(os.path.join(self.script_dir, TITLE_CACHE_FILENAME), headers=self.REQUEST_HEADERS)
+        self._set_scraped_titles_text("正在抓取，请稍候...\n")
+        self.scrape_button.config(state=tk.DISABLED)
+        # Downloads and parses on a worker thread; the window stays responsive meanwhile
+        self.title_scraper.scrape_async(url, lambda result, error: self.events.call(self._on_titles_scraped, result, error))
 
+    def _set_scraped_titles_text(self, text):
         self.scraped_titles_listbox.configure(state='normal')
         self.scraped_titles_listbox.delete(1.0, tk.END)
-        self.scraped_titles_listbox.insert(tk.END, "正在抓取，请稍候...\n")
+        self.scraped_titles_listbox.insert(tk.END, text)
         self.scraped_titles_listbox.configure(state='disabled')
-        self.scrape_button.config(state=tk.DISABLED)
-        self.root.update_idletasks()
 
-        try:
-            # Using a session for potential cookie handling or connection pooling
-            session = requests.Session()
-            response = session.get(url, headers=VideoMergerApp.REQUEST_HEADERS, timeout=20) # Increased timeout
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Attempt to find titles - this selector is a guess and likely needs adjustment
-            # Based on manual inspection of icourse163, titles might be in divs with class 'text js-text' inside 'section-list'
-            # Or, for the specific course, they are in <p class="text"> inside <div class="textCon f-fl"> within list items
-            # Let's try a more specific selector based on the course structure
-            # The actual titles seem to be within <div class="textCon f-fl">...<p class="text">TITLE</p>...</div>
-            # and also the main chapter titles <h3 class="f-thide f-fl listTxt">CHAPTER TITLE</h3>
-            # This needs to be robust.
-
-            self.all_scraped_titles = []
-            # Example: Find all chapter titles (h3 with class 'listTxt') and lesson titles (p with class 'text')
-            # This is a simplified example; a real scraper would need to handle the page structure more carefully.
-            # For icourse163, content is often loaded dynamically. This might only get initial static content.
-            
-            # Let's try to find elements that look like video titles. Common class: 'text' inside 'lessontitle'
-            # Or, for the provided URL structure: items with class 'f-richEditorText'.
-            # The titles are in <p class="text"> within <div class="textCon f-fl"> for each lesson item.
-            # And chapter titles are in <h3 class="f-thide f-fl listTxt">.
-
-            # First, try to get chapter titles
-            chapter_elements = soup.select('div.chapter div.listInnerPos h3.listTxt')
-            # Then, lesson titles within each chapter section
-            lesson_elements_in_chapters = soup.select('div.chapter ul.section-list li.section div.textCon p.text')
-            # Also, sometimes there are top-level lesson lists
-            top_level_lesson_elements = soup.select('ul.video-list li div.textCon p.text')
-
-            # A more general approach for the given URL structure (based on observed structure):
-            # Titles seem to be in elements with class 'j-titletext' or within 'f-richEditorText'
-            # Let's try to find all <p class="text"> elements within <div class="textCon"> as a primary target
-            title_elements = soup.select('div.textCon p.text')
-            if not title_elements:
-                # Fallback to another common pattern if the above fails
-                title_elements = soup.select('.lessontitle .text') # A common pattern on MOOC sites
-            if not title_elements:
-                 title_elements = soup.select('h3.f-thide.f-fl.listTxt') # Chapter titles
-
-            if not title_elements:
-                self.all_scraped_titles.append("未能自动提取标题，请检查URL或手动输入。")
-            else:
-                for el in title_elements:
-                    title = el.get_text(strip=True)
-                    if title:
-                        self.all_scraped_titles.append(title)
-            
-            self.scraped_titles_listbox.configure(state='normal')
-            self.scraped_titles_listbox.delete(1.0, tk.END)
-            if self.all_scraped_titles:
-                for title_text in self.all_scraped_titles:
-                    self.scraped_titles_listbox.insert(tk.END, title_text + "\n")
+    def _on_titles_scraped(self, result, error):
+        if not self.rename_window_ref.winfo_exists():
+            return # Window closed while scraping
+        self.scrape_button.config(state=tk.NORMAL)
+        if error is not None:
+            requests, _ = _import_scraping_modules()
+            if isinstance(error, requests.exceptions.RequestException):
+                messagebox.showerror("抓取错误", f"无法连接到URL或请求失败: {error}", parent=self.rename_window_ref)
+                self._set_scraped_titles_text(f"抓取失败: {error}\n")
             else:
-                self.scraped_titles_listbox.insert(tk.END, "未找到课程标题。可能是动态加载的内容，或页面结构已更改。\n")
-            self.scraped_titles_listbox.configure(state='disabled')
-            self.filter_scraped_titles() # Populate the matched listbox initially
-
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("抓取错误", f"无法连接到URL或请求失败: {e}", parent=self.rename_window_ref)
-            self.scraped_titles_listbox.configure(state='normal')
-            self.scraped_titles_listbox.delete(1.0, tk.END)
-            self.scraped_titles_listbox.insert(tk.END, f"抓取失败: {e}\n")
-            self.scraped_titles_listbox.configure(state='disabled')
-        except Exception as e:
-            messagebox.showerror("抓取错误", f"解析内容时发生未知错误: {e}", parent=self.rename_window_ref)
-            self.scraped_titles_listbox.configure(state='normal')
-            self.scraped_titles_listbox.delete(1.0, tk.END)
-            self.scraped_titles_listbox.insert(tk.END, f"解析错误: {e}\n")
-            self.scraped_titles_listbox.configure(state='disabled')
-        finally:
-            self.scrape_button.config(state=tk.NORMAL)
+                messagebox.showerror("抓取错误", f"解析内容时发生未知错误: {error}", parent=self.rename_window_ref)
+                self._set_scraped_titles_text(f"解析错误: {error}\n")
+            return
+
+        self.all_scraped_titles = result.titles or [self.NO_TITLES_PLACEHOLDER]
+        self.title_index = None
+        text = "".join(title + "\n" for title in self.all_scraped_titles)
+        if result.source == SOURCE_STALE_CACHE:
+            text = f"(网络请求失败，显示上次抓取的结果: {result.error})\n" + text
+        self._set_scraped_titles_text(text)
+        self.filter_scraped_titles() # Populate the matched listbox initially
 
     def on_local_file_select(self, event=None):
         if not self.local_files_listbox.curselection():
@@ -698,74 +1017,68 @@ class VideoMergerApp:
     def _display_first_frame_preview(self):
         if not self.selected_local_video_path or not os.path.exists(self.selected_local_video_path):
             return
+        data = self.thumbnail_cache.get(self.selected_local_video_path)
+        if data is None:
+            # Not made yet: the worker does this file next and _on_thumbnail_ready shows it
+            self.video_preview_canvas.delete("all")
+            self.thumbnail_cache.request(self.selected_local_video_path, urgent=True)
+            return
+        self._show_thumbnail(data)
+
+    def _on_thumbnail_ready(self, path, data):
+        # Thumbnails of other files are only cached; playback keeps the canvas to itself
+        if path == self.selected_local_video_path and not self.is_previewing and self.rename_window_ref.winfo_exists():
+            if data is None:
+                self.video_preview_canvas.delete("all")
+            else:
+                self._show_thumbnail(data)
+
+    def _show_thumbnail(self, data):
         try:
-            cap = cv2.VideoCapture(self.selected_local_video_path)
-            if not cap.isOpened():
-                return
-            ret, frame = cap.read()
-            if ret:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                # Resize frame to fit canvas
-                canvas_w = self.video_preview_canvas.winfo_width()
-                canvas_h = self.video_preview_canvas.winfo_height()
-                if canvas_w == 1 or canvas_h == 1: # Canvas not yet rendered
-                    canvas_w, canvas_h = 320, 180 # Default size
-                
-                img_h, img_w, _ = frame_rgb.shape
-                aspect_ratio = img_w / img_h
-                
-                if canvas_w / aspect_ratio <= canvas_h:
-                    new_w = canvas_w
-                    new_h = int(canvas_w / aspect_ratio)
-                else:
-                    new_h = canvas_h
-                    new_w = int(canvas_h * aspect_ratio)
-                
-                resized_frame = cv2.resize(frame_rgb, (new_w, new_h), interpolation=cv2.INTER_AREA)
-                img = Image.fromarray(resized_frame)
-                self.preview_photo = ImageTk.PhotoImage(image=img) # Keep a reference
-                self.video_preview_canvas.create_image(canvas_w//2, canvas_h//2, anchor=tk.CENTER, image=self.preview_photo)
-            cap.release()
+            _, Image, ImageTk = _import_preview_modules()
+            canvas_w = self.video_preview_canvas.winfo_width()
+            canvas_h = self.video_preview_canvas.winfo_height()
+            if canvas_w == 1 or canvas_h == 1: # Canvas not yet rendered
+                canvas_w, canvas_h = 320, 180 # Default size
+            self.preview_photo = ImageTk.PhotoImage(image=Image.open(io.BytesIO(data))) # Keep a reference
+            self.video_preview_canvas.delete("all")
+            self.video_preview_canvas.create_image(canvas_w//2, canvas_h//2, anchor=tk.CENTER, image=self.preview_photo)
         except Exception as e:
             print(f"Error displaying first frame: {e}") # Log to console for now
             self.video_preview_canvas.delete("all") # Clear on error
 
     def _update_preview_frame(self):
-        if not self.is_previewing or not self.video_capture or not self.video_capture.isOpened():
+        if not self.is_previewing or not self.preview_player:
             self._stop_video_preview_playback()
             return
 
-        ret, frame = self.video_capture.read()
-        current_time_ms = self.video_capture.get(cv2.CAP_PROP_POS_MSEC)
-
-        if ret and current_time_ms <= 15000: # Play for 15 seconds
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            canvas_w = self.video_preview_canvas.winfo_width()
-            canvas_h = self.video_preview_canvas.winfo_height()
-            if canvas_w == 1 or canvas_h == 1: canvas_w, canvas_h = 320, 180
-
-            img_h, img_w, _ = frame_rgb.shape
-            aspect_ratio = img_w / img_h
-            if canvas_w / aspect_ratio <= canvas_h:
-                new_w = canvas_w
-                new_h = int(canvas_w / aspect_ratio)
-            else:
-                new_h = canvas_h
-                new_w = int(canvas_h * aspect_ratio)
-            
-            resized_frame = cv2.resize(frame_rgb, (new_w, new_h), interpolation=cv2.INTER_AREA)
-            img = Image.fromarray(resized_frame)
-            self.preview_photo = ImageTk.PhotoImage(image=img)
-            self.video_preview_canvas.create_image(canvas_w//2, canvas_h//2, anchor=tk.CENTER, image=self.preview_photo)
-            self.preview_frame_job = self.root.after(33, self._update_preview_frame) # Approx 30 FPS
-        else:
+        try:
+            image = self.preview_player.next_frame() # Already converted and scaled by the decoder thread
+        except EOFError:
+            if self.preview_player.error:
+                messagebox.showerror("预览错误", f"播放视频预览时出错: {self.preview_player.error}", parent=self.rename_window_ref)
             self._stop_video_preview_playback()
+            return
+        if image is not None:
+            if self.preview_photo_size != image.size:
+                # First frame: one PhotoImage for the whole playback, later frames are pasted into it
+                _, _, ImageTk = _import_preview_modules()
+                self.preview_photo = ImageTk.PhotoImage(image=image)
+                self.preview_photo_size = image.size
+                canvas_w = self.video_preview_canvas.winfo_width()
+                canvas_h = self.video_preview_canvas.winfo_height()
+                if canvas_w == 1 or canvas_h == 1: canvas_w, canvas_h = 320, 180
+                self.video_preview_canvas.delete("all")
+                self.video_preview_canvas.create_image(canvas_w//2, canvas_h//2, anchor=tk.CENTER, image=self.preview_photo)
+            else:
+                self.preview_photo.paste(image)
+        self.preview_frame_job = self.root.after(self.PREVIEW_TICK_MS, self._update_preview_frame)
 
     def _stop_video_preview_playback(self):
         self.is_previewing = False
-        if self.video_capture:
-            self.video_capture.release()
-            self.video_capture = None
+        if self.preview_player:
+            self.preview_player.stop()
+            self.preview_player = None
         if self.preview_frame_job:
             self.root.after_cancel(self.preview_frame_job)
             self.preview_frame_job = None
@@ -774,7 +1087,7 @@ class VideoMergerApp:
         if self.selected_local_video_path:
              self._display_first_frame_preview()
 
-    def play_video_preview(self):
+    def play_video_preview(self, start_seconds=0.0):
         if self.is_previewing:
             self._stop_video_preview_playback()
             return
@@ -784,44 +1097,111 @@ class VideoMergerApp:
             return
 
         try:
-            self.video_capture = cv2.VideoCapture(self.selected_local_video_path)
-            if not self.video_capture.isOpened():
-                messagebox.showerror("错误", "无法打开视频文件进行预览。", parent=self.rename_window_ref)
-                self.video_capture = None
+            _import_preview_modules()
+        except ImportError as e:
+            messagebox.showerror("缺少依赖", f"视频预览需要安装 opencv-python 和 Pillow:\n{e}", parent=self.rename_window_ref)
+            return
+
+        canvas_w = self.video_preview_canvas.winfo_width()
+        canvas_h = self.video_preview_canvas.winfo_height()
+        if canvas_w == 1 or canvas_h == 1: canvas_w, canvas_h = 320, 180
+        self.preview_player = PreviewPlayer(self.selected_local_video_path, (canvas_w, canvas_h), duration_limit=self.PREVIEW_SECONDS,
+                                            start_seconds=start_seconds)
+        self.preview_player.start()
+        self.preview_photo_size = None
+        self.is_previewing = True
+        self.play_preview_button.config(text="停止预览", state=tk.NORMAL)
+        self._update_preview_frame()
+
+    def open_contact_sheet(self):
+        video_path = self.selected_local_video_path
+        if not video_path or not os.path.exists(video_path):
+            messagebox.showerror("错误", "未选择有效的视频文件或文件不存在。", parent=self.rename_window_ref)
+            return
+        try:
+            _, Image, ImageTk = _import_preview_modules()
+        except ImportError as e:
+            messagebox.showerror("缺少依赖", f"关键帧预览需要安装 opencv-python 和 Pillow:\n{e}", parent=self.rename_window_ref)
+            return
+
+        sheet_window = tk.Toplevel(self.rename_window_ref)
+        sheet_window.title(f"关键帧预览 - {os.path.basename(video_path)}")
+        tile_w, tile_h = TILE_SIZE
+        cell_w, cell_h = tile_w + 8, tile_h + 24 # Room for the timestamp under each tile
+        rows = (SHEET_TILES + SHEET_COLUMNS - 1) // SHEET_COLUMNS
+        canvas = tk.Canvas(sheet_window, width=SHEET_COLUMNS * cell_w, height=rows * cell_h, bg="black")
+        canvas.pack(padx=5, pady=5)
+        status_var = tk.StringVar(value="正在提取关键帧... (点击画面从该处播放预览)")
+        ttk.Label(sheet_window, textvariable=status_var).pack(pady=(0, 5))
+        tile_photos = [] # Keep references, Tk does not
+        stop_event = threading.Event()
+        sheet_window.bind('<Destroy>', lambda event: stop_event.set() if event.widget is sheet_window else None)
+
+        def show_tile(index, seconds, data):
+            if not sheet_window.winfo_exists():
                 return
-            
-            self.is_previewing = True
-            self.play_preview_button.config(text="停止预览", state=tk.NORMAL)
-            self.video_preview_canvas.delete("all") # Clear previous static image
-            self._update_preview_frame()
+            x = (index % SHEET_COLUMNS) * cell_w + cell_w // 2
+            y = (index // SHEET_COLUMNS) * cell_h
+            tag = f"tile{index}"
+            if data is not None:
+                tile_photos.append(ImageTk.PhotoImage(image=Image.open(io.BytesIO(data))))
+                canvas.create_image(x, y + 4 + tile_h // 2, anchor=tk.CENTER, image=tile_photos[-1], tags=tag)
+            canvas.create_text(x, y + tile_h + 14, text=format_seconds(seconds), fill="white", tags=tag)
+            canvas.tag_bind(tag, '<Button-1>', lambda event: self._play_from_contact_sheet(video_path, seconds))
+
+        def finished(duration, error):
+            if sheet_window.winfo_exists():
+                if error:
+                    status_var.set(error)
+                elif duration is None:
+                    status_var.set("无法读取视频时长，无法生成关键帧预览。")
+                else:
+                    status_var.set(f"时长 {format_seconds(duration)}，点击画面从该处播放预览")
 
-        except Exception as e:
-            messagebox.showerror("预览错误", f"播放视频预览时出错: {e}", parent=self.rename_window_ref)
-            if self.video_capture: self.video_capture.release()
-            self.video_capture = None
-            self.is_previewing = False
-            self.play_preview_button.config(text="播放15秒预览", state=tk.NORMAL if self.selected_local_video_path else tk.DISABLED)
+        def extract():
+            duration, error = None, None
+            try:
+                duration = build_contact_sheet(self.ffmpeg_path, video_path,
+                                               lambda index, seconds, data: self.events.call(show_tile, index, seconds, data),
+                                               stop_event=stop_event)
+            except FileNotFoundError:
+                error = FFMPEG_MISSING_MESSAGE
+            except OSError as e:
+                error = f"提取关键帧时出错: {e}"
+            self.events.call(finished, duration, error)
+
+        threading.Thread(target=extract, daemon=True).start()
+
+    def _play_from_contact_sheet(self, video_path, seconds):
+        if video_path != self.selected_local_video_path:
+            return # Another file was selected meanwhile
+        if self.is_previewing:
+            self._stop_video_preview_playback()
+        self.play_video_preview(start_seconds=seconds)
+
+    def _schedule_title_filter(self, event=None):
+        if self.title_filter_job:
+            self.root.after_cancel(self.title_filter_job)
+        self.title_filter_job = self.root.after(self.TITLE_FILTER_DELAY_MS, self.filter_scraped_titles)
 
     def filter_scraped_titles(self, event=None): # event=None for initial call
-        search_term = self.online_title_search_var.get().lower()
+        self.title_filter_job = None
+        search_term = self.online_title_search_var.get()
         self.matched_online_titles_listbox.delete(0, tk.END)
         
         if not self.all_scraped_titles:
             return
 
-        if not search_term:
+        if not search_term.strip():
             # If search is empty, show all scraped titles
-            for title in self.all_scraped_titles:
-                self.matched_online_titles_listbox.insert(tk.END, title)
+            self.matched_online_titles_listbox.insert(tk.END, *self.all_scraped_titles)
         else:
-            # Use difflib for fuzzy matching
-            # get_close_matches returns a list of best matches
-            # You might want to adjust n (max number of matches) and cutoff (similarity threshold 0.0 to 1.0)
-            matches = get_close_matches(search_term, self.all_scraped_titles, n=len(self.all_scraped_titles), cutoff=0.3) # Adjust cutoff as needed
-            # Alternative: simple substring matching
-            # matches = [title for title in self.all_scraped_titles if search_term in title.lower()]
-            for match in matches:
-                self.matched_online_titles_listbox.insert(tk.END, match)
+            # Ranked fuzzy matches from the bigram index, best first
+            if self.title_index is None:
+                self.title_index = TitleIndex(self.all_scraped_titles)
+            matches = [title for _, title in self.title_index.search(search_term)]
+            if matches:
+                self.matched_online_titles_listbox.insert(tk.END, *matches)
         self._update_rename_button_state()
 
     def _update_rename_button_state(self, event=None):
@@ -846,14 +1226,7 @@ class VideoMergerApp:
         folder = self.rename_folder_var.get()
         original_filepath = os.path.join(folder, original_filename)
         _, ext = os.path.splitext(original_filename)
-
-        # Sanitize the online title to be a valid filename
-        # Replace invalid characters, trim whitespace, etc.
-        # This is a basic sanitization, might need to be more robust
-        sanitized_title = "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in selected_online_title).strip()
-        if not sanitized_title: # if title becomes empty after sanitization
-            sanitized_title = "renamed_video"
-        new_filename = f"{sanitized_title}{ext}"
+        new_filename = self._title_to_filename(selected_online_title, ext)
         new_filepath = os.path.join(folder, new_filename)
 
         if original_filepath == new_filepath:
@@ -866,6 +1239,7 @@ class VideoMergerApp:
 
         try:
             os.rename(original_filepath, new_filepath)
+            self.folder_listing.invalidate(folder)
             messagebox.showinfo("成功", f"文件 '{original_filename}' 已重命名为 '{new_filename}'.", parent=self.rename_window_ref)
             # Refresh the local files list and clear selections
             self._load_local_video_files(folder)
@@ -876,111 +1250,78 @@ class VideoMergerApp:
         except OSError as e:
             messagebox.showerror("重命名错误", f"无法重命名 '{original_filename}' 为 '{new_filename}':\n{e}", parent=self.rename_window_ref)
 
+    def _title_to_filename(self, title, ext):
+        # Sanitize the online title to be a valid filename
+        # Replace invalid characters, trim whitespace, etc.
+        # This is a basic sanitization, might need to be more robust
+        sanitized_title = "".join(c if c.isalnum() or c in (' ', '_', '-') else '_' for c in title).strip()
+        if not sanitized_title: # if title becomes empty after sanitization
+            sanitized_title = "renamed_video"
+        return f"{sanitized_title}{ext}"
 
-        subfolders_to_process = []
-        for item in os.listdir(input_dir):
-            item_path = os.path.join(input_dir, item)
-            if os.path.isdir(item_path):
-                # Check for .m3u8 file in the subfolder
-                m3u8_files = [f for f in os.listdir(item_path) if f.endswith(".m3u8")]
-                if m3u8_files:
-                    subfolders_to_process.append((item, item_path, m3u8_files[0])) # (folder_name, full_path, m3u8_filename)
-        
-        if not subfolders_to_process:
-            self.root.after(0, lambda: messagebox.showinfo("提示", "输入文件夹中未找到包含 .m3u8 文件的子文件夹。"))
-            self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-            self.root.after(0, lambda: self.progress_label_var.set("状态: 空闲"))
-            return
-
-        total_folders = len(subfolders_to_process)
-        self.progress_bar["maximum"] = total_folders
-
-        for i, (folder_name, folder_path, m3u8_file) in enumerate(subfolders_to_process):
-            self.root.after(0, lambda: self.progress_label_var.set(f"状态: 正在处理 {folder_name} ({i+1}/{total_folders})"))
-            m3u8_path = os.path.join(folder_path, m3u8_file)
-            output_filename = f"{folder_name}.mp4" # This is the base name for messages and default output
-            output_filepath = os.path.join(output_dir, output_filename)
-            
-            # --- Duplicate Output Detection ---
-            if os.path.exists(output_filepath):
-                # Ask user: Overwrite, Skip, or Cancel
-                # Schedule the dialog in the main thread and wait for the response via the queue
-                self.root.after(0, lambda name_disp=output_filename, q=self.dialog_queue: self.ask_user_for_overwrite(name_disp, q))
-                
-                action = self.dialog_queue.get() # Worker thread blocks here
-
-                if action == 'yes': # Overwrite
-                    self.root.after(0, lambda op=output_filepath, ip=folder_path: self.log_history(ip, op, "准备覆盖"))
-                    # FFmpeg command uses -y, so it will overwrite.
-                elif action == 'no': # Skip
-                    self.root.after(0, lambda op=output_filepath, ip=folder_path: self.log_history(ip, op, "已跳过 (文件已存在)"))
-                    self.root.after(0, lambda val=i+1: self.progress_bar.config(value=val))
-                    self.root.after(0, lambda fn=folder_name: self.progress_label_var.set(f"状态: 已跳过 {fn}"))
-                    continue # Skip to the next video in the loop
-                elif action == 'cancel': # Cancel all or dialog closed with 'X'
-                    self.root.after(0, lambda ip=folder_path: self.log_history(ip, "N/A", "用户取消操作"))
-                    self.root.after(0, lambda: self.progress_label_var.set("状态: 用户取消操作"))
-                    self.root.after(0, lambda: messagebox.showinfo("取消", "所有后续转换已取消。", parent=self.root))
-                    self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-                    self.root.after(0, lambda: self.progress_bar.config(value=0))
-                    return # Exit the process_videos method
-                else: # Should ideally not happen with YESNOCANCEL if 'X' is treated as 'cancel'
-                      # If it somehow returns something else (e.g. None), treat as skip to be safe.
-                    self.root.after(0, lambda op=output_filepath, ip=folder_path: self.log_history(ip, op, "已跳过 (对话框响应未知)"))
-                    self.root.after(0, lambda val=i+1: self.progress_bar.config(value=val))
-                    self.root.after(0, lambda fn=folder_name: self.progress_label_var.set(f"状态: 已跳过 {fn} (对话框响应未知)"))
-                    continue # Skip to the next video
-            
-            # If not skipping or cancelling, or if file didn't exist, proceed.
-            # The old auto-renaming logic is now removed.
-
-            # FFmpeg command
-            command = [
-                self.ffmpeg_path,
-                '-protocol_whitelist', 'file,http,https,tcp,tls,crypto,pipe',
-                '-i', m3u8_path,
-                '-c', 'copy', # Fast remuxing, assumes TS segments are compatible with MP4
-                '-bsf:a', 'aac_adtstoasc', # Necessary for some AAC streams in TS to MP4
-                '-y', # Overwrite output file without asking
-                output_filepath
-            ]
+    def auto_assign_titles(self):
+        folder = self.rename_folder_var.get()
+        if not folder or not os.path.isdir(folder):
+            messagebox.showerror("错误", "请选择一个有效的文件夹。", parent=self.rename_window_ref)
+            return
+        titles = [title for title in self.all_scraped_titles if title != self.NO_TITLES_PLACEHOLDER]
+        if not titles:
+            messagebox.showwarning("提示", "请先抓取课程名称。", parent=self.rename_window_ref)
+            return
+        filenames = list(self.local_files_listbox.get(0, tk.END))
+        if not filenames:
+            messagebox.showwarning("提示", "所选文件夹中没有视频文件。", parent=self.rename_window_ref)
+            return
 
+        self.auto_assign_button.config(state=tk.DISABLED)
+        def run():
+            # Probing durations and solving the assignment take a moment for large courses
             try:
-                # For Windows, hide the console window
-                startupinfo = None
-                if os.name == 'nt':
-                    startupinfo = subprocess.STARTUPINFO()
-                    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    startupinfo.wShowWindow = subprocess.SW_HIDE
-                
-                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', startupinfo=startupinfo)
-                stdout, stderr = process.communicate()
-
-                if process.returncode == 0:
-                    status = "成功"
-                    self.root.after(0, lambda fp=output_filepath, s=status, ip=folder_path: self.log_history(ip, fp, s))
-                else:
-                    status = f"失败: {stderr.strip()}"
-                    self.root.after(0, lambda fp=output_filepath, s=status, ip=folder_path: self.log_history(ip, fp, s))
-                    self.root.after(0, lambda err=stderr.strip(), fn=folder_name: messagebox.showerror("转换错误", f"处理 {fn} 失败:\n{err}"))
-            
-            except FileNotFoundError:
-                status = "失败: FFmpeg 未找到"
-                self.root.after(0, lambda fp=output_filepath, s=status, ip=folder_path: self.log_history(ip, fp, s))
-                self.root.after(0, lambda: messagebox.showerror("错误", "FFmpeg 未找到。请确保已安装 FFmpeg 并将其添加至系统 PATH，或在脚本中指定其完整路径。"))
-                self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
-                self.root.after(0, lambda: self.progress_label_var.set("状态: FFmpeg错误"))
-                return # Stop processing if ffmpeg is not found
+                assignments, error = assign_titles(folder, filenames, titles), None
             except Exception as e:
-                status = f"失败: {str(e)}"
-                self.root.after(0, lambda fp=output_filepath, s=status, ip=folder_path: self.log_history(ip, fp, s))
-                self.root.after(0, lambda err=str(e), fn=folder_name: messagebox.showerror("未知错误", f"处理 {fn} 时发生未知错误:\n{err}"))
-
-            self.root.after(0, lambda val=i+1: self.progress_bar.config(value=val))
+                assignments, error = [], e
+            self.events.call(self._show_title_assignments, assignments, error)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _show_title_assignments(self, assignments, error):
+        if not self.rename_window_ref.winfo_exists():
+            return # Window closed while matching
+        self.auto_assign_button.config(state=tk.NORMAL)
+        if error is not None:
+            messagebox.showerror("匹配错误", f"自动匹配失败: {error}", parent=self.rename_window_ref)
+            return
 
-        self.root.after(0, lambda: self.progress_label_var.set("状态: 处理完成!"))
-        self.root.after(0, lambda: messagebox.showinfo("完成", "所有视频已处理完毕。"))
-        self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
+        self.rename_preview_generation += 1 # A rule preview still being computed must not replace this one
+        self.rule_preview_items = None
+        self.rename_preview_tree.delete(*self.rename_preview_tree.get_children())
+        used_names = set()
+        review_count = 0
+        for assignment in assignments:
+            if assignment.title is None:
+                # More files than titles: left as it is
+                self.rename_preview_tree.insert("", tk.END, values=(assignment.filename, assignment.filename, "未匹配"), tags=('low_confidence',))
+                review_count += 1
+                continue
+            _, ext = os.path.splitext(assignment.filename)
+            new_filename = self._title_to_filename(assignment.title, ext)
+            stem, number = new_filename[:len(new_filename) - len(ext)], 2
+            while new_filename.lower() in used_names: # Titles that sanitise to the same name
+                new_filename = f"{stem}_{number}{ext}"
+                number += 1
+            used_names.add(new_filename.lower())
+            tags = ()
+            if assignment.confidence < LOW_CONFIDENCE:
+                tags = ('low_confidence',)
+                review_count += 1
+            self.rename_preview_tree.insert("", tk.END, values=(assignment.filename, new_filename, f"{assignment.confidence:.0%}"), tags=tags)
+        self.rename_preview_frame.config(
+            text=f"自动匹配预览: {len(assignments)} 个文件，{review_count} 个需核对 (红色) - Delete 键移除不需要的行，确认后点击 应用重命名")
+
+    def _remove_selected_preview_rows(self, event=None):
+        for item_id in self.rename_preview_tree.selection():
+            if self.rule_preview_items is not None:
+                self.rule_preview_items.pop(self.rename_preview_tree.item(item_id, 'values')[0], None)
+            self.rename_preview_tree.delete(item_id)
 
 if __name__ == "__main__":
     root = tk.Tk()